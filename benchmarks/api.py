@@ -0,0 +1,310 @@
+"""
+Benchmark suite for the API endpoints.
+
+Sends a fixed, seeded mix of realistic requests to every route (term and preterm children, all four measurement
+methods, all references, standard and custom centiles), then reports latency percentiles (p50/p95/p99) and
+requests per second for each scenario. Results are written as JSON, and can be compared against a saved baseline:
+any scenario whose p50 or p95 latency grows, or whose requests per second falls, by more than the threshold
+is reported as a regression and the run exits with status 1.
+
+By default requests are made in-process, through the ASGI app (with its lifespan), one at a time.
+With `--url`, a running server is benchmarked instead, with `--concurrency` requests in flight.
+
+usage:
+    python benchmarks/api.py                                   # run and write benchmarks/results/<timestamp>.json
+    python benchmarks/api.py --save-baseline                   # also save the results as benchmarks/baseline.json
+    python benchmarks/api.py --baseline benchmarks/baseline.json --threshold 0.2
+    python benchmarks/api.py --url http://localhost:8000 --concurrency 8 --scenarios uk-who-calculation
+"""
+# standard imports
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# third party imports
+import httpx
+import numpy as np
+
+# local / rcpch imports
+from rcpchgrowth import constants, measurement_from_sds
+from services.lms_engine import reference_age_limits
+
+RESULTS_DIRECTORY = ROOT / 'benchmarks' / 'results'
+DEFAULT_BASELINE = ROOT / 'benchmarks' / 'baseline.json'
+
+ROUTER_PREFIXES = {
+    constants.UK_WHO: 'uk-who',
+    constants.TURNERS: 'turner',
+    constants.TRISOMY_21: 'trisomy-21',
+}
+
+# typical observations, used where the reference cannot give one for the age
+MEASUREMENT_RANGES = {
+    constants.HEIGHT: (45, 180),
+    constants.WEIGHT: (2.5, 80),
+    constants.HEAD_CIRCUMFERENCE: (33, 58),
+    constants.BMI: (12, 28),
+}
+
+
+class PayloadGenerator:
+    """Seeded generator of realistic request bodies"""
+
+    def __init__(self, seed: int):
+        self.random = np.random.default_rng(seed)
+
+    def choice(self, options: list):
+        return options[int(self.random.integers(len(options)))]
+
+    def sex_and_method(self, reference: str) -> tuple:
+        if reference == constants.TURNERS:
+            return constants.FEMALE, constants.HEIGHT
+        return self.choice(constants.SEXES), self.choice(constants.MEASUREMENT_METHODS)
+
+    def measurement(self, reference: str) -> dict:
+        """A measurement request: one child in four preterm, with a plausible observation for their age"""
+        sex, measurement_method = self.sex_and_method(reference)
+        preterm = self.random.random() < 0.25
+        gestation_weeks = int(self.random.integers(25, 37)) if preterm else int(self.random.integers(37, 43))
+        lowest, highest = reference_age_limits(reference, sex, measurement_method)
+        # ages are kept clear of the ends of the reference, so gestational age correction stays within it
+        age = float(self.random.uniform(max(lowest, 0.0) + 0.25, highest - 0.25))
+        try:
+            observation_value = measurement_from_sds(
+                reference=reference,
+                requested_sds=float(self.random.normal(0, 1.2)),
+                measurement_method=measurement_method,
+                sex=sex,
+                age=age)
+        except Exception:
+            observation_value = float(self.random.uniform(*MEASUREMENT_RANGES[measurement_method]))
+        birth_date = date(2010, 1, 1) + timedelta(days=int(self.random.integers(0, 3650)))
+        return {
+            "birth_date": birth_date.isoformat(),
+            "observation_date": (birth_date + timedelta(days=round(age * 365.25))).isoformat(),
+            "observation_value": round(float(observation_value), 2),
+            "sex": sex,
+            "gestation_weeks": gestation_weeks,
+            "gestation_days": int(self.random.integers(0, 7)),
+            "measurement_method": measurement_method,
+        }
+
+    def bulk(self, reference: str, size: int) -> dict:
+        measurements = [self.sex_and_method(reference) for _ in range(size)]
+        return {
+            "decimal_ages": self.random.uniform(0.0, 18.0, size).round(4).tolist(),
+            "sexes": [sex for sex, _ in measurements],
+            "measurement_methods": [measurement_method for _, measurement_method in measurements],
+            "observation_values": [
+                round(float(self.random.uniform(*MEASUREMENT_RANGES[measurement_method])), 2) for _, measurement_method in measurements
+            ],
+        }
+
+    def standard_chart(self, reference: str) -> dict:
+        sex, measurement_method = self.sex_and_method(reference)
+        return {"sex": sex, "measurement_method": measurement_method, "centile_format": self.choice([constants.COLE_TWO_THIRDS_SDS_NINE_CENTILES, constants.THREE_PERCENT_CENTILES])}
+
+    def custom_chart(self, reference: str) -> dict:
+        sex, measurement_method = self.sex_and_method(reference)
+        # a small pool of centile lists, so that both cache misses and cache hits are measured
+        centiles = self.choice([[2, 50, 98], [5, 25, 50, 75, 95], [0.4, 9, 50, 91, 99.6], [float(self.random.integers(1, 99))]])
+        return {"sex": sex, "measurement_method": measurement_method, "centile_format": centiles}
+
+    def fictional_child(self, reference: str) -> dict:
+        sex, measurement_method = self.sex_and_method(reference)
+        return {
+            "measurement_method": measurement_method,
+            "sex": sex,
+            "start_chronological_age": 1.0 if reference == constants.TURNERS else 0.0,
+            "end_age": float(self.random.integers(2, 18)),
+            "gestation_weeks": 40,
+            "gestation_days": 0,
+            "measurement_interval_type": "months",
+            "measurement_interval_number": 3,
+            "start_sds": round(float(self.random.normal(0, 1)), 2),
+            "drift": bool(self.random.random() < 0.5),
+            "drift_range": -0.05,
+            "noise": bool(self.random.random() < 0.5),
+            "noise_range": 0.005,
+            "reference": reference,
+        }
+
+    def mid_parental_height(self) -> dict:
+        return {
+            "height_paternal": round(float(self.random.normal(178, 7)), 1),
+            "height_maternal": round(float(self.random.normal(164, 7)), 1),
+            "sex": self.choice(constants.SEXES),
+        }
+
+
+def scenarios(requests: int, seed: int) -> dict:
+    """
+    Returns {scenario name: (method, path, [request kwargs])} for every route.
+    Requests are generated up front from the seed, so every run sends the same requests.
+    """
+    generator = PayloadGenerator(seed)
+    batch_size = 20
+    stream_size = 100
+    scenario_requests = {}
+    for reference, prefix in ROUTER_PREFIXES.items():
+        scenario_requests[f'{prefix}-calculation'] = ('POST', f'/{prefix}/calculation', [
+            {"json": generator.measurement(reference)} for _ in range(requests)])
+        scenario_requests[f'{prefix}-calculations'] = ('POST', f'/{prefix}/calculations', [
+            {"json": [generator.measurement(reference) for _ in range(batch_size)]} for _ in range(max(requests // 10, 1))])
+        scenario_requests[f'{prefix}-calculations-stream'] = ('POST', f'/{prefix}/calculations/stream', [
+            {
+                "content": '\n'.join(json.dumps(generator.measurement(reference)) for _ in range(stream_size)),
+                "headers": {"Content-Type": "application/x-ndjson"},
+            } for _ in range(max(requests // 20, 1))])
+        scenario_requests[f'{prefix}-bulk-calculation'] = ('POST', f'/{prefix}/bulk-calculation', [
+            {"json": generator.bulk(reference, 10_000)} for _ in range(max(requests // 20, 1))])
+        scenario_requests[f'{prefix}-chart-coordinates'] = ('POST', f'/{prefix}/chart-coordinates', [
+            {"json": generator.standard_chart(reference)} for _ in range(requests)])
+        scenario_requests[f'{prefix}-chart-coordinates-custom'] = ('POST', f'/{prefix}/chart-coordinates', [
+            {"json": generator.custom_chart(reference)} for _ in range(max(requests // 5, 1))])
+        scenario_requests[f'{prefix}-fictional-child-data'] = ('POST', f'/{prefix}/fictional-child-data', [
+            {"json": generator.fictional_child(reference)} for _ in range(max(requests // 10, 1))])
+    scenario_requests['utilities-mid-parental-height'] = ('POST', '/utilities/mid-parental-height', [
+        {"json": generator.mid_parental_height()} for _ in range(requests)])
+    scenario_requests['openapi'] = ('GET', '/', [{} for _ in range(max(requests // 10, 1))])
+    return scenario_requests
+
+
+def timed_request(client: httpx.Client, method: str, path: str, kwargs: dict) -> tuple:
+    started = time.perf_counter()
+    try:
+        response = client.request(method, path, **kwargs)
+        # read the whole body (streamed responses included) before stopping the clock
+        response.read()
+        status_code = response.status_code
+    except httpx.HTTPError:
+        status_code = 0
+    return time.perf_counter() - started, status_code
+
+
+def run_scenario(client: httpx.Client, method: str, path: str, requests: list, concurrency: int, warmup: int) -> dict:
+    for kwargs in requests[:warmup]:
+        timed_request(client, method, path, kwargs)
+
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            timings = list(pool.map(lambda kwargs: timed_request(client, method, path, kwargs), requests))
+    else:
+        timings = [timed_request(client, method, path, kwargs) for kwargs in requests]
+    elapsed = time.perf_counter() - started
+
+    latencies = np.array([latency for latency, _ in timings]) * 1000
+    status_codes = {}
+    for _, status_code in timings:
+        status_codes[str(status_code)] = status_codes.get(str(status_code), 0) + 1
+    return {
+        "requests": len(requests),
+        "errors": sum(count for status_code, count in status_codes.items() if not status_code.startswith(('2', '3'))),
+        "status_codes": status_codes,
+        "mean_ms": round(float(latencies.mean()), 3),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+        "requests_per_second": round(len(requests) / elapsed, 2),
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Returns a description of each regression beyond the threshold against the baseline"""
+    regressions = []
+    for name, result in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if previous is None:
+            continue
+        for metric in ('p50_ms', 'p95_ms'):
+            if previous[metric] > 0 and result[metric] > previous[metric] * (1 + threshold):
+                regressions.append(f'{name}: {metric} {previous[metric]:.2f} -> {result[metric]:.2f}')
+        if result['requests_per_second'] < previous['requests_per_second'] * (1 - threshold):
+            regressions.append(f'{name}: requests_per_second {previous["requests_per_second"]:.1f} -> {result["requests_per_second"]:.1f}')
+    return regressions
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ''
+
+
+def main(arguments=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--url', help="benchmark a running server, rather than the app in-process")
+    parser.add_argument('--requests', type=int, default=200, help="requests per scenario (fewer for the heavier scenarios)")
+    parser.add_argument('--concurrency', type=int, default=1, help="requests in flight at once (with --url)")
+    parser.add_argument('--warmup', type=int, default=5, help="requests sent, and not timed, before each scenario")
+    parser.add_argument('--seed', type=int, default=14)
+    parser.add_argument('--scenarios', nargs='+', help="only run the named scenarios")
+    parser.add_argument('--output', type=Path, help="where to write the results (default benchmarks/results/<timestamp>.json)")
+    parser.add_argument('--baseline', type=Path, help="results to compare against")
+    parser.add_argument('--threshold', type=float, default=0.2, help="allowed fractional regression against the baseline")
+    parser.add_argument('--save-baseline', action='store_true', help=f"also save the results as {DEFAULT_BASELINE.relative_to(ROOT)}")
+    arguments = parser.parse_args(arguments)
+
+    all_scenarios = scenarios(arguments.requests, arguments.seed)
+    selected = {name: all_scenarios[name] for name in (arguments.scenarios or all_scenarios)}
+
+    if arguments.url:
+        client = httpx.Client(base_url=arguments.url, timeout=120)
+        concurrency = arguments.concurrency
+    else:
+        from fastapi.testclient import TestClient
+        from main import app
+        client = TestClient(app, raise_server_exceptions=False)
+        concurrency = 1
+
+    results = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "target": arguments.url or "in-process",
+            "concurrency": concurrency,
+            "seed": arguments.seed,
+        },
+        "scenarios": {},
+    }
+
+    print(f'{"scenario":<40} {"requests":>8} {"errors":>6} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"req/s":>9}')
+    with client:
+        for name, (method, path, requests) in selected.items():
+            result = run_scenario(client, method, path, requests, concurrency, arguments.warmup)
+            results['scenarios'][name] = result
+            print(f'{name:<40} {result["requests"]:>8} {result["errors"]:>6} {result["p50_ms"]:>9.2f} {result["p95_ms"]:>9.2f} {result["p99_ms"]:>9.2f} {result["requests_per_second"]:>9.1f}')
+
+    output = arguments.output or RESULTS_DIRECTORY / f'{results["meta"]["timestamp"].replace(":", "")}.json'
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=4))
+    print(f'Results written to {output}')
+    if arguments.save_baseline:
+        DEFAULT_BASELINE.write_text(json.dumps(results, indent=4))
+        print(f'Baseline saved to {DEFAULT_BASELINE}')
+
+    if arguments.baseline:
+        regressions = compare(results, json.loads(arguments.baseline.read_text()), arguments.threshold)
+        if regressions:
+            print(f'Regressions of more than {arguments.threshold:.0%} against {arguments.baseline}:')
+            for regression in regressions:
+                print(f'  {regression}')
+            return 1
+        print(f'No regressions of more than {arguments.threshold:.0%} against {arguments.baseline}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+"""
+Benchmark of response compression on every standard chart coordinates response in `chart-data/`.
+
+For each data set, reports the bytes on the wire and the CPU time to compress (and to decompress, as a client would)
+with each coding at the levels the server uses: `dynamic` (responses compressed as they are sent, by the compression
+middleware), `prepared` (chart responses compressed on first request) and `build` (`python build.py --compressed`).
+
+usage: `python benchmarks/compression.py [--repeat 5]`
+"""
+# standard imports
+import argparse
+import gzip
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# local / rcpch imports
+from services.chart_responses import prepare_chart_response
+from services.chart_store import CHART_DATA_DIRECTORY, chart_data_name, standard_chart_data_parameters
+from services.compression import BROTLI, DYNAMIC_BROTLI_QUALITY, DYNAMIC_GZIP_LEVEL, GZIP, brotli
+
+
+def levels() -> list:
+    """(coding, label, compress, decompress) for each coding and level the server uses"""
+    gzip_levels = [
+        (GZIP, 'dynamic', lambda body: gzip.compress(body, compresslevel=DYNAMIC_GZIP_LEVEL, mtime=0), gzip.decompress),
+        (GZIP, 'prepared', lambda body: gzip.compress(body, compresslevel=9, mtime=0), gzip.decompress),
+    ]
+    if brotli is None:
+        return gzip_levels
+    return gzip_levels + [
+        (BROTLI, 'dynamic', lambda body: brotli.compress(body, quality=DYNAMIC_BROTLI_QUALITY), brotli.decompress),
+        (BROTLI, 'prepared', lambda body: brotli.compress(body, quality=9), brotli.decompress),
+        (BROTLI, 'build', lambda body: brotli.compress(body, quality=11), brotli.decompress),
+    ]
+
+
+def fastest(function, argument, repeat: int) -> tuple:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function(argument)
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--repeat', type=int, default=5, help="compressions of each response; the fastest is reported")
+    arguments = parser.parse_args(arguments)
+
+    codings = levels()
+    totals = {(coding, label): [0, 0.0, 0.0] for coding, label, _, _ in codings}
+    identity_total = 0
+    print(f'{"chart data":<58} {"coding":>6} {"level":>8} {"bytes":>10} {"ratio":>6} {"compress ms":>12} {"decompress ms":>14}')
+    for parameters in standard_chart_data_parameters():
+        name = chart_data_name(*parameters)
+        path = CHART_DATA_DIRECTORY / f'{name}.json'
+        if not path.exists():
+            continue
+        body = prepare_chart_response(json.loads(path.read_text())).body
+        identity_total += len(body)
+        print(f'{name:<58} {"-":>6} {"-":>8} {len(body):>10,} {1:>6.2f}')
+        for coding, label, compress, decompress in codings:
+            compress_seconds, compressed = fastest(compress, body, arguments.repeat)
+            decompress_seconds, _ = fastest(decompress, compressed, arguments.repeat)
+            total = totals[(coding, label)]
+            total[0] += len(compressed)
+            total[1] += compress_seconds
+            total[2] += decompress_seconds
+            print(f'{"":<58} {coding:>6} {label:>8} {len(compressed):>10,} {len(body) / len(compressed):>6.2f} '
+                  f'{compress_seconds * 1000:>12.2f} {decompress_seconds * 1000:>14.2f}')
+
+    print(f'{"all chart data":<58} {"-":>6} {"-":>8} {identity_total:>10,} {1:>6.2f}')
+    for (coding, label), (size, compress_seconds, decompress_seconds) in totals.items():
+        print(f'{"":<58} {coding:>6} {label:>8} {size:>10,} {identity_total / max(size, 1):>6.2f} '
+              f'{compress_seconds * 1000:>12.2f} {decompress_seconds * 1000:>14.2f}')
+
+
+if __name__ == '__main__':
+    main()
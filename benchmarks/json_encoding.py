@@ -0,0 +1,53 @@
+"""
+Benchmark of the JSON encoders on the largest responses: the standard chart coordinates in `chart-data/`.
+
+For each of the largest chart data files, times encoding the `Centile_Data` response with each available encoder,
+at full float precision and at fewer decimal places, and reports the payload size (plain and gzipped).
+
+usage: `python benchmarks/json_encoding.py [--files 3] [--repeat 20]`
+"""
+# standard imports
+import argparse
+import gzip
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# local / rcpch imports
+from services.chart_responses import centile_data_content
+from services.chart_store import CHART_DATA_DIRECTORY
+from services.json_encoding import ENCODERS, render_json
+
+
+def time_encoding(content, encoder: str, float_decimals, repeat: int) -> tuple:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = render_json(content, encoder=encoder, float_decimals=float_decimals)
+        timings.append(time.perf_counter() - started)
+    return min(timings), body
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--files', type=int, default=3, help="number of chart data files, largest first")
+    parser.add_argument('--repeat', type=int, default=20, help="encodings of each file; the fastest is reported")
+    parser.add_argument('--decimals', type=int, nargs='*', default=[3, 2], help="float precisions to compare with full precision")
+    arguments = parser.parse_args(arguments)
+
+    files = sorted(CHART_DATA_DIRECTORY.glob('*.json'), key=lambda path: path.stat().st_size, reverse=True)[:arguments.files]
+    print(f'{"chart data":<50} {"encoder":>8} {"decimals":>8} {"encode ms":>10} {"bytes":>10} {"gzip bytes":>11}')
+    for path in files:
+        content = centile_data_content(json.loads(path.read_text()))
+        for encoder in sorted(ENCODERS):
+            for float_decimals in [None] + arguments.decimals:
+                seconds, body = time_encoding(content, encoder, float_decimals, arguments.repeat)
+                print(f'{path.stem:<50} {encoder:>8} {float_decimals if float_decimals is not None else "full":>8} '
+                      f'{seconds * 1000:>10.2f} {len(body):>10,} {len(gzip.compress(body, compresslevel=6)):>11,}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Microbenchmark of LMS lookup: rcpchgrowth's `fetch_lms` (a linear search of the reference data, and scipy for
+linear interpolation) against the indexed LMS tables (a binary search and precomputed interpolation coefficients).
+
+Times single lookups at random ages, whole `Measurement` calculations (as the calculation endpoints make),
+and a custom `create_chart`, with and without the index.
+
+usage: `python benchmarks/lms_lookup.py [--lookups 20000] [--measurements 500]`
+"""
+# standard imports
+import argparse
+import sys
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# third party imports
+import numpy as np
+
+# local / rcpch imports
+from rcpchgrowth import Measurement, constants, create_chart, global_functions
+from rcpchgrowth.uk_who import uk_who_lms_array_for_measurement_and_sex
+from services import lms_engine
+
+
+def time_lookups(ages: list, lms_array: list) -> float:
+    started = time.perf_counter()
+    for age in ages:
+        global_functions.fetch_lms(age=age, lms_value_array_for_measurement=lms_array)
+    return time.perf_counter() - started
+
+
+def time_measurements(observations: list) -> float:
+    started = time.perf_counter()
+    for birth_date, observation_date, observation_value in observations:
+        Measurement(
+            reference=constants.UK_WHO,
+            birth_date=birth_date,
+            observation_date=observation_date,
+            measurement_method=constants.HEIGHT,
+            observation_value=observation_value,
+            sex=constants.FEMALE,
+            gestation_weeks=40,
+            gestation_days=0
+        )
+    return time.perf_counter() - started
+
+
+def time_chart() -> float:
+    started = time.perf_counter()
+    create_chart(constants.UK_WHO, [5, 50, 95], measurement_method=constants.WEIGHT, sex=constants.MALE)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--lookups', type=int, default=20000)
+    parser.add_argument('--measurements', type=int, default=500)
+    arguments = parser.parse_args()
+
+    random = np.random.default_rng(seed=13)
+    lms_array = uk_who_lms_array_for_measurement_and_sex(age=10.0, measurement_method=constants.HEIGHT, sex=constants.FEMALE)
+    ages = random.uniform(4.0, 20.0, arguments.lookups).tolist()
+    birth_date = date(2004, 1, 1)
+    observations = [
+        (birth_date, birth_date + timedelta(days=int(days)), float(value))
+        for days in random.integers(30, 365 * 18, arguments.measurements)
+        for value in random.uniform(60, 170, 1)
+    ]
+
+    results = {}
+    for label in ('rcpchgrowth', 'indexed'):
+        if label == 'indexed':
+            lms_engine.install_lms_index()
+        results[label] = (time_lookups(ages, lms_array), time_measurements(observations), time_chart())
+
+    print(f'{"":<24} {"rcpchgrowth":>12} {"indexed":>12} {"speed-up":>9}')
+    rows = [
+        ('LMS lookup (us)', 1e6 / arguments.lookups, 0),
+        ('Measurement (ms)', 1e3 / arguments.measurements, 1),
+        ('custom chart (ms)', 1e3, 2),
+    ]
+    for name, scale, column in rows:
+        before, after = results['rcpchgrowth'][column] * scale, results['indexed'][column] * scale
+        print(f'{name:<24} {before:>12.2f} {after:>12.2f} {before / after:>8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Measures the memory held by each server worker for each chart data format.
+
+Starts the server with several workers for each `CHART_DATA_FORMAT`, requests every standard chart
+(plain and gzip-encoded) so that every worker has served chart data, then reports each worker's
+RSS (resident memory, counting shared pages in full) and PSS (shared pages divided between the processes mapping them).
+PSS is the fairer measure of what an extra worker costs. Linux only, as it reads /proc.
+
+usage: `python benchmarks/worker_memory.py [--workers 4] [--formats json binary mmap]`
+(run `python build.py --binary --shared` first)
+"""
+# standard imports
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# local / rcpch imports
+from rcpchgrowth import constants
+from services.chart_store import standard_chart_data_parameters
+
+ROUTER_PREFIXES = {
+    constants.UK_WHO: 'uk-who',
+    constants.TURNERS: 'turner',
+    constants.TRISOMY_21: 'trisomy-21',
+}
+
+
+def post(url: str, body: dict, headers: dict = None) -> int:
+    request = urllib.request.Request(
+        url, data=json.dumps(body).encode('utf-8'), method='POST',
+        headers={'Content-Type': 'application/json', 'Connection': 'close', **(headers or {})})
+    with urllib.request.urlopen(request) as response:
+        return len(response.read())
+
+
+def wait_until_ready(url: str, timeout: float = 60.0):
+    started = time.monotonic()
+    while time.monotonic() - started < timeout:
+        try:
+            with urllib.request.urlopen(url):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise TimeoutError(f'Server at {url} did not start')
+
+
+def child_pids(pid: int) -> list:
+    children = []
+    for task in Path(f'/proc/{pid}/task').iterdir():
+        children.extend(int(child) for child in (task / 'children').read_text().split())
+    return children
+
+
+def memory_kb(pid: int) -> dict:
+    """Returns the Rss and Pss of a process in kB, from /proc/<pid>/smaps_rollup"""
+    values = {}
+    for line in Path(f'/proc/{pid}/smaps_rollup').read_text().splitlines():
+        key, _, value = line.partition(':')
+        if key in ('Rss', 'Pss'):
+            values[key] = int(value.split()[0])
+    return values
+
+
+def measure(data_format: str, workers: int, port: int, repeats: int) -> list:
+    environment = {**os.environ, 'CHART_DATA_FORMAT': data_format}
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--workers', str(workers), '--port', str(port), '--log-level', 'warning'],
+        cwd=ROOT, env=environment, stdout=subprocess.DEVNULL)
+    try:
+        wait_until_ready(f'http://127.0.0.1:{port}/redoc')
+        # new connections are spread across the workers, so every worker serves every chart
+        for _ in range(repeats):
+            for centile_format, reference, sex, measurement_method in standard_chart_data_parameters():
+                body = {"sex": sex, "measurement_method": measurement_method, "centile_format": centile_format}
+                url = f'http://127.0.0.1:{port}/{ROUTER_PREFIXES[reference]}/chart-coordinates'
+                post(url, body)
+                post(url, body, headers={'Accept-Encoding': 'gzip'})
+        return [memory_kb(pid) for pid in child_pids(server.pid) if Path(f'/proc/{pid}/smaps_rollup').exists()]
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--formats', nargs='+', default=['json', 'binary', 'mmap'])
+    parser.add_argument('--port', type=int, default=8123)
+    parser.add_argument('--repeats', type=int, default=3)
+    arguments = parser.parse_args()
+
+    print(f'{"format":<8} {"worker":>6} {"RSS MB":>8} {"PSS MB":>8}')
+    for data_format in arguments.formats:
+        results = measure(data_format, arguments.workers, arguments.port, arguments.repeats)
+        for worker, result in enumerate(results):
+            print(f'{data_format:<8} {worker:>6} {result["Rss"] / 1024:>8.1f} {result["Pss"] / 1024:>8.1f}')
+        total_pss = sum(result['Pss'] for result in results) / 1024
+        print(f'{data_format:<8} {"total":>6} {"":>8} {total_pss:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
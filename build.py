@@ -0,0 +1,171 @@
+"""
+Builds the assets the server loads at startup:
+* the chart plotting data for the centile background curves, in `chart-data/`
+* the openAPI3 spec, in `openapi.json`
+* optionally, packed binary copies of the chart data (`chart-data/*.bin`)
+* optionally, the memory-mapped shared chart store (`chart-data/chart-store.bin`)
+* optionally, precompressed chart coordinate responses (`chart-data/*.json.br` and `chart-data/*.json.gz`)
+
+usage: `python build.py [--force] [--binary] [--shared] [--compressed] [--check]`
+"""
+# standard imports
+import argparse
+import json
+import sys
+from pathlib import Path
+
+# local / rcpch imports
+from rcpchgrowth import chart_functions
+from services.chart_binary import pack_chart_data
+from services.chart_responses import prepare_chart_response
+from services.chart_store import CHART_DATA_DIRECTORY, chart_data_name, standard_chart_data_parameters
+from services.compression import FILE_EXTENSIONS, available_encodings, precompress, precompressed_path
+from services.shared_chart_store import SHARED_CHART_STORE_NAME, write_shared_chart_store
+
+OPENAPI_FILE = Path(__file__).resolve().parent / 'openapi.json'
+
+
+# Generate and store the chart plotting data for the centile background curves.
+# This data is only generated once and then is stored and served from file.
+def generate_and_store_chart_data(force: bool = False) -> list:
+    """
+    Creates every missing chart data file (or every file if `force` is set).
+    Returns the names of the data sets that could not be created.
+    """
+    failed = []
+    for centile_format, reference, sex, measurement_method in standard_chart_data_parameters():
+        name = chart_data_name(centile_format, reference, sex, measurement_method)
+        chart_data_file = CHART_DATA_DIRECTORY / f'{name}.json'
+        if chart_data_file.exists() and not force:
+            print(f'Chart data file exists for {name}.')
+            continue
+        print(f'Creating chart data file for {name}')
+        try:
+            chart_data = chart_functions.create_chart(
+                reference,
+                measurement_method=measurement_method,
+                sex=sex,
+                centile_format=centile_format
+            )
+            chart_data_file.write_text(json.dumps(chart_data, indent=4))
+            print(f'chart data file created for {name}')
+        except Exception as error:
+            print(f'Chart data not created due to: {error}')
+            failed.append(name)
+    return failed
+
+
+def convert_chart_data_to_binary(force: bool = False):
+    """
+    Writes a packed `.bin` copy of each chart data JSON file that does not have an up to date one.
+    """
+    for parameters in standard_chart_data_parameters():
+        name = chart_data_name(*parameters)
+        json_file = CHART_DATA_DIRECTORY / f'{name}.json'
+        binary_file = CHART_DATA_DIRECTORY / f'{name}.bin'
+        if not json_file.exists():
+            continue
+        if binary_file.exists() and binary_file.stat().st_mtime >= json_file.stat().st_mtime and not force:
+            continue
+        with open(json_file, 'r') as file:
+            packed = pack_chart_data(json.load(file))
+        binary_file.write_bytes(packed)
+        print(f'binary chart data file created for {name} ({json_file.stat().st_size:,} bytes to {len(packed):,} bytes)')
+
+
+def build_shared_chart_store():
+    """
+    Writes every chart data set, with its prepared responses, to one file for workers to map.
+    """
+    chart_data_sets = {}
+    for parameters in standard_chart_data_parameters():
+        name = chart_data_name(*parameters)
+        json_file = CHART_DATA_DIRECTORY / f'{name}.json'
+        if json_file.exists():
+            with open(json_file, 'r') as file:
+                chart_data_sets[name] = json.load(file)
+    path = CHART_DATA_DIRECTORY / SHARED_CHART_STORE_NAME
+    write_shared_chart_store(path, chart_data_sets)
+    print(f'shared chart store created with {len(chart_data_sets)} data sets ({path.stat().st_size:,} bytes)')
+
+
+def write_precompressed_chart_responses():
+    """
+    Writes each chart coordinates response compressed at the highest level, for the server to send without compressing it.
+    The files are named by the digest of the response, so are rewritten (and the old ones removed) only if the response changes.
+    """
+    for parameters in standard_chart_data_parameters():
+        name = chart_data_name(*parameters)
+        json_file = CHART_DATA_DIRECTORY / f'{name}.json'
+        if not json_file.exists():
+            continue
+        with open(json_file, 'r') as file:
+            prepared = prepare_chart_response(json.load(file))
+        for encoding in available_encodings():
+            path = precompressed_path(CHART_DATA_DIRECTORY, name, prepared.digest, encoding)
+            for old_path in CHART_DATA_DIRECTORY.glob(f'{name}.*.json.{FILE_EXTENSIONS[encoding]}'):
+                if old_path != path:
+                    old_path.unlink()
+            if path.exists():
+                continue
+            compressed = precompress(prepared.body, encoding)
+            path.write_bytes(compressed)
+            print(f'{encoding} chart coordinates created for {name} ({len(prepared.body):,} bytes to {len(compressed):,} bytes)')
+
+
+def missing_chart_data() -> list:
+    return [
+        chart_data_name(*parameters) for parameters in standard_chart_data_parameters()
+        if not (CHART_DATA_DIRECTORY / f'{chart_data_name(*parameters)}.json').exists()
+    ]
+
+
+# Saves openAPI3 spec to file in the project root.
+def write_apispec_to_file(check: bool = False) -> bool:
+    """
+    Writes openapi.json if it differs from the spec generated from the app.
+    With `check`, the file is left as it is. Returns True if the file is (or was) up to date.
+    """
+    from main import app
+
+    spec = json.dumps(app.openapi(), indent=4)
+    if OPENAPI_FILE.exists() and OPENAPI_FILE.read_text() == spec:
+        print("Generated internal openAPI3 spec and openapi.json have equal file content")
+        return True
+    if check:
+        print("openapi.json is out of date. Run `python build.py` to update it.")
+        return False
+    OPENAPI_FILE.write_text(spec)
+    print("openapi.json updated")
+    return False
+
+
+def main(arguments=None) -> int:
+    parser = argparse.ArgumentParser(description="Builds chart data and openapi.json for the RCPCH Digital Growth API")
+    parser.add_argument('--force', action='store_true', help="recreate every chart data file, even if it exists")
+    parser.add_argument('--binary', action='store_true', help="also write packed binary copies of the chart data")
+    parser.add_argument('--shared', action='store_true', help="also write the memory-mapped chart store shared by workers")
+    parser.add_argument('--compressed', action='store_true', help="also write precompressed chart coordinate responses")
+    parser.add_argument('--check', action='store_true', help="only report missing or out of date assets; exits 1 if any")
+    arguments = parser.parse_args(arguments)
+
+    if arguments.check:
+        missing = missing_chart_data()
+        if missing:
+            print(f'Chart data files missing: {", ".join(missing)}')
+        spec_up_to_date = write_apispec_to_file(check=True)
+        return 0 if spec_up_to_date and not missing else 1
+
+    failed = generate_and_store_chart_data(force=arguments.force)
+    if arguments.binary:
+        convert_chart_data_to_binary(force=arguments.force)
+    if arguments.shared:
+        build_shared_chart_store()
+    if arguments.compressed:
+        write_precompressed_chart_responses()
+    write_apispec_to_file()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,9 @@
+"""
+gunicorn settings, read by gunicorn from the working directory
+"""
+from services.metrics import mark_process_dead
+
+
+def child_exit(server, worker):
+    # the exited worker's live metric values are dropped from the values added up by /metrics
+    mark_process_dead(worker.pid)
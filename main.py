@@ -1,33 +1,59 @@
 # standard imports
-import json
-from pathlib import Path
+import time
+STARTUP_STARTED = time.perf_counter()
+from contextlib import asynccontextmanager
 import os
 
 # third party imports
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.exception_handlers import request_validation_exception_handler
+from fastapi.exceptions import RequestValidationError
 from fastapi.openapi.docs import get_swagger_ui_html, get_redoc_html
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.openapi.utils import get_openapi
-from pydantic_settings import BaseSettings, SettingsConfigDict
+from fastapi.responses import JSONResponse
 
 # local / rcpch imports
-from rcpchgrowth import chart_functions, constants
 from routers import trisomy_21, turners, uk_who, utilities
-
-class Settings(BaseSettings):
-    """this is a class for use of env files"""
-    model_config = SettingsConfigDict(
-        # `.env.prod` takes priority over `.env.local`. extra~ is for futur use
-        env_file=('.env.local', '.env.prod'), extra='ignore')
+from services import chart_store, settings
+from services.compression import CompressionMiddleware
+from services.executor import ServerBusy, shutdown_executors, start_executors
+from services.json_encoding import FastJSONResponse
+from services.lms_engine import install_lms_index
+from services.metrics import MetricsMiddleware, count_error, metrics_response
 
 version='4.2.18'  # this is set by bump version
 
+
+# Chart data and openapi.json are built ahead of time by `python build.py`.
+# Workers only load the prebuilt chart data, unless BUILD_ON_STARTUP is set.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    startup_began = time.perf_counter()
+    if settings.build_on_startup:
+        import build
+        build.generate_and_store_chart_data()
+        build.write_apispec_to_file()
+    if settings.preload_chart_data:
+        chart_store.load()
+    if settings.lms_index:
+        install_lms_index()
+    await start_executors()
+    started = time.perf_counter()
+    print(f'Worker {os.getpid()} started in {started - STARTUP_STARTED:.3f}s '
+          f'({startup_began - STARTUP_STARTED:.3f}s importing, {started - startup_began:.3f}s loading)')
+    yield
+    shutdown_executors()
+
+
 # Declare the FastAPI app
 app = FastAPI(
         title="RCPCH Digital Growth API",
         openapi_url="/",
         redoc_url=None,
+        lifespan=lifespan,
+        default_response_class=FastJSONResponse,
         license_info={
             "name": "GNU Affero General Public License",
             "url": "https://www.gnu.org/licenses/agpl-3.0.en.html"
@@ -44,6 +70,29 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# brotli or gzip compression of responses, as the client accepts
+if settings.compress_responses:
+    app.add_middleware(CompressionMiddleware, minimum_size=settings.compression_minimum_size)
+# request counts and latencies, served at /metrics
+app.add_middleware(MetricsMiddleware)
+
+
+# Expensive work is refused at once when the executors are saturated, rather than queued
+@app.exception_handler(ServerBusy)
+async def server_busy_handler(request: Request, exc: ServerBusy):
+    count_error(exc)
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "The server is busy. Please try again shortly."},
+        headers={"Retry-After": "1"}
+    )
+
+
+# Invalid requests are counted before the usual 422 response
+@app.exception_handler(RequestValidationError)
+async def validation_error_handler(request: Request, exc: RequestValidationError):
+    count_error(exc)
+    return await request_validation_exception_handler(request, exc)
 
 
 # Include routers for each type of endpoint.
@@ -81,54 +130,13 @@ def root():
     """
     return
 
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Prometheus metrics, added up across workers if `PROMETHEUS_MULTIPROC_DIR` is set"""
+    return metrics_response()
+
+
 @app.get("/redoc", include_in_schema=False)
 def overridden_redoc():
     """spec fo redoc"""
     return get_redoc_html(openapi_url="/", title="RCPCH Digital Growth API", redoc_favicon_url="/assets/favicon.ico")
-
-# Generate and store the chart plotting data for the centile background curves.
-# This data is only generated once and then is stored and served from file.
-def generate_and_store_chart_data():
-    for centile_format in [constants.COLE_TWO_THIRDS_SDS_NINE_CENTILES, constants.THREE_PERCENT_CENTILES]:
-        for reference in constants.REFERENCES:
-            for sex in constants.SEXES:
-                for measurement_method in constants.MEASUREMENT_METHODS:
-                    # Don't generate files for Turner's for references we don't have (males or non-height measurements)
-                    if reference == "turners-syndrome" and (sex != "female" or measurement_method != "height"):
-                        continue
-                    chart_data_file = Path(
-                        f'chart-data/{centile_format}-{reference}-{sex}-{measurement_method}.json')
-                    if chart_data_file.exists():
-                        print(f'Chart data file exists for {centile_format}-{reference}-{sex}-{measurement_method}.')
-                    else:
-                        print(f'Chart data file does not exist for {centile_format}-{reference}-{sex}-{measurement_method}')
-                        try:
-                            chart_data = chart_functions.create_chart(
-                                reference,
-                                measurement_method=measurement_method,
-                                sex=sex,
-                                centile_format=centile_format
-                            )
-                            script_dir = os.path.dirname(__file__)
-                            path = os.path.join(script_dir, f'chart-data/{centile_format}-{reference}-{sex}-{measurement_method}.json')
-                            with open(path, 'w') as file:
-                                file.write(json.dumps(chart_data, indent=4))
-                            print(f'chart data file created for {centile_format}-{reference}-{sex}-{measurement_method}')
-                        except Exception as error:
-                            print(f'Chart data not created due to: {error}')
-
-generate_and_store_chart_data()
-
-
-# Saves openAPI3 spec to file in the project root.
-def write_apispec_to_file():
-    # check if openapi.json is already the same as the autogenerated
-    file = open(r'openapi.json', 'r')
-    if file.read() == json.dumps(app.openapi(), indent=4):
-        print("Generated internal openAPI3 spec and openapi.json have equal file content")
-    else:
-        file = open(r'openapi.json', 'w')
-        file.write(json.dumps(app.openapi(), indent=4))
-    file.close()
-
-write_apispec_to_file()
@@ -2,18 +2,26 @@
 Trisomy 21 router
 """
 # Standard imports
-import json
-from pathlib import Path
-from schemas.response_schema_classes import Centile_Data, MeasurementObject
+from schemas.response_schema_classes import BulkCalculationResponse, Centile_Data, Columnar_Centile_Data, MeasurementBatchItem, MeasurementObject
 
 # Third party imports
-from fastapi import APIRouter, Body, HTTPException
-from typing import List
-from rcpchgrowth import Measurement, constants, generate_fictional_child_data, create_chart
+from fastapi import APIRouter, Body, HTTPException, Request
+from typing import List, Union
+from typing_extensions import Annotated
+from rcpchgrowth import constants, generate_fictional_child_data
 from rcpchgrowth.constants.reference_constants import TRISOMY_21
 
 # local imports
-from schemas import MeasurementRequest, ChartCoordinateRequest, FictionalChildRequest
+from schemas import BulkCalculationRequest, MeasurementRequest, MeasurementRequestBatch, ChartCoordinateRequest, FictionalChildRequest, FictionalCohortRequest
+from services import chart_cache, chart_detail_cache, chart_store, combined_chart_cache, settings
+from services.binary_encoding import batch_response, bulk_response, measurements_response, negotiate_media_type
+from services.calculation_cache import cache_control
+from services.calculations import bulk_calculation, calculate_measurement_async, calculate_measurements
+from services.combined_charts import requested
+from services.executor import ServerBusy, run_cpu_bound, run_cpu_heavy
+from services.fictional_cohort import streamed_cohort
+from services.metrics import count_error
+from services.streaming import STREAM_REQUEST_BODY, streamed_calculations
 
 # set up the API router
 trisomy_21 = APIRouter(
@@ -22,7 +30,7 @@ trisomy_21 = APIRouter(
 
 
 @trisomy_21.post("/calculation", tags=["trisomy-21"], response_model=MeasurementObject)
-def trisomy_21_calculation(measurementRequest: MeasurementRequest = Body(
+async def trisomy_21_calculation(request: Request, measurementRequest: MeasurementRequest = Body(
             ...,
             example={
                 "birth_date": "2020-04-12",
@@ -40,6 +48,8 @@ def trisomy_21_calculation(measurementRequest: MeasurementRequest = Body(
 
     * This endpoint MUST ONLY be used for children with Trisomy 21 (Down's Syndrome).  
     * Returns a single centile/SDS calculation for the selected `measurement_method`.  
+    * Recent calculations are cached. Send `Cache-Control: no-cache` to recalculate, or `no-store` to recalculate without caching the result.
+    * Send `Accept: application/msgpack` for MessagePack, or `Accept: application/vnd.apache.arrow.stream` for an Arrow table with a typed column for each value.
     * Gestational age correction will be applied automatically if appropriate according to the gestational age at birth data supplied.  
     * Available `measurement_method`s are: `height`, `weight`, `bmi`, or `ofc` (OFC = occipitofrontal circumference = 'head circumference').  
     * Note that BMI must be precalculated for the `bmi` function.
@@ -51,38 +61,101 @@ def trisomy_21_calculation(measurementRequest: MeasurementRequest = Body(
     * Optional events can be passed in as a list of strings - each list is associated with a measurement
     """
     try:
-        calculation = Measurement(
-            reference=constants.TRISOMY_21,
-            birth_date=measurementRequest.birth_date,
-            gestation_days=measurementRequest.gestation_days,
-            gestation_weeks=measurementRequest.gestation_weeks,
-            measurement_method=measurementRequest.measurement_method,
-            observation_date=measurementRequest.observation_date,
-            observation_value=measurementRequest.observation_value,
-            sex=measurementRequest.sex,
-            bone_age=measurementRequest.bone_age,
-            bone_age_centile=measurementRequest.bone_age_centile,
-            bone_age_sds=measurementRequest.bone_age_sds,
-            bone_age_text=measurementRequest.bone_age_text,
-            bone_age_type=measurementRequest.bone_age_type,
-            events_text=measurementRequest.events_text
-        ).measurement
-        return calculation
+        calculation = await calculate_measurement_async(constants.TRISOMY_21, measurementRequest, cache_control(request.headers))
+        return measurements_response(request, MeasurementObject, calculation)
     except Exception as err:
+        count_error(err)
         return err, 400
 
 
-@trisomy_21.post("/chart-coordinates", tags=["trisomy-21"], response_model=Centile_Data)
-def trisomy_21_chart_coordinates(chartParams: ChartCoordinateRequest):
+@trisomy_21.post("/calculations", tags=["trisomy-21"], response_model=List[MeasurementBatchItem])
+async def trisomy_21_calculations(request: Request, measurementRequests: Annotated[MeasurementRequestBatch, Body(
+        ...,
+        example=[
+            {
+                "birth_date": "2020-04-12",
+                "observation_date": "2020-06-12",
+                "observation_value": 60,
+                "measurement_method": "height",
+                "sex": "male",
+                "gestation_weeks": 40,
+                "gestation_days": 4
+            },
+            {
+                "birth_date": "2020-04-12",
+                "observation_date": "2021-04-12",
+                "observation_value": 70,
+                "measurement_method": "height",
+                "sex": "male",
+                "gestation_weeks": 40,
+                "gestation_days": 4
+            }
+        ]
+)]):
+    """
+    ## Trisomy-21 Batch Centile and SDS Calculations.
+
+    * Accepts a list of measurements in the same format as the `/calculation` endpoint, for example a whole patient history.
+    * Returns a list of the same length and order. Each item has either a `measurement` or an `error`.
+    * An invalid measurement is reported in its own `error` and does not fail the rest of the batch.
+    * The number of measurements in one request is limited by the server `MAX_BATCH_SIZE` setting.
+    * Send `Accept: application/msgpack` for MessagePack, or `Accept: application/vnd.apache.arrow.stream` for an Arrow table with a row for each item and an `error` column.
+    """
+    if len(measurementRequests) > settings.max_batch_size:
+        raise HTTPException(status_code=422, detail=f"A batch cannot exceed {settings.max_batch_size} measurements.")
+    calculations = await run_cpu_bound(calculate_measurements, constants.TRISOMY_21, measurementRequests, cache_control(request.headers))
+    return await run_cpu_bound(batch_response, request, calculations)
+
+
+@trisomy_21.post("/calculations/stream", tags=["trisomy-21"], openapi_extra=STREAM_REQUEST_BODY)
+async def trisomy_21_calculations_stream(request: Request):
+    """
+    ## Trisomy-21 Streaming Centile and SDS Calculations.
+
+    * For scoring large extracts without holding them in memory on either side.
+    * Accepts newline-delimited JSON (`application/x-ndjson`), one `/calculation` request per line,
+    * or CSV (`text/csv`) with a header row naming the `/calculation` request fields. Empty cells are treated as missing.
+    * Results are streamed back as each row is calculated, in the same order, as NDJSON or CSV.
+    * The response format matches the request unless `Accept` asks for `application/x-ndjson` or `text/csv`.
+    * A row which cannot be calculated carries an `error` and does not stop the stream.
+    """
+    return streamed_calculations(constants.TRISOMY_21, request)
+
+
+@trisomy_21.post("/bulk-calculation", tags=["trisomy-21"], response_model=BulkCalculationResponse)
+async def trisomy_21_bulk_calculation(request: Request, bulkCalculationRequest: BulkCalculationRequest):
+    """
+    ## Trisomy-21 Bulk SDS and Centile Calculations.
+
+    * For population analytics: scores large numbers of measurements in one vectorised pass.
+    * Accepts parallel lists of `decimal_ages`, `sexes`, `measurement_methods` and `observation_values`.
+    * Ages are used as supplied - no gestational age correction is applied, and no dates, comments or plottable data are returned.
+    * Returns parallel lists of `sds` and `centiles`. These are `null` where there is no reference data for that age, sex and measurement method.
+    * The number of measurements in one request is limited by the server `MAX_BULK_SIZE` setting.
+    * Send `Accept: application/msgpack` for MessagePack, or `Accept: application/vnd.apache.arrow.stream` for an Arrow table of `sds` and `centiles` columns.
+    """
+    if len(bulkCalculationRequest.decimal_ages) > settings.max_bulk_size:
+        raise HTTPException(status_code=422, detail=f"A bulk calculation cannot exceed {settings.max_bulk_size} measurements.")
+    calculation = await run_cpu_bound(bulk_calculation, constants.TRISOMY_21, bulkCalculationRequest)
+    return await run_cpu_bound(bulk_response, request, calculation)
+
+
+@trisomy_21.post("/chart-coordinates", tags=["trisomy-21"], response_model=Union[Centile_Data, Columnar_Centile_Data])
+async def trisomy_21_chart_coordinates(chartParams: ChartCoordinateRequest, request: Request):
     """
     ## Trisomy-21 Chart Coordinates Data.
         
     * Returns coordinates for constructing the lines of a traditional growth chart, in JSON format
     * Requires a sex ('male' or 'female' lowercase) and a measurement_method ('height', 'weight' ,'bmi', 'ofc')
+    * Lists of sexes and of measurement methods (e.g. ['height', 'weight', 'bmi', 'ofc']) return every chart in one response
     * If custom centiles/sds collections (individually or as a collection) are required, accepts a list of float values (up to 15) as centile_format parameter
     * The is_sds boolean flag (default false) specifies if the custom list is of SDS or centiles.
     * In addition to the custom list, "cole-nine-centiles" or "three-percent-centiles" can be specified which are standard collections.
     * If no centile_format is supplied, "cole-nine-centiles" are returned as a default.
+    * Charts are returned with an `ETag`. Send it back as `If-None-Match` to receive `304 Not Modified` if the chart has not changed.
+    * For smaller charts, age_min and age_max return only the points within an age range, and max_points simplifies each centile line to about that many points.
+    * With format set to `columnar`, each centile line carries its label once, with parallel lists of ages (`x`) and measurements (`y`).
+    * Send `Accept: application/msgpack` for MessagePack, or `Accept: application/vnd.apache.arrow.stream` for an Arrow table with one row for each point.
     \f
     [
         "height": [
@@ -103,41 +176,46 @@ def trisomy_21_chart_coordinates(chartParams: ChartCoordinateRequest):
         ... repeat for weight, bmi, ofc, based on which measurements supplied. If only height data supplied, only height centile data returned
     ]
     """
-    chart_data=None
-    if (type(chartParams.centile_format) is list):
-        # custom centiles requested - calculate these and return. Do not persist
-        try:
-            chart_data = create_chart(
-                TRISOMY_21, 
-                chartParams.centile_format, 
-                measurement_method=chartParams.measurement_method, 
-                sex=chartParams.sex,
-                is_sds=chartParams.is_sds)
-        except:
-            return HTTPException(status_code=422, detail=f"Error creating {chartParams.sex} {chartParams.measurement_method} Trisomy 21 chart on the server, using {chartParams.centile_format} centile format.")
-    else:
-        chart_data_file = Path(
-                    f'chart-data/{chartParams.centile_format}-{constants.TRISOMY_21}-{chartParams.sex}-{chartParams.measurement_method}.json')
-        if chart_data_file.exists():
-            print(f'Chart data file exists for {chartParams.centile_format}-{constants.TRISOMY_21}-{chartParams.sex}-{chartParams.measurement_method}.')
-            with open(f'chart-data/{chartParams.centile_format}-{constants.TRISOMY_21}-{chartParams.sex}-{chartParams.measurement_method}.json', 'r') as file:
-                chart_data = json.load(file)
-        else:
-            return HTTPException(status_code=422, detail=f"Item not found: chart-data/{chartParams.centile_format}-{constants.TRISOMY_21}-{chartParams.sex}-{chartParams.measurement_method}.json")
+    charts = []
+    for sex in requested(chartParams.sex):
+        for measurement_method in requested(chartParams.measurement_method):
+            if (type(chartParams.centile_format) is list):
+                # custom centiles requested - calculate these, or return them from the chart cache if recently requested
+                try:
+                    chart = await chart_cache.get_response_async(
+                        TRISOMY_21,
+                        chartParams.centile_format,
+                        measurement_method=measurement_method,
+                        sex=sex,
+                        is_sds=chartParams.is_sds)
+                except ServerBusy:
+                    raise
+                except Exception as error:
+                    count_error(error)
+                    return HTTPException(status_code=422, detail=f"Error creating {sex} {measurement_method} Trisomy 21 chart on the server, using {chartParams.centile_format} centile format.")
+            else:
+                # standard centiles are served as prepared bytes, with an ETag so unchanged charts are not downloaded again
+                chart = await chart_store.get_response_async(chartParams.centile_format, constants.TRISOMY_21, sex, measurement_method)
+                if chart is None:
+                    return HTTPException(status_code=422, detail=f"Item not found: chart-data/{chartParams.centile_format}-{constants.TRISOMY_21}-{sex}-{measurement_method}.json")
+            charts.append(chart)
+    # several sexes or measurement methods are merged into one response
+    chart_response = await combined_chart_cache.get_response_async(charts)
+    chart_response = await chart_detail_cache.get_response_async(chart_response, chartParams.age_min, chartParams.age_max, chartParams.max_points, chartParams.format, negotiate_media_type(request.headers.get('accept', '')))
+    return chart_response.to_response(request)
         
-    return {
-        "centile_data": chart_data
-    }
 
 @trisomy_21.post('/fictional-child-data', tags=["trisomy-21"], response_model=List[MeasurementObject])
-def fictional_child_data(fictional_child_request: FictionalChildRequest):
+async def fictional_child_data(request: Request, fictional_child_request: FictionalChildRequest):
     """
     ## Trisomy-21 Fictional Child Data Endpoint
 
     * Generates synthetic data for demonstration or testing purposes
+    * Send `Accept: application/msgpack` for MessagePack, or `Accept: application/vnd.apache.arrow.stream` for an Arrow table with one row for each measurement.
     """
     try:
-        life_course_fictional_child_data = generate_fictional_child_data(
+        life_course_fictional_child_data = await run_cpu_heavy(
+            generate_fictional_child_data,
             measurement_method=fictional_child_request.measurement_method,
             sex=fictional_child_request.sex,
             start_chronological_age=fictional_child_request.start_chronological_age,
@@ -153,7 +231,27 @@ def fictional_child_data(fictional_child_request: FictionalChildRequest):
             noise_range=fictional_child_request.noise_range,
             reference=TRISOMY_21
         )
-        return life_course_fictional_child_data
-    except: 
+        return measurements_response(request, List[MeasurementObject], life_course_fictional_child_data)
+    except ServerBusy:
+        raise
+    except Exception as error:
+        count_error(error)
         return HTTPException(status_code=422, detail=f"Not possible to create Trisomy 21 fictional child data.")
-        
+
+
+@trisomy_21.post('/fictional-cohort-data', tags=["trisomy-21"])
+async def trisomy_21_fictional_cohort_data(fictional_cohort_request: FictionalCohortRequest):
+    """
+    ## Trisomy-21 Fictional Cohort Data Endpoint
+
+    * Generates synthetic data for a whole cohort of fictional children, for example to load-test systems which receive growth data.
+    * Each child's sex, starting SDS, gestation, drift and measurement error are drawn from the distributions in the request.
+    * The same `seed` and parameters always generate the same cohort.
+    * Children are streamed as newline-delimited JSON (`application/x-ndjson`), one child per line, each with its `measurements`.
+    * The SDS and centile of each measurement are for its corrected age.
+    * The number of children in one request is limited by the server `MAX_COHORT_SIZE` setting.
+    """
+    if fictional_cohort_request.number_of_children > settings.max_cohort_size:
+        raise HTTPException(status_code=422, detail=f"A cohort cannot exceed {settings.max_cohort_size} children.")
+    sexes = [fictional_cohort_request.sex] if fictional_cohort_request.sex else constants.SEXES
+    return await streamed_cohort(constants.TRISOMY_21, fictional_cohort_request, sexes)
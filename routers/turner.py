@@ -2,18 +2,26 @@
 Turner router
 """
 # Standard imports
-import json
-from pathlib import Path
-from typing import List
+from typing import List, Union
+from typing_extensions import Annotated
 
 # Third party imports
-from fastapi import APIRouter, Body, HTTPException
-from schemas.response_schema_classes import Centile_Data, MeasurementObject
+from fastapi import APIRouter, Body, HTTPException, Request
+from schemas.response_schema_classes import BulkCalculationResponse, Centile_Data, Columnar_Centile_Data, MeasurementBatchItem, MeasurementObject
 
 # RCPCH imports
-from rcpchgrowth import Measurement, constants, generate_fictional_child_data, create_chart
+from rcpchgrowth import constants, generate_fictional_child_data
 from rcpchgrowth.constants.reference_constants import TURNERS
-from schemas import MeasurementRequest, ChartCoordinateRequest, FictionalChildRequest
+from schemas import BulkCalculationRequest, MeasurementRequest, MeasurementRequestBatch, ChartCoordinateRequest, FictionalChildRequest, FictionalCohortRequest
+from services import chart_cache, chart_detail_cache, chart_store, combined_chart_cache, settings
+from services.binary_encoding import batch_response, bulk_response, measurements_response, negotiate_media_type
+from services.calculation_cache import cache_control
+from services.calculations import bulk_calculation, calculate_measurement_async, calculate_measurements
+from services.combined_charts import requested
+from services.executor import ServerBusy, run_cpu_bound, run_cpu_heavy
+from services.fictional_cohort import streamed_cohort
+from services.metrics import count_error
+from services.streaming import STREAM_REQUEST_BODY, streamed_calculations
 
 # set up the API router
 turners = APIRouter(
@@ -21,7 +29,7 @@ turners = APIRouter(
 )
 
 @turners.post("/calculation", tags=["turners-syndrome"], response_model=MeasurementObject)
-def turner_calculation(measurementRequest: MeasurementRequest = Body(
+async def turner_calculation(request: Request, measurementRequest: MeasurementRequest = Body(
         ...,
         example={
             "birth_date": "2020-04-12",
@@ -38,6 +46,8 @@ def turner_calculation(measurementRequest: MeasurementRequest = Body(
         
     * This endpoint MUST ONLY be used for **female** children with the chromosomal disorder Turner's Syndrome (45,XO karyotype).  
     * Returns a single centile/SDS calculation for the selected `measurement_method`.  
+    * Recent calculations are cached. Send `Cache-Control: no-cache` to recalculate, or `no-store` to recalculate without caching the result.
+    * Send `Accept: application/msgpack` for MessagePack, or `Accept: application/vnd.apache.arrow.stream` for an Arrow table with a typed column for each value.
     * Gestational age correction will be applied automatically if appropriate, according to the gestational age at birth data supplied.  
     * Available `measurement_method`s are: `height` **only** because this reference data is all that exists.  
     * Dates will discard anything after first 'T' in YYYY-MM-DDTHH:MM:SS.milliseconds+TZ etc
@@ -48,30 +58,87 @@ def turner_calculation(measurementRequest: MeasurementRequest = Body(
     * Optional events can be passed in as a list of strings - each list is associated with a measurement
     """
     try:
-        calculation = Measurement(
-            reference=constants.TURNERS,
-            birth_date=measurementRequest.birth_date,
-            gestation_days=measurementRequest.gestation_days,
-            gestation_weeks=measurementRequest.gestation_weeks,
-            measurement_method=measurementRequest.measurement_method,
-            observation_date=measurementRequest.observation_date,
-            observation_value=measurementRequest.observation_value,
-            sex=measurementRequest.sex,
-            bone_age=measurementRequest.bone_age,
-            bone_age_centile=measurementRequest.bone_age_centile,
-            bone_age_sds=measurementRequest.bone_age_sds,
-            bone_age_text=measurementRequest.bone_age_text,
-            bone_age_type=measurementRequest.bone_age_type,
-            events_text=measurementRequest.events_text
-        ).measurement
+        calculation = await calculate_measurement_async(constants.TURNERS, measurementRequest, cache_control(request.headers))
     except ValueError as err:
-        print(err.args)
+        count_error(err)
         return err.args, 422
-    return calculation
+    return measurements_response(request, MeasurementObject, calculation)
     
 
-@turners.post("/chart-coordinates", tags=["turners-syndrome"], response_model=Centile_Data)
-def turner_chart_coordinates(chartParams: ChartCoordinateRequest):
+@turners.post("/calculations", tags=["turners-syndrome"], response_model=List[MeasurementBatchItem])
+async def turner_calculations(request: Request, measurementRequests: Annotated[MeasurementRequestBatch, Body(
+        ...,
+        example=[
+            {
+                "birth_date": "2020-04-12",
+                "observation_date": "2024-06-12",
+                "observation_value": 78,
+                "measurement_method": "height",
+                "sex": "female",
+                "gestation_weeks": 39,
+                "gestation_days": 2
+            },
+            {
+                "birth_date": "2020-04-12",
+                "observation_date": "2025-06-12",
+                "observation_value": 84,
+                "measurement_method": "height",
+                "sex": "female",
+                "gestation_weeks": 39,
+                "gestation_days": 2
+            }
+        ]
+)]):
+    """
+    ## Turner's Syndrome Batch Centile and SDS Calculations.
+
+    * Accepts a list of measurements in the same format as the `/calculation` endpoint, for example a whole patient history.
+    * Returns a list of the same length and order. Each item has either a `measurement` or an `error`.
+    * An invalid measurement is reported in its own `error` and does not fail the rest of the batch.
+    * The number of measurements in one request is limited by the server `MAX_BATCH_SIZE` setting.
+    * Send `Accept: application/msgpack` for MessagePack, or `Accept: application/vnd.apache.arrow.stream` for an Arrow table with a row for each item and an `error` column.
+    """
+    if len(measurementRequests) > settings.max_batch_size:
+        raise HTTPException(status_code=422, detail=f"A batch cannot exceed {settings.max_batch_size} measurements.")
+    calculations = await run_cpu_bound(calculate_measurements, constants.TURNERS, measurementRequests, cache_control(request.headers))
+    return await run_cpu_bound(batch_response, request, calculations)
+
+
+@turners.post("/calculations/stream", tags=["turners-syndrome"], openapi_extra=STREAM_REQUEST_BODY)
+async def turner_calculations_stream(request: Request):
+    """
+    ## Turner's Syndrome Streaming Centile and SDS Calculations.
+
+    * For scoring large extracts without holding them in memory on either side.
+    * Accepts newline-delimited JSON (`application/x-ndjson`), one `/calculation` request per line,
+    * or CSV (`text/csv`) with a header row naming the `/calculation` request fields. Empty cells are treated as missing.
+    * Results are streamed back as each row is calculated, in the same order, as NDJSON or CSV.
+    * The response format matches the request unless `Accept` asks for `application/x-ndjson` or `text/csv`.
+    * A row which cannot be calculated carries an `error` and does not stop the stream.
+    """
+    return streamed_calculations(constants.TURNERS, request)
+
+
+@turners.post("/bulk-calculation", tags=["turners-syndrome"], response_model=BulkCalculationResponse)
+async def turner_bulk_calculation(request: Request, bulkCalculationRequest: BulkCalculationRequest):
+    """
+    ## Turner's Syndrome Bulk SDS and Centile Calculations.
+
+    * For population analytics: scores large numbers of measurements in one vectorised pass.
+    * Accepts parallel lists of `decimal_ages`, `sexes`, `measurement_methods` and `observation_values`.
+    * Ages are used as supplied - no gestational age correction is applied, and no dates, comments or plottable data are returned.
+    * Returns parallel lists of `sds` and `centiles`. These are `null` where there is no reference data for that age, sex and measurement method.
+    * The number of measurements in one request is limited by the server `MAX_BULK_SIZE` setting.
+    * Send `Accept: application/msgpack` for MessagePack, or `Accept: application/vnd.apache.arrow.stream` for an Arrow table of `sds` and `centiles` columns.
+    """
+    if len(bulkCalculationRequest.decimal_ages) > settings.max_bulk_size:
+        raise HTTPException(status_code=422, detail=f"A bulk calculation cannot exceed {settings.max_bulk_size} measurements.")
+    calculation = await run_cpu_bound(bulk_calculation, constants.TURNERS, bulkCalculationRequest)
+    return await run_cpu_bound(bulk_response, request, calculation)
+
+
+@turners.post("/chart-coordinates", tags=["turners-syndrome"], response_model=Union[Centile_Data, Columnar_Centile_Data])
+async def turner_chart_coordinates(chartParams: ChartCoordinateRequest, request: Request):
     """
     ## Turner's Syndrome Chart Coordinates data.
     
@@ -81,6 +148,10 @@ def turner_chart_coordinates(chartParams: ChartCoordinateRequest):
     * The is_sds boolean flag (default false) specifies if the custom list is of SDS or centiles.
     * In addition to the custom list, "cole-nine-centiles" or "three-percent-centiles" can be specified which are standard collections.
     * If no centile_format is supplied, "cole-nine-centiles" are returned as a default.
+    * Charts are returned with an `ETag`. Send it back as `If-None-Match` to receive `304 Not Modified` if the chart has not changed.
+    * For smaller charts, age_min and age_max return only the points within an age range, and max_points simplifies each centile line to about that many points.
+    * With format set to `columnar`, each centile line carries its label once, with parallel lists of ages (`x`) and measurements (`y`).
+    * Send `Accept: application/msgpack` for MessagePack, or `Accept: application/vnd.apache.arrow.stream` for an Arrow table with one row for each point.
     \f
     [
         "height": [
@@ -101,46 +172,51 @@ def turner_chart_coordinates(chartParams: ChartCoordinateRequest):
     ... repeat for weight, bmi, ofc, based on which measurements supplied. If only height data supplied, only height centile data returned
     ]
     """
-    if chartParams.sex == "male" or chartParams.measurement_method != "height":
-        return "Turner data only exists for height in girls."
-
-    chart_data=None
-    if (type(chartParams.centile_format) is list):
-        # custom centiles requested - calculate these and return. Do not persist
-        try:
-            chart_data = create_chart(
-                constants.TURNERS, 
-                chartParams.centile_format, 
-                measurement_method=chartParams.measurement_method, 
-                sex=chartParams.sex,
-                is_sds=chartParams.is_sds)
-        except:
-            return HTTPException(status_code=422, detail=f"Error creating {chartParams.sex} {chartParams.measurement_method} Turner's syndrome chart on the server, using {chartParams.centile_format} centile format.")
-    else:
-        chart_data_file = Path(
-                    f'chart-data/{chartParams.centile_format}-{constants.TURNERS}-{chartParams.sex}-{chartParams.measurement_method}.json')
-        if chart_data_file.exists():
-            print(f'Chart data file exists for {chartParams.centile_format}-{constants.TURNERS}-{chartParams.sex}-{chartParams.measurement_method}.')
-            with open(f'chart-data/{chartParams.centile_format}-{constants.TURNERS}-{chartParams.sex}-{chartParams.measurement_method}.json', 'r') as file:
-                chart_data = json.load(file)
-        else:
-            return HTTPException(status_code=422, detail=f"Item not found: chart-data/{chartParams.centile_format}-{constants.TURNERS}-{chartParams.sex}-{chartParams.measurement_method}.json")
+    if requested(chartParams.sex) != ["female"] or requested(chartParams.measurement_method) != ["height"]:
+        raise HTTPException(status_code=422, detail="Turner data only exists for height in girls.")
+
+    charts = []
+    for sex in requested(chartParams.sex):
+        for measurement_method in requested(chartParams.measurement_method):
+            if (type(chartParams.centile_format) is list):
+                # custom centiles requested - calculate these, or return them from the chart cache if recently requested
+                try:
+                    chart = await chart_cache.get_response_async(
+                        constants.TURNERS,
+                        chartParams.centile_format,
+                        measurement_method=measurement_method,
+                        sex=sex,
+                        is_sds=chartParams.is_sds)
+                except ServerBusy:
+                    raise
+                except Exception as error:
+                    count_error(error)
+                    return HTTPException(status_code=422, detail=f"Error creating {sex} {measurement_method} Turner's syndrome chart on the server, using {chartParams.centile_format} centile format.")
+            else:
+                # standard centiles are served as prepared bytes, with an ETag so unchanged charts are not downloaded again
+                chart = await chart_store.get_response_async(chartParams.centile_format, constants.TURNERS, sex, measurement_method)
+                if chart is None:
+                    return HTTPException(status_code=422, detail=f"Item not found: chart-data/{chartParams.centile_format}-{constants.TURNERS}-{sex}-{measurement_method}.json")
+            charts.append(chart)
+    # several sexes or measurement methods are merged into one response
+    chart_response = await combined_chart_cache.get_response_async(charts)
+    chart_response = await chart_detail_cache.get_response_async(chart_response, chartParams.age_min, chartParams.age_max, chartParams.max_points, chartParams.format, negotiate_media_type(request.headers.get('accept', '')))
+    return chart_response.to_response(request)
         
-    return {
-        "centile_data": chart_data
-    }
 
 
 
 @turners.post('/fictional-child-data', tags=["turners-syndrome"], response_model=List[MeasurementObject])
-def fictional_child_data(fictional_child_request: FictionalChildRequest):
+async def fictional_child_data(request: Request, fictional_child_request: FictionalChildRequest):
     """
     ## Turner's Fictional Child Data Endpoint
     
     * Generates synthetic data for demonstration or testing purposes
+    * Send `Accept: application/msgpack` for MessagePack, or `Accept: application/vnd.apache.arrow.stream` for an Arrow table with one row for each measurement.
     """
     try:
-        life_course_fictional_child_data = generate_fictional_child_data(
+        life_course_fictional_child_data = await run_cpu_heavy(
+            generate_fictional_child_data,
             measurement_method=fictional_child_request.measurement_method,
             sex=fictional_child_request.sex,
             start_chronological_age=fictional_child_request.start_chronological_age,
@@ -156,6 +232,28 @@ def fictional_child_data(fictional_child_request: FictionalChildRequest):
             noise_range=fictional_child_request.noise_range,
             reference=constants.TURNERS
         )
-        return life_course_fictional_child_data
-    except:
+        return measurements_response(request, List[MeasurementObject], life_course_fictional_child_data)
+    except ServerBusy:
+        raise
+    except Exception as error:
+        count_error(error)
         return HTTPException(status_code=422, detail=f"Not possible to create Turner fictional child data.")
+
+
+@turners.post('/fictional-cohort-data', tags=["turners-syndrome"])
+async def turner_fictional_cohort_data(fictional_cohort_request: FictionalCohortRequest):
+    """
+    ## Turner's Fictional Cohort Data Endpoint
+
+    * Generates synthetic data for a whole cohort of fictional children, for example to load-test systems which receive growth data.
+    * Each child's sex, starting SDS, gestation, drift and measurement error are drawn from the distributions in the request.
+    * The same `seed` and parameters always generate the same cohort.
+    * Turner's syndrome reference data are for girls' height only, so children are female unless `sex` is given.
+    * Children are streamed as newline-delimited JSON (`application/x-ndjson`), one child per line, each with its `measurements`.
+    * The SDS and centile of each measurement are for its corrected age.
+    * The number of children in one request is limited by the server `MAX_COHORT_SIZE` setting.
+    """
+    if fictional_cohort_request.number_of_children > settings.max_cohort_size:
+        raise HTTPException(status_code=422, detail=f"A cohort cannot exceed {settings.max_cohort_size} children.")
+    sexes = [fictional_cohort_request.sex] if fictional_cohort_request.sex else [constants.FEMALE]
+    return await streamed_cohort(constants.TURNERS, fictional_cohort_request, sexes)
@@ -1,6 +1,8 @@
 """
 Utilities router
 """
+# Standard imports
+from functools import lru_cache
 
 # Third party imports
 from fastapi import APIRouter
@@ -9,8 +11,12 @@ from fastapi import APIRouter
 from rcpchgrowth import mid_parental_height, sds_for_measurement, constants, centile
 from rcpchgrowth.constants.reference_constants import UK_WHO
 from rcpchgrowth.global_functions import measurement_from_sds
-from rcpchgrowth.chart_functions import create_chart
 from schemas import MidParentalHeightRequest, MidParentalHeightResponse
+from services import settings
+from services.executor import ServerBusy, run_cpu_heavy
+from services.metrics import count_error
+from services.trusted_output import trusted_response
+from services.lms_engine import create_uk_who_chart
 
 # set up the API router
 utilities = APIRouter(
@@ -19,7 +25,7 @@ utilities = APIRouter(
 
 
 @utilities.post('/mid-parental-height', tags=['utilities'], response_model=MidParentalHeightResponse)
-def mid_parental_height_endpoint(mid_parental_height_request: MidParentalHeightRequest):
+async def mid_parental_height_endpoint(mid_parental_height_request: MidParentalHeightRequest):
     """
     ## Mid-parental-height Endpoint
 
@@ -51,46 +57,26 @@ def mid_parental_height_endpoint(mid_parental_height_request: MidParentalHeightR
                 sex=mid_parental_height_request.sex
             )
 
-    except Exception:
-        print("It was not possible to calculate midparental SDS.")
+    except Exception as e:
+        count_error(e)
 
     try:
         mph_centile = centile(mph_sds)
-    except:
-        print("It was not possible to calculate a centile from midparental height.")
-    
-    try:
-        mph_centile_data = create_chart(
-            reference=UK_WHO,
-            centile_format=[mph_centile],
-            measurement_method=constants.HEIGHT,
-            sex=mid_parental_height_request.sex
-        )
-    except Exception as e:
-        print(e)
-    
-    try:
-        lower_centile = centile(mph_sds - 2)
-        mph_lower_centile_data = create_chart(
-            reference=UK_WHO,
-            centile_format=[lower_centile],
-            measurement_method=constants.HEIGHT,
-            sex=mid_parental_height_request.sex
-        )
-        
-    except Exception as e:
-        print(e)
+    except Exception as error:
+        count_error(error)
     
     try:
-        upper_centile = centile(mph_sds + 2)
-        mph_upper_centile_data = create_chart(
-            reference=UK_WHO,
-            centile_format=[upper_centile],
-            measurement_method=constants.HEIGHT,
-            sex=mid_parental_height_request.sex
+        # memoised on the exact parental heights, so the lines always match the SDS and centile above
+        mph_centile_data, mph_lower_centile_data, mph_upper_centile_data = await run_cpu_heavy(
+            mid_parental_height_centile_data,
+            mid_parental_height_request.height_paternal,
+            mid_parental_height_request.height_maternal,
+            mid_parental_height_request.sex
         )
+    except ServerBusy:
+        raise
     except Exception as e:
-        print(e)
+        count_error(e)
 
     try:
         upper_height = measurement_from_sds(
@@ -108,9 +94,9 @@ def mid_parental_height_endpoint(mid_parental_height_request: MidParentalHeightR
             requested_sds=mph_sds - 2
         )
     except Exception as e:
-        print(e)
+        count_error(e)
 
-    return {
+    return trusted_response(MidParentalHeightResponse, {
         "mid_parental_height": height,
         "mid_parental_height_sds": mph_sds,
         "mid_parental_height_centile": mph_centile,
@@ -119,4 +105,39 @@ def mid_parental_height_endpoint(mid_parental_height_request: MidParentalHeightR
         "mid_parental_height_upper_centile_data": mph_upper_centile_data,
         "mid_parental_height_lower_value": lower_height,
         "mid_parental_height_upper_value": upper_height
-    }
+    })
+
+
+@lru_cache(maxsize=settings.mid_parental_height_cache_size)
+def mid_parental_height_centile_data(height_paternal: float, height_maternal: float, sex: str) -> tuple:
+    """
+    Returns UK-WHO height chart data for the mid-parental height centile, and for the centiles 2 SDS below and above it.
+    All three lines are generated together in one vectorised pass, and are memoised on the parental heights.
+    """
+    height = mid_parental_height(height_paternal, height_maternal, sex)
+    mph_sds = sds_for_measurement(
+        reference=constants.UK_WHO,
+        age=20.0,
+        measurement_method=constants.HEIGHT,
+        observation_value=height,
+        sex=sex
+    )
+    chart_data = create_uk_who_chart(
+        measurement_method=constants.HEIGHT,
+        sex=sex,
+        centiles=[centile(mph_sds), centile(mph_sds - 2), centile(mph_sds + 2)]
+    )
+    return tuple(centile_line_chart_data(chart_data, index) for index in range(3))
+
+
+def centile_line_chart_data(chart_data: list, index: int) -> list:
+    """Returns chart data holding only the centile line at `index` of each reference"""
+    return [
+        {
+            reference: {
+                sex: {
+                    measurement_method: [centiles[index]] for measurement_method, centiles in measurement_methods.items()
+                } for sex, measurement_methods in sexes.items()
+            }
+        } for reference_data in chart_data for reference, sexes in reference_data.items()
+    ]
@@ -1,9 +1,10 @@
 # standard imports
 from datetime import date, datetime
 from typing import Optional, Literal, Union, List
+from typing_extensions import Annotated
 
 # third party imports
-from pydantic import BaseModel, Field, validator
+from pydantic import BaseModel, Field, WithJsonSchema, validator
 from rcpchgrowth import constants
 
 # local / rcpch imports
@@ -58,16 +59,24 @@ three_percent_centiles = THREE_PERCENT_CENTILES
 
 
 class ChartCoordinateRequest(BaseModel):
-    sex: Literal['male', 'female'] = Field(
-        ..., description="The sex of the patient, as a string value which can either be `male` or `female`. Abbreviations or alternatives are not accepted.")
-    measurement_method: Literal['height', 'weight', 'ofc', 'bmi'] = Field(
-        ..., description="The type of measurement performed on the infant or child as a string which can be `height`, `weight`, `bmi` or `ofc`. The value of this measurement is supplied as the `observation_value` parameter. The measurements represent height **in centimetres**, weight *in kilograms**, body mass index **in kilograms/metre²** and occipitofrontal circumference (head circumference, OFC) **in centimetres**.")
+    sex: Union[Literal['male', 'female'], List[Literal['male', 'female']]] = Field(
+        ..., description="The sex of the patient, as a string value which can either be `male` or `female`. Abbreviations or alternatives are not accepted. A list of both returns the charts for both sexes in one response.")
+    measurement_method: Union[Literal['height', 'weight', 'ofc', 'bmi'], List[Literal['height', 'weight', 'ofc', 'bmi']]] = Field(
+        ..., description="The type of measurement performed on the infant or child as a string which can be `height`, `weight`, `bmi` or `ofc`. The value of this measurement is supplied as the `observation_value` parameter. The measurements represent height **in centimetres**, weight *in kilograms**, body mass index **in kilograms/metre²** and occipitofrontal circumference (head circumference, OFC) **in centimetres**. A list (e.g. `['height', 'weight', 'bmi', 'ofc']`) returns the charts for each measurement method in one response.")
     is_sds: bool = Field(
         False,
         description="Boolean flag (default False) referring to centile_format. If custom lines requested as SDS, rather than as centiles, set this to True."
     )
     centile_format: Optional[Union[Literal["cole-nine-centiles", "three-percent-centiles"], List[float]]] = Field(
         'cole-nine-centiles', description="Optional selection of centile format using 9 centile standard ['nine-centiles'], or older three-percent centile format ['three-percent-centiles'], or accepts a list of floats as a custom centile format e.g. [7/10/20/30/40/50/60/70/80/90/93]. Defaults to cole-nine-centiles")
+    max_points: Optional[int] = Field(
+        None, ge=2, description="Optional level of detail. If supplied, each centile line is simplified to about this many points across the chart, keeping the points which contribute most to its shape. Useful for small charts, such as on mobile devices.")
+    age_min: Optional[float] = Field(
+        None, description="Optional youngest decimal age of the chart. If supplied, only points from this age are returned (with the point before it, so lines reach the edge of the chart).")
+    age_max: Optional[float] = Field(
+        None, description="Optional oldest decimal age of the chart. If supplied, only points up to this age are returned (with the point after it, so lines reach the edge of the chart).")
+    format: Literal['points', 'columnar'] = Field(
+        'points', description="Optional response format. `points` (the default) returns each centile line as a list of points `{l, x, y}`. `columnar` returns the label of each centile line once, with parallel lists of its ages `x` and measurements `y`, which is smaller and quicker to decode.")
 
     @validator('centile_format', 'is_sds')
     def custom_centiles_must_not_exceed_fifteen(cls, v, values):
@@ -82,6 +91,18 @@ class ChartCoordinateRequest(BaseModel):
                     raise ValueError("Centile values cannot be negative.")
         return v
 
+    @validator('sex', 'measurement_method')
+    def lists_must_not_be_empty(cls, v):
+        if type(v) is list and len(v) < 1:
+            raise ValueError("Empty list. Please provide at least one value.")
+        return v
+
+    @validator('age_max')
+    def age_max_must_follow_age_min(cls, v, values):
+        if v is not None and values.get('age_min') is not None and v <= values['age_min']:
+            raise ValueError("age_max must be greater than age_min.")
+        return v
+
 
 class FictionalChildRequest(BaseModel):
     measurement_method: Literal['height', 'weight', 'ofc', 'bmi'] = Field(
@@ -114,6 +135,73 @@ class FictionalChildRequest(BaseModel):
         'uk-who', description="Selected reference as string. Case sensitive and accepts only once of ['uk-who', 'trisomy-21', 'turners-syndrome']")
 
 
+# A batch of measurement requests. Items are validated one at a time, so that one invalid item does not fail the batch,
+# but are documented as `MeasurementRequest`s
+MeasurementRequestBatch = Annotated[List[dict], WithJsonSchema({
+    "type": "array",
+    "items": {"$ref": "#/components/schemas/MeasurementRequest"},
+})]
+
+
+class FictionalCohortRequest(BaseModel):
+    """
+    A cohort of fictional children. Each child's sex, starting SDS, gestation, drift and measurement error are drawn
+    from the distributions given here, using a random number generator seeded with `seed`, so the same request
+    always returns the same cohort.
+    """
+    number_of_children: int = Field(
+        100, ge=1, description="The number of children in the cohort. Limited by the server `MAX_COHORT_SIZE` setting.")
+    seed: int = Field(
+        0, ge=0, description="Seed of the random number generator. The same seed and parameters always generate the same cohort.")
+    measurement_method: Literal['height', 'weight', 'ofc', 'bmi'] = Field(
+        ..., description="The type of measurement generated for every child, which can be `height`, `weight`, `bmi` or `ofc`.")
+    sex: Optional[Literal['male', 'female']] = Field(
+        None, description="The sex of every child, `male` or `female`. If not supplied, each child is male or female with equal probability.")
+    start_chronological_age: float = Field(
+        0.0, ge=0, description="Decimal age as a float. The age from which fictional data is generated.")
+    end_age: float = Field(
+        20.0, description="Decimal age as float. Age until which fictional data is generated.")
+    measurement_interval_type: Literal['d', 'day', 'days', 'w', 'week', 'weeks', 'm', 'month', 'months', 'y', 'year', 'years'] = Field(
+        "months", description="Interval type between fictional measurements. Accepts days as ['d', 'day', 'days'], weeks as ['w', 'weeks', 'weeks'], months as ['m', 'month', 'months'] or years as ['y', 'year', 'years']")
+    measurement_interval_number: int = Field(
+        20, ge=1, description="Interval length as integer between fictional measurements.")
+    start_sds_mean: float = Field(
+        0.0, description="Mean of the normal distribution from which each child's starting SDS is drawn.")
+    start_sds_sd: float = Field(
+        1.0, ge=0, description="Standard deviation of the normal distribution from which each child's starting SDS is drawn.")
+    gestation_weeks_mean: float = Field(
+        39.5, ge=limits.MINIMUM_GESTATION_WEEKS, le=limits.MAXIMUM_GESTATION_WEEKS, description="Mean of the normal distribution from which each child's gestation at birth, in weeks, is drawn.")
+    gestation_weeks_sd: float = Field(
+        1.5, ge=0, description=f"Standard deviation, in weeks, of the gestation at birth. Gestations are limited to {limits.MINIMUM_GESTATION_WEEKS} to {limits.MAXIMUM_GESTATION_WEEKS} weeks.")
+    drift_mean: float = Field(
+        0.0, description="Mean of the normal distribution from which each child's drift is drawn: the change in SDS between the first and last measurement.")
+    drift_sd: float = Field(
+        0.0, ge=0, description="Standard deviation of the normal distribution from which each child's drift is drawn.")
+    noise_range_max: float = Field(
+        0.0, ge=0, le=1, description="Each child's measurement error is drawn uniformly between 0 and this proportion of the measurement (0.01 is up to 1%). Each measurement is then out by up to that proportion, either way.")
+
+
+class BulkCalculationRequest(BaseModel):
+    """
+    Parallel lists of measurements for vectorised SDS and centile calculation.
+    Item n of each list describes measurement n. Ages are supplied already calculated (chronological or corrected as required).
+    """
+    decimal_ages: List[float] = Field(
+        ..., description="Decimal age of each measurement in years, as floats. Correction for gestational age, if required, must already have been applied.")
+    sexes: List[Literal['male', 'female']] = Field(
+        ..., description="The sex of each patient, as a string value which can either be `male` or `female`.")
+    measurement_methods: List[Literal['height', 'weight', 'ofc', 'bmi']] = Field(
+        ..., description="The type of each measurement, which can be `height`, `weight`, `bmi` or `ofc`.")
+    observation_values: List[float] = Field(
+        ..., description="The value of each measurement, as floats, in the same units as the `observation_value` of the calculation endpoints.")
+
+    @validator('sexes', 'measurement_methods', 'observation_values')
+    def lists_must_be_the_same_length(cls, v, values):
+        if 'decimal_ages' in values and len(v) != len(values['decimal_ages']):
+            raise ValueError("All lists must be the same length as decimal_ages.")
+        return v
+
+
 class MidParentalHeightRequest(BaseModel):
     height_paternal: float = Field(
         ge=50, description="The height of the child's biological father, passed as float, measured in centimeters")
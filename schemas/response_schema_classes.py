@@ -143,6 +143,16 @@ class MeasurementObject(BaseModel):
     events_data: EventsData
 
 
+class MeasurementBatchItem(BaseModel):
+    measurement: Optional[MeasurementObject] = None
+    error: Optional[str] = None
+
+
+class BulkCalculationResponse(BaseModel):
+    sds: List[Optional[float]]
+    centiles: List[Optional[float]]
+
+
 class Data(BaseModel):
     l: str
     x: float
@@ -201,6 +211,34 @@ class Centile_Data(BaseModel):
     centile_data: List[ReferenceCreate]
 
 
+class ColumnarCentile(BaseModel):
+    sds: float
+    centile: float
+    l: Optional[str]
+    x: Optional[List[float]]
+    y: Optional[List[Optional[float]]]
+
+
+class ColumnarMeasurementMethod(BaseModel):
+    height: Optional[List[ColumnarCentile]]
+    weight: Optional[List[ColumnarCentile]]
+    ofc: Optional[List[ColumnarCentile]]
+    bmi: Optional[List[ColumnarCentile]]
+
+
+class ColumnarSex(BaseModel):
+    male: Optional[ColumnarMeasurementMethod]
+    female: Optional[ColumnarMeasurementMethod]
+
+
+class ColumnarReference(BaseModel):
+    root: Dict[str, ColumnarSex]
+
+
+class Columnar_Centile_Data(BaseModel):
+    centile_data: List[ColumnarReference]
+
+
 class MidParentalHeightResponse(BaseModel):
     mid_parental_height: float
     mid_parental_height_sds: float
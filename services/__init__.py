@@ -0,0 +1,5 @@
+from .settings import settings
+from .chart_store import chart_store
+from .chart_cache import chart_cache
+from .chart_detail import chart_detail_cache
+from .combined_charts import combined_chart_cache
@@ -0,0 +1,272 @@
+"""
+Binary response formats, for clients which would rather not encode and decode JSON: MessagePack and Arrow.
+
+The chart coordinates, calculation (single, batch and bulk) and fictional child endpoints follow the request's `Accept` header:
+
+* `application/msgpack` returns the same content as the JSON response, encoded as MessagePack.
+* `application/vnd.apache.arrow.stream` returns an Arrow IPC stream of one table, with a typed column for each value.
+  Measurements are flattened to one row each: birth data, dates, the observation, every calculated value
+  (`chronological_sds`, `corrected_centile`...), bone age and events. Batch items are one such row each, with an
+  `error` column (and nulls elsewhere) for items which could not be calculated. Bulk calculations are a row of
+  `sds` and `centiles` for each measurement. Chart coordinates are one row per point,
+  with its reference, sex, measurement method, centile, sds and label.
+
+Both libraries are optional. If one is not installed, its media type is not offered and JSON is returned instead.
+"""
+# standard imports
+import io
+from datetime import date
+from functools import lru_cache
+from typing import List, Literal, Union, get_args, get_origin
+
+# third party imports
+from fastapi import Request, Response
+from pydantic import BaseModel
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional - JSON is always available
+    msgpack = None
+
+try:
+    import pyarrow
+except ImportError:  # pyarrow is optional - JSON is always available
+    pyarrow = None
+
+# local imports
+from schemas.response_schema_classes import BulkCalculationResponse, MeasurementBatchItem, MeasurementObject
+from .trusted_output import trusted_content, trusted_response
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+ARROW_STREAM = 'application/vnd.apache.arrow.stream'
+
+# media types also sent for MessagePack, though not registered
+MEDIA_TYPE_ALIASES = {'application/x-msgpack': MSGPACK}
+
+# the parts of a measurement flattened into Arrow columns (plottable data repeats the calculated values, for charts)
+MEASUREMENT_SECTIONS = ['birth_data', 'measurement_dates', 'child_observation_value', 'measurement_calculated_values', 'bone_age', 'events_data']
+
+CHART_COLUMNS = ['reference', 'sex', 'measurement_method', 'centile', 'sds', 'l', 'x', 'y']
+
+
+def available_media_types() -> list:
+    """Returns the media types this server can produce, JSON first"""
+    media_types = [JSON]
+    if msgpack is not None:
+        media_types.append(MSGPACK)
+    if pyarrow is not None:
+        media_types.append(ARROW_STREAM)
+    return media_types
+
+
+def negotiate_media_type(accept: str) -> str:
+    """
+    Picks the preferred available media type from an `Accept` header, honouring q-values.
+    A media type named in the header is preferred to one matched by a wildcard, and of those with equal
+    quality, the first named is preferred. Returns JSON unless a binary media type is asked for.
+    """
+    if not accept:
+        return JSON
+    weights = {}
+    for position, item in enumerate(accept.split(',')):
+        media_type, _, parameters = item.strip().partition(';')
+        media_type = media_type.strip().lower()
+        media_type = MEDIA_TYPE_ALIASES.get(media_type, media_type)
+        quality = 1.0
+        for parameter in parameters.split(';'):
+            name, _, value = parameter.strip().partition('=')
+            if name == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        weights.setdefault(media_type, (quality, position))
+
+    best = JSON
+    best_rank = None
+    for media_type in available_media_types():
+        if media_type in weights:
+            quality, position = weights[media_type]
+            rank = (quality, 1, -position)
+        else:
+            wildcard = weights.get(media_type.split('/')[0] + '/*', weights.get('*/*'))
+            if wildcard is None:
+                continue
+            rank = (wildcard[0], 0, -wildcard[1])
+        if rank[0] > 0 and (best_rank is None or rank > best_rank):
+            best, best_rank = media_type, rank
+    return best
+
+
+def arrow_type(annotation):
+    """Returns the Arrow type of a scalar response model field, or None if it is not a scalar"""
+    origin = get_origin(annotation)
+    if origin is Union:
+        types = [argument for argument in get_args(annotation) if argument is not type(None)]
+        return arrow_type(types[0]) if len(types) == 1 else None
+    if origin is Literal or annotation is str:
+        return pyarrow.string()
+    if annotation is float:
+        return pyarrow.float64()
+    if annotation is int:
+        return pyarrow.int64()
+    if annotation is date:
+        return pyarrow.date32()
+    if annotation is list or origin in (list, List):
+        return pyarrow.list_(pyarrow.string())
+    return None
+
+
+def _model_columns(model, path: tuple) -> list:
+    columns = []
+    for name, field in model.model_fields.items():
+        annotation = field.annotation
+        if get_origin(annotation) is Union:
+            annotation = next(argument for argument in get_args(annotation) if argument is not type(None))
+        if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+            columns.extend(_model_columns(annotation, path + (name,)))
+        elif arrow_type(field.annotation) is not None:
+            columns.append((name, path + (name,), arrow_type(field.annotation)))
+    return columns
+
+
+@lru_cache(maxsize=None)
+def measurement_columns() -> list:
+    """(column name, path in the measurement, Arrow type) of each column of a measurements table, worked out once from the response model"""
+    return [
+        column
+        for section in MEASUREMENT_SECTIONS
+        for column in _model_columns(MeasurementObject.model_fields[section].annotation, (section,))
+    ]
+
+
+def _value(content: dict, path: tuple):
+    for key in path:
+        if content is None:
+            return None
+        content = content.get(key)
+    return content
+
+
+def _column_value(value, column_type):
+    if value is None:
+        return None
+    if column_type == pyarrow.date32() and isinstance(value, str):
+        return date.fromisoformat(value)
+    if pyarrow.types.is_list(column_type):
+        return [str(item) for item in value]
+    return value
+
+
+def measurements_table(measurements: list):
+    """Returns an Arrow table of measurements (shaped as `MeasurementObject`), one row for each"""
+    columns = measurement_columns()
+    return pyarrow.table(
+        {
+            name: pyarrow.array([_column_value(_value(measurement, path), column_type) for measurement in measurements], type=column_type)
+            for name, path, column_type in columns
+        },
+        schema=pyarrow.schema([(name, column_type) for name, _, column_type in columns]),
+    )
+
+
+def batch_table(items: list):
+    """Returns an Arrow table of batch items (shaped as `MeasurementBatchItem`): a measurement row for each, and its error"""
+    table = measurements_table([item['measurement'] for item in items])
+    return table.append_column(pyarrow.field('error', pyarrow.string()), pyarrow.array([item['error'] for item in items], type=pyarrow.string()))
+
+
+def bulk_table(content: dict):
+    """Returns an Arrow table of a bulk calculation (`BulkCalculationResponse` content), one row for each measurement"""
+    return pyarrow.table(
+        {name: pyarrow.array(content[name], type=pyarrow.float64()) for name in ['sds', 'centiles']},
+        schema=pyarrow.schema([('sds', pyarrow.float64()), ('centiles', pyarrow.float64())]),
+    )
+
+
+def chart_table(content: dict):
+    """Returns an Arrow table of chart coordinates (`Centile_Data` content, as points or columnar), one row for each point"""
+    values = {column: [] for column in CHART_COLUMNS}
+    for reference_data in content['centile_data']:
+        for reference, sexes in reference_data.items():
+            for sex, measurement_methods in sexes.items():
+                for measurement_method, centiles in (measurement_methods or {}).items():
+                    for centile in centiles or []:
+                        if 'x' in centile:
+                            ages, measurements = centile['x'] or [], centile['y'] or []
+                            labels = [centile['l']] * len(ages)
+                        else:
+                            points = centile['data'] or []
+                            ages = [point['x'] for point in points]
+                            measurements = [point['y'] for point in points]
+                            labels = [point['l'] for point in points]
+                        count = len(ages)
+                        values['reference'].extend([reference] * count)
+                        values['sex'].extend([sex] * count)
+                        values['measurement_method'].extend([measurement_method] * count)
+                        values['centile'].extend([centile['centile']] * count)
+                        values['sds'].extend([centile['sds']] * count)
+                        values['l'].extend(labels)
+                        values['x'].extend(ages)
+                        values['y'].extend(measurements)
+    schema = pyarrow.schema([
+        ('reference', pyarrow.dictionary(pyarrow.int8(), pyarrow.string())),
+        ('sex', pyarrow.dictionary(pyarrow.int8(), pyarrow.string())),
+        ('measurement_method', pyarrow.dictionary(pyarrow.int8(), pyarrow.string())),
+        ('centile', pyarrow.float64()),
+        ('sds', pyarrow.float64()),
+        ('l', pyarrow.dictionary(pyarrow.int8(), pyarrow.string())),
+        ('x', pyarrow.float64()),
+        ('y', pyarrow.float64()),
+    ])
+    return pyarrow.table(values, schema=schema)
+
+
+def arrow_stream(table) -> bytes:
+    """Returns the table as an Arrow IPC stream"""
+    sink = io.BytesIO()
+    with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+def encode_msgpack(content) -> bytes:
+    return msgpack.packb(content, use_bin_type=True)
+
+
+def encode_chart(media_type: str, content: dict) -> bytes:
+    """Returns chart coordinates content in a binary media type"""
+    if media_type == ARROW_STREAM:
+        return arrow_stream(chart_table(content))
+    return encode_msgpack(content)
+
+
+def negotiated_response(request: Request, response_model, content, table) -> Response:
+    """
+    Returns content in the media type the request accepts. JSON responses are as `trusted_response` returns them.
+    For Arrow, `table` makes the table from the content, shaped by the response model.
+    """
+    media_type = negotiate_media_type(request.headers.get('accept', ''))
+    if media_type == JSON:
+        return trusted_response(response_model, content)
+    content = trusted_content(response_model, content)
+    body = arrow_stream(table(content)) if media_type == ARROW_STREAM else encode_msgpack(content)
+    return Response(content=body, media_type=media_type, headers={'Vary': 'Accept'})
+
+
+def measurements_response(request: Request, response_model, content) -> Response:
+    """Returns one measurement, or a list of them, in the media type the request accepts"""
+    return negotiated_response(
+        request, response_model, content,
+        lambda measurements: measurements_table(measurements if isinstance(measurements, list) else [measurements]))
+
+
+def batch_response(request: Request, content: list) -> Response:
+    """Returns batch calculation items in the media type the request accepts"""
+    return negotiated_response(request, List[MeasurementBatchItem], content, batch_table)
+
+
+def bulk_response(request: Request, content: dict) -> Response:
+    """Returns a bulk calculation in the media type the request accepts"""
+    return negotiated_response(request, BulkCalculationResponse, content, bulk_table)
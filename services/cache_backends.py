@@ -0,0 +1,403 @@
+"""
+Cache backends: where cached calculations and custom charts are kept.
+
+`CACHE_BACKEND` chooses one of
+* `memory`: an LRU cache in each worker (the default). Nothing is shared, and nothing survives a restart.
+* `sqlite`: a SQLite file (`CACHE_SQLITE_PATH`), shared by every worker on a node and kept across restarts.
+* `redis`: any server speaking the Redis protocol (Redis, Valkey, KeyDB...) at `CACHE_REDIS_URL`,
+  shared by every worker of every node. Limits on its size are the server's `maxmemory` settings.
+
+Every backend stores bytes under string keys, with an optional time to live in seconds.
+Keys are namespaced by `CACHE_KEY_PREFIX` and the rcpchgrowth version, so results of another version are never served
+(SQLite tables of another version are dropped as the file is opened; Redis keys of another version expire).
+A cache which cannot be reached is a miss; its errors are counted in the `growth_api_cache_errors_total` metric,
+and logged at most once every `ERROR_LOG_SECONDS`.
+"""
+# standard imports
+import abc
+import itertools
+import os
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from importlib.metadata import version
+from typing import Callable, Optional
+from urllib.parse import unquote, urlparse
+
+# local imports
+from .metrics import cache_errors_total
+from .settings import settings
+
+MEMORY = 'memory'
+SQLITE = 'sqlite'
+REDIS = 'redis'
+
+
+# errors of one cache are logged at most this often (each is counted in the metrics)
+ERROR_LOG_SECONDS = 60
+
+
+class CacheBackend(abc.ABC):
+    """The operations every cache backend provides"""
+
+    # whether operations wait on file or network I/O, so should not be called from the event loop
+    blocking = True
+
+    @abc.abstractmethod
+    def get(self, key: str) -> Optional[bytes]:
+        """Returns the value stored under the key, or None if there is none (or it has expired)"""
+
+    @abc.abstractmethod
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None):
+        """Stores the value under the key, for `ttl` seconds if given"""
+
+    @abc.abstractmethod
+    def delete(self, key: str):
+        """Removes the key, if it is stored"""
+
+    @abc.abstractmethod
+    def clear(self):
+        """Removes every entry of this cache (other caches sharing the server or file are untouched)"""
+
+
+class ErrorLog:
+    """
+    Counts the errors of a cache backend, and logs them at most once every `ERROR_LOG_SECONDS`,
+    so that an unavailable cache does not log once per request
+    """
+
+    def __init__(self, backend: str):
+        self.backend = backend
+        self._logged_at = None
+        self._unlogged = 0
+        self._lock = threading.Lock()
+
+    def error(self, message: str):
+        cache_errors_total.labels(backend=self.backend).inc()
+        now = time.monotonic()
+        with self._lock:
+            if self._logged_at is not None and now - self._logged_at < ERROR_LOG_SECONDS:
+                self._unlogged += 1
+                return
+            unlogged, self._unlogged, self._logged_at = self._unlogged, 0, now
+        print(message + (f' ({unlogged} more cache errors since the last was logged)' if unlogged else ''))
+
+
+class MemoryCache(CacheBackend):
+    """Thread-safe LRU cache held by this process, bounded by number of entries"""
+
+    blocking = False
+
+    def __init__(self, max_entries: int, on_evict: Optional[Callable[[int], None]] = None):
+        self.max_entries = max_entries
+        self.on_evict = on_evict
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires is not None and expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None):
+        evicted = 0
+        with self._lock:
+            self._entries[key] = (None if ttl is None else time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                evicted += 1
+        if evicted and self.on_evict is not None:
+            self.on_evict(evicted)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteCache(CacheBackend):
+    """
+    Cache in a table of a SQLite file, which every worker on the node opens. Each thread has its own connection.
+    Beyond `max_entries`, the entries written longest ago are removed (checked every `PRUNE_INTERVAL` writes).
+    If the file is locked for longer than the timeout, or cannot be written, gets miss and sets are dropped.
+    Tables are recorded in `TABLES` with their `family`: a table of the same family is the same cache of another
+    rcpchgrowth version, and is dropped as this one is opened.
+    """
+    PRUNE_INTERVAL = 100
+    TABLES = 'cache_tables'
+
+    def __init__(self, path: str, table: str, max_entries: int, on_evict: Optional[Callable[[int], None]] = None, timeout: float = 10, family: Optional[str] = None):
+        if not table.isidentifier() or table == self.TABLES:
+            raise ValueError(f'Invalid cache table name: {table}')
+        self.path = path
+        self.table = table
+        self.max_entries = max_entries
+        self.on_evict = on_evict
+        self.timeout = timeout
+        self._local = threading.local()
+        self._writes = itertools.count(1)
+        self._errors = ErrorLog(SQLITE)
+        connection = self._connection()
+        connection.execute(f'CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL, written REAL NOT NULL)')
+        connection.execute(f'CREATE INDEX IF NOT EXISTS {table}_written ON {table} (written)')
+        if family is not None:
+            try:
+                self._drop_stale_tables(connection, family)
+            except sqlite3.Error as error:
+                self._unavailable(error)
+
+    def _drop_stale_tables(self, connection: sqlite3.Connection, family: str):
+        connection.execute(f'CREATE TABLE IF NOT EXISTS {self.TABLES} (name TEXT PRIMARY KEY, family TEXT NOT NULL)')
+        connection.execute(f'INSERT OR REPLACE INTO {self.TABLES} (name, family) VALUES (?, ?)', (self.table, family))
+        stale = [name for name, in connection.execute(f'SELECT name FROM {self.TABLES} WHERE family = ? AND name != ?', (family, self.table))]
+        for name in stale:
+            # names were checked as identifiers when they were recorded
+            connection.execute(f'DROP TABLE IF EXISTS {name}')
+            connection.execute(f'DELETE FROM {self.TABLES} WHERE name = ?', (name,))
+        if stale:
+            print(f'Dropped cache tables of other rcpchgrowth versions: {", ".join(stale)}')
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            # readers do not block the writer (or each other), across processes
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def __len__(self) -> int:
+        return self._connection().execute(f'SELECT COUNT(*) FROM {self.table}').fetchone()[0]
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            row = self._connection().execute(f'SELECT value, expires FROM {self.table} WHERE key = ?', (key,)).fetchone()
+        except sqlite3.Error as error:
+            self._unavailable(error)
+            return None
+        if row is None:
+            return None
+        value, expires = row
+        if expires is not None and expires <= time.time():
+            self.delete(key)
+            return None
+        return value
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None):
+        now = time.time()
+        try:
+            connection = self._connection()
+            connection.execute(
+                f'INSERT OR REPLACE INTO {self.table} (key, value, expires, written) VALUES (?, ?, ?, ?)',
+                (key, value, None if ttl is None else now + ttl, now))
+            if next(self._writes) % self.PRUNE_INTERVAL == 0:
+                self.prune()
+        except sqlite3.Error as error:
+            self._unavailable(error)
+
+    def _unavailable(self, error: sqlite3.Error):
+        # the cache is only an optimisation: a locked or full database is a miss or a dropped set
+        self._errors.error(f'Cache file {self.path} unavailable ({error}).')
+
+    def prune(self):
+        """Removes expired entries, then the oldest entries beyond `max_entries`"""
+        connection = self._connection()
+        removed = connection.execute(f'DELETE FROM {self.table} WHERE expires IS NOT NULL AND expires <= ?', (time.time(),)).rowcount
+        removed += connection.execute(
+            f'DELETE FROM {self.table} WHERE key IN (SELECT key FROM {self.table} ORDER BY written DESC LIMIT -1 OFFSET ?)',
+            (self.max_entries,)).rowcount
+        if removed and self.on_evict is not None:
+            self.on_evict(removed)
+
+    def delete(self, key: str):
+        try:
+            self._connection().execute(f'DELETE FROM {self.table} WHERE key = ?', (key,))
+        except sqlite3.Error as error:
+            self._unavailable(error)
+
+    def clear(self):
+        self._connection().execute(f'DELETE FROM {self.table}')
+
+
+class RedisError(Exception):
+    """An error reply from the Redis server"""
+
+
+class RedisLoginError(RedisError):
+    """An error reply to AUTH or SELECT, as a connection is opened"""
+
+
+class RedisCache(CacheBackend):
+    """
+    Cache on a Redis protocol server. Speaks just enough RESP for GET, SET, DEL and SCAN,
+    so no client library is needed. Each thread has its own connection.
+    The cache is only an optimisation, so if the server cannot be reached, or cannot be logged in to, gets miss
+    and sets are dropped, and the server is not tried again for `RETRY_SECONDS`. Other error replies
+    (out of memory, for example) are a miss or a dropped set.
+    """
+    RETRY_SECONDS = 5
+
+    def __init__(self, url: str, namespace: str, timeout: float = 1.0):
+        parsed = urlparse(url)
+        if parsed.scheme != 'redis':
+            raise ValueError(f'Unsupported cache URL scheme: {parsed.scheme}')
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.username = unquote(parsed.username) if parsed.username else None
+        self.database = int(parsed.path.lstrip('/') or 0)
+        self.namespace = namespace
+        self.timeout = timeout
+        self._local = threading.local()
+        self._unavailable_until = 0.0
+        self._errors = ErrorLog(REDIS)
+
+    def _connect(self):
+        connection = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        try:
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            reader = connection.makefile('rb')
+            if self.password is not None:
+                self._exchange(connection, reader, 'AUTH', *([self.username] if self.username else []), self.password)
+            if self.database:
+                self._exchange(connection, reader, 'SELECT', str(self.database))
+        # an unauthenticated connection, or one on the wrong database, is never kept
+        except RedisError as error:
+            connection.close()
+            raise RedisLoginError(*error.args) from error
+        except BaseException:
+            connection.close()
+            raise
+        self._local.connection = connection
+        self._local.reader = reader
+
+    def command(self, *arguments):
+        """Sends a command and returns its reply, reconnecting once if the connection was lost"""
+        try:
+            if getattr(self._local, 'connection', None) is None:
+                self._connect()
+            return self._send(*arguments)
+        except (ConnectionError, socket.timeout, OSError):
+            self._close()
+            self._connect()
+            return self._send(*arguments)
+
+    def _close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+        self._local.connection = None
+
+    def _send(self, *arguments):
+        return self._exchange(self._local.connection, self._local.reader, *arguments)
+
+    def _exchange(self, connection: socket.socket, reader, *arguments):
+        encoded = [argument if isinstance(argument, bytes) else str(argument).encode('utf-8') for argument in arguments]
+        request = b'*%d\r\n' % len(encoded) + b''.join(b'$%d\r\n%s\r\n' % (len(argument), argument) for argument in encoded)
+        connection.sendall(request)
+        return self._reply(reader)
+
+    def _reply(self, reader):
+        line = reader.readline()
+        if not line:
+            raise ConnectionError('Connection closed by the cache server')
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest.decode('utf-8')
+        if kind == b'-':
+            raise RedisError(rest.decode('utf-8'))
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            length = int(rest)
+            if length < 0:
+                return None
+            value = reader.read(length + 2)
+            return value[:-2]
+        if kind == b'*':
+            length = int(rest)
+            return None if length < 0 else [self._reply(reader) for _ in range(length)]
+        raise RedisError(f'Unexpected reply from the cache server: {line!r}')
+
+    def _key(self, key: str) -> str:
+        return f'{self.namespace}:{key}'
+
+    def _available_command(self, *arguments):
+        """As `command`, but returns None without waiting if the server is unavailable"""
+        if time.monotonic() < self._unavailable_until:
+            return None
+        try:
+            return self.command(*arguments)
+        except OSError as error:
+            self._close()
+            self._unavailable_until = time.monotonic() + self.RETRY_SECONDS
+            self._errors.error(f'Cache server {self.host}:{self.port} unavailable ({error}), retrying in {self.RETRY_SECONDS} seconds.')
+            return None
+        except RedisError as error:
+            # an error reply (out of memory, read only replica, failed authentication...) is a miss or a dropped set.
+            # The connection is closed, in case the reply was not read to its end
+            self._close()
+            if isinstance(error, RedisLoginError):
+                self._unavailable_until = time.monotonic() + self.RETRY_SECONDS
+            self._errors.error(f'Cache server {self.host}:{self.port} replied with an error ({error}).')
+            return None
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._available_command('GET', self._key(key))
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None):
+        if ttl is None:
+            self._available_command('SET', self._key(key), value)
+        else:
+            self._available_command('SET', self._key(key), value, 'PX', max(int(ttl * 1000), 1))
+
+    def delete(self, key: str):
+        self._available_command('DEL', self._key(key))
+
+    def clear(self):
+        cursor = '0'
+        while True:
+            cursor, keys = self.command('SCAN', cursor, 'MATCH', f'{self.namespace}:*', 'COUNT', 1000)
+            cursor = cursor.decode('utf-8')
+            if keys:
+                self.command('DEL', *keys)
+            if cursor == '0':
+                return
+
+
+def key_namespace(name: str) -> str:
+    """Namespace of a cache's keys: the configured prefix, the rcpchgrowth version and the cache's name"""
+    return f'{settings.cache_key_prefix}{version("rcpchgrowth")}:{name}'
+
+
+def cache_backend(name: str, max_entries: int, backend: Optional[str] = None, on_evict: Optional[Callable[[int], None]] = None) -> CacheBackend:
+    """Returns the backend chosen in the server settings (or `backend`) for the named cache"""
+    backend = backend or settings.cache_backend
+    if backend == MEMORY:
+        return MemoryCache(max_entries, on_evict=on_evict)
+    if backend == SQLITE:
+        path = settings.cache_sqlite_path or os.path.join(tempfile.gettempdir(), 'growth-api-cache.sqlite3')
+        table = ''.join(character if character.isalnum() else '_' for character in key_namespace(name))
+        # the same cache of another rcpchgrowth version is the same family
+        return SQLiteCache(path, f'cache_{table}', max_entries, on_evict=on_evict, family=f'{settings.cache_key_prefix}:{name}')
+    if backend == REDIS:
+        return RedisCache(settings.cache_redis_url, key_namespace(name))
+    raise ValueError(f'Unknown cache backend: {backend}. Use {MEMORY}, {SQLITE} or {REDIS}.')
@@ -0,0 +1,117 @@
+"""
+Bounded cache of single measurement calculations.
+
+The same historic measurements are often recalculated each time a patient record is opened. Results are cached by
+reference and every calculation input; free text (`events_text` and `bone_age_text`) is not part of the key,
+is not stored, and is attached to each result as it is returned. Results are stored as JSON, in the configured
+cache backend (see `cache_backends`), so every hit is a fresh copy. Entries expire after `CALCULATION_CACHE_TTL_SECONDS`,
+and beyond `CALCULATION_CACHE_MAX_ENTRIES` the least recently used are evicted. Clients may opt out with a `Cache-Control: no-cache` (calculate afresh)
+or `no-store` (calculate afresh and do not keep the result) request header.
+"""
+# standard imports
+import hashlib
+import threading
+from typing import Callable, Optional
+
+# local imports
+from .cache_backends import CacheBackend, cache_backend
+from .json_encoding import decode_json, json_encoder
+from .metrics import calculation_cache_evictions_total, calculation_cache_requests_total
+from .settings import settings
+
+FREE_TEXT_FIELDS = {'events_text', 'bone_age_text'}
+
+# `use_cache` values: read and store, store only, or neither
+USE = 'use'
+REFRESH = 'refresh'
+BYPASS = 'bypass'
+
+
+def calculation_cache_key(reference: str, measurement_request) -> tuple:
+    """Every input of a calculation except free text, so that requests differing only in their notes share a result"""
+    inputs = measurement_request.model_dump(exclude=FREE_TEXT_FIELDS)
+    inputs['observation_value'] = float(inputs['observation_value'])
+    return (reference, *sorted(inputs.items()))
+
+
+def cache_control(headers) -> str:
+    """Returns how a request may use the calculation cache, from its `Cache-Control` header"""
+    directives = {directive.strip().lower() for directive in headers.get('cache-control', '').split(',')}
+    if 'no-store' in directives:
+        return BYPASS
+    if 'no-cache' in directives:
+        return REFRESH
+    return USE
+
+
+def with_free_text(measurement: dict, bone_age_text: Optional[str], events_text: Optional[list]) -> dict:
+    """Sets the free text of a measurement everywhere rcpchgrowth writes it, and returns the measurement"""
+    if measurement.get('bone_age') is not None:
+        measurement['bone_age']['bone_age_text'] = bone_age_text
+    if measurement.get('events_data') is not None:
+        measurement['events_data']['events_text'] = events_text
+    for age_data in (measurement.get('plottable_data') or {}).values():
+        for data in age_data.values():
+            data['events_text'] = events_text
+            data['bone_age_label'] = bone_age_text
+    return measurement
+
+
+class CalculationCache:
+    """Calculation results, kept in a cache backend with an expiry time for each entry"""
+
+    def __init__(self, backend: CacheBackend, ttl_seconds: float):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple, calculate: Callable[[], dict], bone_age_text: Optional[str] = None, events_text: Optional[list] = None, use_cache: str = USE) -> dict:
+        """
+        Returns the cached result for the key, or the result of `calculate`, which is cached.
+        Either way the free text given is attached to the result.
+        """
+        if self.backend is None or use_cache == BYPASS:
+            calculation_cache_requests_total.labels(result='bypass').inc()
+            return calculate()
+        backend_key = hashlib.sha256(repr(key).encode('utf-8')).hexdigest()
+        body = self.backend.get(backend_key) if use_cache == USE else None
+        if body is not None:
+            with self._lock:
+                self.hits += 1
+            calculation_cache_requests_total.labels(result='hit').inc()
+            return with_free_text(decode_json(body), bone_age_text, events_text)
+        with self._lock:
+            self.misses += 1
+        calculation_cache_requests_total.labels(result='miss').inc()
+        measurement = calculate()
+        # the stored copy carries no free text
+        self.backend.set(backend_key, json_encoder(settings.json_encoder)(with_free_text(measurement, None, None)), ttl=self.ttl_seconds)
+        return with_free_text(measurement, bone_age_text, events_text)
+
+    @property
+    def blocking(self) -> bool:
+        """True if lookups wait on file or network I/O (a `sqlite` or `redis` backend)"""
+        return self.backend is not None and self.backend.blocking
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+
+calculation_cache = CalculationCache(
+    cache_backend(
+        'calculations',
+        settings.calculation_cache_max_entries,
+        on_evict=calculation_cache_evictions_total.inc
+    ) if settings.calculation_cache_max_entries else None,
+    ttl_seconds=settings.calculation_cache_ttl_seconds
+)
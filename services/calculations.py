@@ -0,0 +1,115 @@
+"""
+Centile and SDS calculations shared by the reference routers
+"""
+# third party imports
+import numpy as np
+from pydantic import ValidationError
+from starlette.concurrency import run_in_threadpool
+
+# RCPCH imports
+from rcpchgrowth import Measurement
+
+# local imports
+from schemas import BulkCalculationRequest, MeasurementRequest
+from .calculation_cache import BYPASS, USE, calculation_cache, calculation_cache_key
+from .lms_engine import centiles_for_sds, sds_for_measurements
+
+
+def calculate_measurement(reference: str, measurement_request: MeasurementRequest, use_cache: str = USE) -> dict:
+    """
+    Returns the rcpchgrowth measurement object for a single validated request against the given reference,
+    from the calculation cache if the same measurement has been calculated recently.
+    """
+    return calculation_cache.get(
+        calculation_cache_key(reference, measurement_request),
+        lambda: measurement_object(reference, measurement_request),
+        bone_age_text=measurement_request.bone_age_text,
+        events_text=measurement_request.events_text,
+        use_cache=use_cache)
+
+
+async def calculate_measurement_async(reference: str, measurement_request: MeasurementRequest, use_cache: str = USE) -> dict:
+    """
+    As `calculate_measurement`, for async routes. If the calculation cache is kept in SQLite or Redis,
+    the lookup is file or network I/O, so it (and any calculation) runs in the threadpool rather than on the event loop.
+    """
+    if calculation_cache.blocking and use_cache != BYPASS:
+        return await run_in_threadpool(calculate_measurement, reference, measurement_request, use_cache)
+    return calculate_measurement(reference, measurement_request, use_cache)
+
+
+def measurement_object(reference: str, measurement_request: MeasurementRequest) -> dict:
+    return Measurement(
+        reference=reference,
+        birth_date=measurement_request.birth_date,
+        gestation_days=measurement_request.gestation_days,
+        gestation_weeks=measurement_request.gestation_weeks,
+        measurement_method=measurement_request.measurement_method,
+        observation_date=measurement_request.observation_date,
+        observation_value=measurement_request.observation_value,
+        sex=measurement_request.sex,
+        bone_age=measurement_request.bone_age,
+        bone_age_centile=measurement_request.bone_age_centile,
+        bone_age_sds=measurement_request.bone_age_sds,
+        bone_age_text=measurement_request.bone_age_text,
+        bone_age_type=measurement_request.bone_age_type,
+        events_text=measurement_request.events_text
+    ).measurement
+
+
+def calculate_measurements(reference: str, measurement_requests: list, use_cache: str = USE) -> list:
+    """
+    Validates and calculates each item of a batch independently.
+    An item which fails validation or calculation is returned with an error in place of its measurement,
+    so one bad row does not fail the whole batch.
+    """
+    return [calculate_item(reference, item, use_cache) for item in measurement_requests]
+
+
+def calculate_item(reference: str, item: dict, use_cache: str = USE) -> dict:
+    """
+    Validates and calculates one unvalidated measurement request,
+    returning either the measurement or the reason it could not be calculated.
+    """
+    try:
+        measurement_request = MeasurementRequest.model_validate(item)
+        return {
+            "measurement": calculate_measurement(reference, measurement_request, use_cache),
+            "error": None
+        }
+    except Exception as err:
+        return {
+            "measurement": None,
+            "error": error_message(err)
+        }
+
+
+def error_message(err: Exception) -> str:
+    if isinstance(err, ValidationError):
+        return "; ".join(
+            f"{'.'.join(str(location) for location in error['loc'])}: {error['msg']}" for error in err.errors()
+        )
+    return str(err)
+
+
+def bulk_calculation(reference: str, bulk_calculation_request: BulkCalculationRequest) -> dict:
+    """
+    Returns the SDS and centile of every measurement in a bulk request, using the vectorised LMS engine.
+    Measurements for which there is no reference data have an SDS and centile of None.
+    """
+    sds = sds_for_measurements(
+        reference,
+        ages=bulk_calculation_request.decimal_ages,
+        sexes=bulk_calculation_request.sexes,
+        measurement_methods=bulk_calculation_request.measurement_methods,
+        observation_values=bulk_calculation_request.observation_values
+    )
+    centiles = centiles_for_sds(sds)
+    return {
+        "sds": none_for_nan(sds),
+        "centiles": none_for_nan(centiles)
+    }
+
+
+def none_for_nan(values: np.ndarray) -> list:
+    return [None if value != value else value for value in values.tolist()]
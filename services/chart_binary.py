@@ -0,0 +1,131 @@
+"""
+Compact binary format for chart data.
+
+A chart data set (the `create_chart` output stored in `chart-data/`) is packed as:
+* an 8 byte magic number and a little-endian uint32 header length (padded to 16 bytes)
+* a JSON header, padded to a multiple of 8 bytes, holding the chart data with each
+  centile line's `data` replaced by the label, offset and number of points of its arrays
+* the x (decimal age) and y (measurement) values of each centile line, as packed arrays
+
+The arrays can be read with NumPy (or a `memoryview`) straight from the file bytes or an mmap,
+and the chart data is rebuilt in its JSON shape on demand.
+"""
+# standard imports
+import json
+import struct
+from typing import Iterator, Optional
+
+# third party imports
+import numpy as np
+
+MAGIC = b'RCPCHCD1'
+PREAMBLE = struct.Struct('<8sI4x')
+ALIGNMENT = 8
+
+
+def _padded(length: int) -> int:
+    return -(-length // ALIGNMENT) * ALIGNMENT
+
+
+def _walk_lines(chart_data: list) -> Iterator[tuple]:
+    """Yields (reference, sex, measurement_method, centile lines) for every list of centile lines"""
+    for reference_data in chart_data:
+        for reference, sexes in reference_data.items():
+            for sex, measurement_methods in (sexes or {}).items():
+                for measurement_method, centile_lines in (measurement_methods or {}).items():
+                    if centile_lines is not None:
+                        yield reference, sex, measurement_method, centile_lines
+
+
+def pack_chart_data(chart_data: list, dtype: str = '<f4', decimals: Optional[int] = 4) -> bytes:
+    """
+    Packs chart data into the binary format.
+    With the default float32 arrays, values are rounded to `decimals` places when unpacked, which restores
+    the 4 d.p. values of `create_chart` exactly. Use `dtype='<f8', decimals=None` to store values as they are.
+    """
+    dtype = np.dtype(dtype)
+    skeleton = json.loads(json.dumps(chart_data))
+    arrays = []
+    offset = 0
+    for _, _, _, centile_lines in _walk_lines(skeleton):
+        for centile_line in centile_lines:
+            points = centile_line['data']
+            if points is None:
+                continue
+            label = points[0]['l'] if points else centile_line['centile']
+            if any(point['l'] != label for point in points):
+                raise ValueError("Every point of a centile line must have the same label to be packed")
+            x = np.array([point['x'] for point in points], dtype=np.float64)
+            y = np.array([np.nan if point['y'] is None else point['y'] for point in points], dtype=np.float64)
+            centile_line['data'] = {"label": label, "offset": offset, "count": len(points)}
+            arrays.extend((x.astype(dtype), y.astype(dtype)))
+            offset += 2 * len(points) * dtype.itemsize
+
+    header = json.dumps({"dtype": dtype.str, "decimals": decimals, "chart_data": skeleton}, separators=(',', ':')).encode('utf-8')
+    header += b' ' * (_padded(len(header)) - len(header))
+    return b''.join([PREAMBLE.pack(MAGIC, len(header)), header] + [array.tobytes() for array in arrays])
+
+
+class BinaryChartData:
+    """
+    Read-only view of packed chart data held in `buffer` (bytes, memoryview or mmap).
+    The arrays are not copied until the chart data is rebuilt.
+    """
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        magic, header_length = PREAMBLE.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            raise ValueError("Not packed chart data")
+        header = json.loads(bytes(buffer[PREAMBLE.size:PREAMBLE.size + header_length]))
+        self.dtype = np.dtype(header['dtype'])
+        self.decimals = header['decimals']
+        self.skeleton = header['chart_data']
+        self.data_offset = PREAMBLE.size + header_length
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def arrays(self, data: dict) -> tuple:
+        """Returns the (x, y) arrays of a packed centile line"""
+        count = data['count']
+        offset = self.data_offset + data['offset']
+        x = np.frombuffer(self.buffer, dtype=self.dtype, count=count, offset=offset)
+        y = np.frombuffer(self.buffer, dtype=self.dtype, count=count, offset=offset + count * self.dtype.itemsize)
+        return x, y
+
+    def lines(self) -> Iterator[tuple]:
+        """Yields (reference, sex, measurement_method, sds, centile, x, y) for every centile line with data"""
+        for reference, sex, measurement_method, centile_lines in _walk_lines(self.skeleton):
+            for centile_line in centile_lines:
+                if centile_line['data'] is not None:
+                    x, y = self.arrays(centile_line['data'])
+                    yield reference, sex, measurement_method, centile_line['sds'], centile_line['centile'], x, y
+
+    def _values(self, array: np.ndarray) -> list:
+        values = array.astype(np.float64)
+        if self.decimals is not None:
+            values = np.round(values, self.decimals)
+        return values.tolist()
+
+    def _points(self, data: Optional[dict]) -> Optional[list]:
+        if data is None:
+            return None
+        x, y = self.arrays(data)
+        label = data['label']
+        return [
+            {"l": label, "x": x_value, "y": None if y_value != y_value else y_value}
+            for x_value, y_value in zip(self._values(x), self._values(y))
+        ]
+
+    def chart_data(self) -> list:
+        """Rebuilds the chart data in the JSON shape of `create_chart`"""
+        chart_data = json.loads(json.dumps(self.skeleton))
+        for _, _, _, centile_lines in _walk_lines(chart_data):
+            for centile_line in centile_lines:
+                centile_line['data'] = self._points(centile_line['data'])
+        return chart_data
+
+
+def unpack_chart_data(buffer) -> list:
+    return BinaryChartData(buffer).chart_data()
@@ -0,0 +1,225 @@
+"""
+Bounded LRU cache for custom centile charts.
+With a shared cache backend (`sqlite` or `redis`), charts are also kept there, so each chart is created once for every worker.
+"""
+# standard imports
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+# third party imports
+from starlette.concurrency import run_in_threadpool
+
+# RCPCH imports
+from rcpchgrowth import create_chart
+
+# local imports
+from .cache_backends import MEMORY, CacheBackend, cache_backend
+from .chart_responses import PreparedResponse, prepare_chart_response
+from .executor import run_cpu_heavy
+from .metrics import chart_cache_evictions_total, chart_cache_requests_total, create_chart_duration_seconds
+from .settings import settings
+
+
+def chart_cache_key(reference: str, centile_format: list, measurement_method: str, sex: str, is_sds: bool) -> tuple:
+    """
+    Normalises custom chart parameters, so that (for example) [50] and [50.0] share a cache entry.
+    The order of the centiles is kept, as it is the order of the lines in the chart.
+    """
+    return (reference, sex, measurement_method, tuple(float(value) for value in centile_format), bool(is_sds))
+
+
+def custom_chart_body(reference: str, centile_format: list, measurement_method: str, sex: str, is_sds: bool) -> bytes:
+    """Creates a custom chart and returns its serialised `Centile_Data` response"""
+    started = time.perf_counter()
+    chart_data = create_chart(
+        reference,
+        centile_format,
+        measurement_method=measurement_method,
+        sex=sex,
+        is_sds=is_sds)
+    create_chart_duration_seconds.labels(reference=reference).observe(time.perf_counter() - started)
+    return prepare_chart_response(chart_data).body
+
+
+class ChartCache:
+    """
+    Thread-safe LRU cache of prepared custom chart responses.
+    Bounded by number of entries and total bytes. If a spill directory is given,
+    evicted entries are written there and read back on a later request rather than recreated.
+    If a shared cache backend is given, charts not held by this worker are looked for there before they are created.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, spill_directory: Optional[str] = None, max_spill_entries: int = 0, shared: Optional[CacheBackend] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.spill_directory = Path(spill_directory) if spill_directory else None
+        self.max_spill_entries = max_spill_entries
+        self.shared = shared
+        self.hits = 0
+        self.disk_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if self.spill_directory is not None:
+            self.spill_directory.mkdir(parents=True, exist_ok=True)
+
+    def get_response(self, reference: str, centile_format: list, measurement_method: str, sex: str, is_sds: bool) -> PreparedResponse:
+        """
+        Returns the prepared response for a custom chart, creating it with `create_chart` only if it is not cached.
+        """
+        key = chart_cache_key(reference, centile_format, measurement_method, sex, is_sds)
+        prepared = self._cached(key)
+        if prepared is not None:
+            return prepared
+
+        prepared = self._read_spilled(key) or self._read_shared(key)
+        if prepared is None:
+            self._count_miss()
+            prepared = PreparedResponse(custom_chart_body(reference, centile_format, measurement_method, sex, is_sds))
+            self._store_shared(key, prepared)
+
+        self._store(key, prepared)
+        return prepared
+
+    async def get_response_async(self, reference: str, centile_format: list, measurement_method: str, sex: str, is_sds: bool) -> PreparedResponse:
+        """
+        As `get_response`, for async routes: cache hits are returned directly, spilled charts are read in the threadpool
+        and new charts are created on the process pool (or CPU executor).
+        """
+        key = chart_cache_key(reference, centile_format, measurement_method, sex, is_sds)
+        prepared = self._cached(key)
+        if prepared is not None:
+            return prepared
+
+        if self.spill_directory is not None:
+            prepared = await run_in_threadpool(self._read_spilled, key)
+        if prepared is None and self.shared is not None:
+            prepared = await run_in_threadpool(self._read_shared, key)
+        if prepared is None:
+            self._count_miss()
+            prepared = PreparedResponse(await run_cpu_heavy(custom_chart_body, reference, centile_format, measurement_method, sex, is_sds))
+            if self.shared is not None:
+                await run_in_threadpool(self._store_shared, key, prepared)
+
+        if self.spill_directory is not None:
+            await run_in_threadpool(self._store, key, prepared)
+        else:
+            self._store(key, prepared)
+        return prepared
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _cached(self, key: tuple) -> Optional[PreparedResponse]:
+        with self._lock:
+            prepared = self._entries.get(key)
+            if prepared is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        if prepared is not None:
+            chart_cache_requests_total.labels(result='hit').inc()
+        return prepared
+
+    def _count_miss(self):
+        with self._lock:
+            self.misses += 1
+        chart_cache_requests_total.labels(result='miss').inc()
+
+    def _store(self, key: tuple, prepared: PreparedResponse):
+        size = len(prepared.body)
+        if size > self.max_bytes:
+            return
+        evicted = []
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = prepared
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                evicted_key, evicted_response = self._entries.popitem(last=False)
+                self._bytes -= len(evicted_response.body)
+                self.evictions += 1
+                evicted.append((evicted_key, evicted_response))
+        chart_cache_evictions_total.inc(len(evicted))
+        for evicted_key, evicted_response in evicted:
+            self._spill(evicted_key, evicted_response)
+
+    @staticmethod
+    def _key_digest(key: tuple) -> str:
+        return hashlib.sha256(repr(key).encode("utf-8")).hexdigest()
+
+    def _spill_path(self, key: tuple) -> Path:
+        return self.spill_directory / f'{self._key_digest(key)}.json'
+
+    def _spill(self, key: tuple, prepared: PreparedResponse):
+        if self.spill_directory is None:
+            return
+        path = self._spill_path(key)
+        # write to a temporary file first so another worker never reads a partial file
+        temporary_path = path.with_suffix(f'.{os.getpid()}.tmp')
+        temporary_path.write_bytes(prepared.body)
+        os.replace(temporary_path, path)
+        if self.max_spill_entries:
+            spilled = sorted(self.spill_directory.glob('*.json'), key=lambda spilled_path: spilled_path.stat().st_mtime)
+            for old_path in spilled[:-self.max_spill_entries]:
+                old_path.unlink(missing_ok=True)
+
+    def _read_spilled(self, key: tuple) -> Optional[PreparedResponse]:
+        if self.spill_directory is None:
+            return None
+        try:
+            prepared = PreparedResponse(self._spill_path(key).read_bytes())
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            self.disk_hits += 1
+        chart_cache_requests_total.labels(result='disk_hit').inc()
+        return prepared
+
+
+    def _read_shared(self, key: tuple) -> Optional[PreparedResponse]:
+        if self.shared is None:
+            return None
+        body = self.shared.get(self._key_digest(key))
+        if body is None:
+            return None
+        with self._lock:
+            self.shared_hits += 1
+        chart_cache_requests_total.labels(result='shared_hit').inc()
+        return PreparedResponse(body)
+
+    def _store_shared(self, key: tuple, prepared: PreparedResponse):
+        if self.shared is not None:
+            self.shared.set(self._key_digest(key), prepared.body)
+
+
+chart_cache = ChartCache(
+    max_entries=settings.chart_cache_max_entries,
+    max_bytes=settings.chart_cache_max_mb * 1_000_000,
+    spill_directory=settings.chart_cache_spill_directory,
+    max_spill_entries=settings.chart_cache_max_spill_entries,
+    # this worker's own charts are held above, so an in-process backend would only hold them twice
+    shared=None if settings.cache_backend == MEMORY else cache_backend('charts', settings.chart_cache_max_shared_entries)
+)
@@ -0,0 +1,207 @@
+"""
+Level of detail for chart coordinates: age windows and simplified centile lines.
+
+Each point of a centile line is ranked once, by the order in which Visvalingam-Whyatt simplification would remove it
+(the point making the smallest triangle with its neighbours goes first, so the points that shape the curve are kept
+longest). Any level of detail is then a selection of the highest ranked points, without simplifying again.
+Areas are measured with ages and measurements scaled to the size of the chart, as the curve would be drawn.
+
+Responses may also be returned in the columnar format, in which each centile line carries its label once, with
+parallel lists of ages and measurements in place of a list of points.
+
+They may be returned as MessagePack or Arrow, rather than JSON, if the request's `Accept` header asks for them.
+
+Simplified, columnar and binary responses are prepared once and kept in a bounded LRU cache, by data set, level of
+detail, format and media type.
+"""
+# standard imports
+import heapq
+import json
+import threading
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from typing import Optional
+
+# local imports
+from .binary_encoding import ARROW_STREAM, JSON, encode_chart
+from .chart_responses import PreparedResponse, columnar_content
+from .executor import run_cpu_bound
+from .json_encoding import render_json
+from .settings import settings
+
+# response formats: a list of points for each centile line, or parallel lists of ages and measurements
+POINTS = 'points'
+COLUMNAR = 'columnar'
+
+
+def removal_ranks(x: list, y: list) -> list:
+    """
+    Returns the rank of each point: the order in which Visvalingam-Whyatt simplification removes it, from 0.
+    The first and last points are never removed, so rank last. Points without a measurement are kept as breaks in the line.
+    """
+    count = len(x)
+    ranks = [0] * count
+    previous = list(range(-1, count - 1))
+    following = list(range(1, count + 1))
+
+    def area(index: int) -> float:
+        before, after = previous[index], following[index]
+        if y[index] is None or y[before] is None or y[after] is None:
+            return float('inf')
+        return abs((x[index] - x[before]) * (y[after] - y[before]) - (x[after] - x[before]) * (y[index] - y[before])) / 2
+
+    heap = [(area(index), index) for index in range(1, count - 1)]
+    heapq.heapify(heap)
+    areas = {index: point_area for point_area, index in heap}
+    rank = 0
+    largest_removed = 0.0
+    while heap:
+        point_area, index = heapq.heappop(heap)
+        if areas.get(index) != point_area:
+            # superseded by a later area for this point
+            continue
+        del areas[index]
+        # a point's area never counts as less than one already removed, so that ranks follow the order of removal
+        largest_removed = max(largest_removed, point_area)
+        ranks[index] = rank
+        rank += 1
+        before, after = previous[index], following[index]
+        following[before], previous[after] = after, before
+        for neighbour in (before, after):
+            if neighbour in areas:
+                areas[neighbour] = max(area(neighbour), largest_removed)
+                heapq.heappush(heap, (areas[neighbour], neighbour))
+    for index in (0, count - 1) if count > 1 else (0,):
+        ranks[index] = rank
+        rank += 1
+    return ranks
+
+
+def _centile_lines(content: dict):
+    """Yields (sex, measurement_method, centile index, centile line) for every centile line of a `Centile_Data` content"""
+    for reference_data in content['centile_data']:
+        for sexes in reference_data.values():
+            for sex, measurement_methods in (sexes or {}).items():
+                for measurement_method, centile_lines in (measurement_methods or {}).items():
+                    for index, centile_line in enumerate(centile_lines or []):
+                        if centile_line['data'] is not None:
+                            yield sex, measurement_method, index, centile_line
+
+
+def chart_ranks(content: dict) -> list:
+    """Returns the removal ranks of the points of every centile line, in the order of `_centile_lines`"""
+    lines = [centile_line['data'] for _, _, _, centile_line in _centile_lines(content)]
+    ages = [point['x'] for points in lines for point in points]
+    measurements = [point['y'] for points in lines for point in points if point['y'] is not None]
+    age_scale = (max(ages) - min(ages)) or 1.0 if ages else 1.0
+    measurement_scale = (max(measurements) - min(measurements)) or 1.0 if measurements else 1.0
+    return [
+        removal_ranks(
+            [point['x'] / age_scale for point in points],
+            [None if point['y'] is None else point['y'] / measurement_scale for point in points])
+        for points in lines
+    ]
+
+
+def age_window(ages: list, age_min: Optional[float], age_max: Optional[float]) -> range:
+    """Returns the indices of the (sorted) ages within the window, with the age either side of it"""
+    start = 0 if age_min is None else max(bisect_right(ages, age_min) - 1, 0)
+    end = len(ages) if age_max is None else min(bisect_left(ages, age_max) + 1, len(ages))
+    if end <= start or (age_min is not None and ages[end - 1] < age_min) or (age_max is not None and ages[start] > age_max):
+        # the line lies wholly outside the window
+        return range(0)
+    return range(start, end)
+
+
+def detailed_content(content: dict, ranks: list, age_min: Optional[float], age_max: Optional[float], max_points: Optional[int]) -> dict:
+    """
+    Keeps only the points of the chart content in the age window, and simplifies each centile line to about `max_points`
+    across the chart. The points of a centile are shared between references in proportion to the points each has in the window.
+    The content is changed in place, and returned.
+    """
+    lines = list(_centile_lines(content))
+    windows = [age_window([point['x'] for point in centile_line['data']], age_min, age_max) for _, _, _, centile_line in lines]
+
+    points_per_centile = {}
+    for (sex, measurement_method, index, _), window in zip(lines, windows):
+        points_per_centile[(sex, measurement_method, index)] = points_per_centile.get((sex, measurement_method, index), 0) + len(window)
+
+    for (sex, measurement_method, index, centile_line), window, line_ranks in zip(lines, windows, ranks):
+        points = centile_line['data']
+        keep = len(window)
+        total = points_per_centile[(sex, measurement_method, index)]
+        if max_points is not None and total > max_points:
+            keep = min(len(window), max(2, round(max_points * len(window) / total)))
+        if keep < len(window):
+            # the window's own ends are always kept, then the highest ranked points within it
+            ends = {window.start, window.stop - 1}
+            inner = sorted(window[1:-1], key=lambda point_index: line_ranks[point_index], reverse=True)[:max(keep - 2, 0)]
+            window = sorted(ends.union(inner))
+        centile_line['data'] = [points[point_index] for point_index in window]
+    return content
+
+
+class ChartDetailCache:
+    """
+    Thread-safe LRU cache of chart responses at a level of detail, in the columnar format or in a binary media type, and of the point ranks of each data set.
+    Both are keyed by the digest of the full response, so standard and custom charts share the cache.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._responses = OrderedDict()
+        self._ranks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cached(self, entries: OrderedDict, key):
+        with self._lock:
+            value = entries.get(key)
+            if value is not None:
+                entries.move_to_end(key)
+            return value
+
+    def _store(self, entries: OrderedDict, key, value):
+        with self._lock:
+            entries[key] = value
+            entries.move_to_end(key)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+
+    def get_response(self, prepared: PreparedResponse, age_min: Optional[float], age_max: Optional[float], max_points: Optional[int], chart_format: str = POINTS, media_type: str = JSON) -> PreparedResponse:
+        """Returns the response at the requested level of detail, format and media type, preparing it only if it is not cached"""
+        if age_min is None and age_max is None and max_points is None and chart_format == POINTS and media_type == JSON:
+            return prepared
+        if media_type == ARROW_STREAM:
+            # an Arrow table is columnar whichever format is asked for
+            chart_format = POINTS
+        key = (prepared.digest, age_min, age_max, max_points, chart_format, media_type)
+        detailed = self._cached(self._responses, key)
+        if detailed is not None:
+            return detailed
+        content = json.loads(prepared.body)
+        if age_min is not None or age_max is not None or max_points is not None:
+            ranks = self._cached(self._ranks, prepared.digest)
+            if ranks is None:
+                ranks = chart_ranks(content)
+                self._store(self._ranks, prepared.digest, ranks)
+            content = detailed_content(content, ranks, age_min, age_max, max_points)
+        if chart_format == COLUMNAR:
+            content = columnar_content(content)
+        if media_type == JSON:
+            detailed = PreparedResponse(render_json(content))
+        else:
+            detailed = PreparedResponse(encode_chart(media_type, content), media_type)
+        self._store(self._responses, key, detailed)
+        return detailed
+
+    async def get_response_async(self, prepared: PreparedResponse, age_min: Optional[float], age_max: Optional[float], max_points: Optional[int], chart_format: str = POINTS, media_type: str = JSON) -> PreparedResponse:
+        """As `get_response`, for async routes: cached responses are returned directly, others are prepared on the CPU executor"""
+        if age_min is None and age_max is None and max_points is None and chart_format == POINTS and media_type == JSON:
+            return prepared
+        detailed = self._cached(self._responses, (prepared.digest, age_min, age_max, max_points, POINTS if media_type == ARROW_STREAM else chart_format, media_type))
+        if detailed is not None:
+            return detailed
+        return await run_cpu_bound(self.get_response, prepared, age_min, age_max, max_points, chart_format, media_type)
+
+
+chart_detail_cache = ChartDetailCache(max_entries=settings.chart_detail_cache_max_entries)
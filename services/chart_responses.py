@@ -0,0 +1,149 @@
+"""
+Pre-serialised responses for the standard chart coordinates
+"""
+# standard imports
+import hashlib
+
+# third party imports
+from fastapi import Request, Response
+
+# local imports
+from .compression import IDENTITY, compress, negotiate_encoding
+from .json_encoding import render_json
+
+SEXES = ['male', 'female']
+MEASUREMENT_METHODS = ['height', 'weight', 'ofc', 'bmi']
+
+
+def centile_data_content(chart_data: list) -> dict:
+    """
+    Returns chart data in the shape the `Centile_Data` response model produces:
+    every sex and measurement method present (or null), labels as strings and coordinates as floats.
+    """
+    centile_data = []
+    for reference_data in chart_data:
+        reference_content = {}
+        for reference, sexes in reference_data.items():
+            sex_content = {}
+            for sex in SEXES:
+                measurement_methods = sexes.get(sex)
+                if measurement_methods is None:
+                    sex_content[sex] = None
+                    continue
+                sex_content[sex] = {
+                    measurement_method: centiles_content(measurement_methods.get(measurement_method))
+                    for measurement_method in MEASUREMENT_METHODS
+                }
+            reference_content[reference] = sex_content
+        centile_data.append(reference_content)
+    return {'centile_data': centile_data}
+
+
+def centiles_content(centiles: list):
+    if centiles is None:
+        return None
+    return [
+        {
+            'sds': float(centile['sds']),
+            'centile': float(centile['centile']),
+            'data': None if centile['data'] is None else [
+                {
+                    'l': str(point['l']),
+                    'x': float(point['x']),
+                    'y': None if point['y'] is None else float(point['y'])
+                } for point in centile['data']
+            ]
+        } for centile in centiles
+    ]
+
+
+def columnar_content(content: dict) -> dict:
+    """
+    Returns `Centile_Data` content in the columnar format: each centile line carries its label once,
+    with parallel lists of the ages and measurements of its points.
+    """
+    return {'centile_data': [
+        {
+            reference: {
+                sex: None if measurement_methods is None else {
+                    measurement_method: None if centiles is None else [columnar_centile(centile) for centile in centiles]
+                    for measurement_method, centiles in measurement_methods.items()
+                } for sex, measurement_methods in sexes.items()
+            } for reference, sexes in reference_data.items()
+        } for reference_data in content['centile_data']
+    ]}
+
+
+def columnar_centile(centile: dict) -> dict:
+    points = centile['data']
+    return {
+        'sds': centile['sds'],
+        'centile': centile['centile'],
+        'l': points[0]['l'] if points else None,
+        'x': None if points is None else [point['x'] for point in points],
+        'y': None if points is None else [point['y'] for point in points],
+    }
+
+
+class PreparedResponse:
+    """
+    The final JSON bytes of a response that never changes for a given data set.
+    Compressed variants are made on first request and then kept.
+    The strong ETag is derived from the uncompressed bytes, so it changes only if the data does.
+    """
+
+    def __init__(self, body: bytes, media_type: str = 'application/json'):
+        self.body = body
+        self.media_type = media_type
+        self.digest = hashlib.sha256(body).hexdigest()[:32]
+        self._encoded = {IDENTITY: body}
+
+    def etag(self, encoding: str = IDENTITY) -> str:
+        # each content coding is a different representation, so needs a distinct strong validator
+        if encoding == IDENTITY:
+            return f'"{self.digest}"'
+        return f'"{self.digest}-{encoding}"'
+
+    def add_encoded(self, encoded: dict):
+        """Keeps compressed variants made elsewhere (precompressed files), so they are not compressed again"""
+        self._encoded.update(encoded)
+
+    def encoded(self, encoding: str) -> bytes:
+        if encoding not in self._encoded:
+            self._encoded[encoding] = compress(self.body, encoding)
+        return self._encoded[encoding]
+
+    def matches(self, if_none_match: str) -> bool:
+        """True if any entity tag in an `If-None-Match` header refers to this data set"""
+        if not if_none_match:
+            return False
+        for tag in if_none_match.split(','):
+            tag = tag.strip()
+            if tag == '*':
+                return True
+            if tag.startswith('W/'):
+                tag = tag[2:]
+            if tag.strip('"').split('-')[0] == self.digest:
+                return True
+        return False
+
+    def to_response(self, request: Request) -> Response:
+        """
+        Returns the prepared bytes in the best encoding the client accepts,
+        or 304 Not Modified if the client already holds this data set.
+        """
+        encoding = negotiate_encoding(request.headers.get('accept-encoding', ''))
+        headers = {
+            'ETag': self.etag(encoding),
+            'Vary': 'Accept, Accept-Encoding',
+            'Cache-Control': 'no-cache',
+        }
+        if self.matches(request.headers.get('if-none-match')):
+            return Response(status_code=304, headers=headers)
+        if encoding != IDENTITY:
+            headers['Content-Encoding'] = encoding
+        return Response(content=self.encoded(encoding), media_type=self.media_type, headers=headers)
+
+
+def prepare_chart_response(chart_data: list) -> PreparedResponse:
+    return PreparedResponse(render_json(centile_data_content(chart_data)))
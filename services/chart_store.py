@@ -0,0 +1,183 @@
+"""
+In-memory store for the precomputed chart coordinates in `chart-data/`
+"""
+# standard imports
+import json
+import threading
+from pathlib import Path
+from typing import Optional
+
+# third party imports
+from starlette.concurrency import run_in_threadpool
+
+# RCPCH imports
+from rcpchgrowth import constants
+
+# local imports
+from .chart_binary import BinaryChartData
+from .chart_responses import PreparedResponse, prepare_chart_response
+from .compression import read_precompressed
+from .settings import settings
+from .shared_chart_store import SHARED_CHART_STORE_NAME, SharedChartStore
+
+CHART_DATA_DIRECTORY = Path(__file__).resolve().parent.parent / 'chart-data'
+
+
+def chart_data_name(centile_format: str, reference: str, sex: str, measurement_method: str) -> str:
+    """Returns the `{centile_format}-{reference}-{sex}-{measurement_method}` name of a chart-data file"""
+    return f'{centile_format}-{reference}-{sex}-{measurement_method}'
+
+
+def standard_chart_data_parameters():
+    """
+    Yields (centile_format, reference, sex, measurement_method) for every standard chart data set.
+    Turner's is skipped for combinations for which there is no reference (males or non-height measurements)
+    """
+    for centile_format in [constants.COLE_TWO_THIRDS_SDS_NINE_CENTILES, constants.THREE_PERCENT_CENTILES]:
+        for reference in constants.REFERENCES:
+            for sex in constants.SEXES:
+                for measurement_method in constants.MEASUREMENT_METHODS:
+                    if reference == constants.TURNERS and (sex != constants.FEMALE or measurement_method != constants.HEIGHT):
+                        continue
+                    yield centile_format, reference, sex, measurement_method
+
+
+class ChartDataStore:
+    """
+    Loads the standard chart data sets once per worker and serves them from memory.
+    Data sets are loaded in order until `memory_budget` (bytes of file on disk) is reached;
+    any remaining data sets are read from disk when requested.
+    With `data_format='binary'`, packed `.bin` files are used where they exist and are held in memory packed.
+    With `data_format='mmap'`, the shared chart store file is mapped instead, so the data is held once for all workers.
+    """
+
+    def __init__(self, directory: Path = CHART_DATA_DIRECTORY, memory_budget: int = 0, data_format: str = 'json'):
+        self.directory = Path(directory)
+        self.memory_budget = memory_budget
+        self.data_format = data_format
+        self.loaded = False
+        self.loaded_bytes = 0
+        self._chart_data = {}
+        self._responses = {}
+        self._on_disk = set()
+        self._shared = None
+        self._load_lock = threading.Lock()
+
+    def path_for(self, name: str) -> Path:
+        if self.data_format == 'binary':
+            binary_path = self.directory / f'{name}.bin'
+            if binary_path.exists():
+                return binary_path
+        return self.directory / f'{name}.json'
+
+    @staticmethod
+    def read(path: Path):
+        if path.suffix == '.bin':
+            return BinaryChartData(path.read_bytes())
+        with open(path, 'r') as file:
+            return json.load(file)
+
+    def load(self):
+        """
+        Reads every standard chart data file within the memory budget and logs what was loaded.
+        The data sets are read into new collections, which replace the old only once complete,
+        so requests being served while the store loads (or reloads) never see it part loaded.
+        """
+        with self._load_lock:
+            self._load()
+
+    def _ensure_loaded(self):
+        """Loads the store on first use. Of concurrent first requests, one loads it and the others wait for it"""
+        if not self.loaded:
+            with self._load_lock:
+                if not self.loaded:
+                    self._load()
+
+    def _load(self):
+        chart_data, on_disk, shared, loaded_bytes = {}, set(), None, 0
+        if self.data_format == 'mmap':
+            shared_path = self.directory / SHARED_CHART_STORE_NAME
+            if shared_path.exists():
+                shared = SharedChartStore(shared_path)
+                print(f'Chart data store mapped {len(shared)} data sets ({shared.size() / 1_000_000:.1f} MB shared) from {shared_path.name}.')
+            else:
+                print(f'Shared chart store {shared_path.name} not found. Run `python build.py --shared`. Loading chart data files.')
+        missing = []
+        if shared is None:
+            for parameters in standard_chart_data_parameters():
+                name = chart_data_name(*parameters)
+                path = self.path_for(name)
+                if not path.exists():
+                    missing.append(name)
+                    continue
+                size = path.stat().st_size
+                if loaded_bytes + size > self.memory_budget:
+                    on_disk.add(name)
+                    continue
+                chart_data[name] = self.read(path)
+                loaded_bytes += size
+
+        self._chart_data, self._responses, self._on_disk, self._shared, self.loaded_bytes = chart_data, {}, on_disk, shared, loaded_bytes
+        self.loaded = True
+        if shared is not None:
+            return
+        print(f'Chart data store loaded {len(chart_data)} data sets ({loaded_bytes / 1_000_000:.1f} MB of {self.memory_budget / 1_000_000:.1f} MB budget) into memory.')
+        if on_disk:
+            print(f'Chart data over memory budget, served from disk: {", ".join(sorted(on_disk))}')
+        if missing:
+            print(f'Chart data files missing: {", ".join(missing)}')
+
+    def get(self, centile_format: str, reference: str, sex: str, measurement_method: str) -> Optional[list]:
+        """
+        Returns the chart data for the requested standard centile format, or None if no such data set exists.
+        """
+        self._ensure_loaded()
+        name = chart_data_name(centile_format, reference, sex, measurement_method)
+        if self._shared is not None:
+            binary_chart_data = self._shared.chart_data(name)
+            return None if binary_chart_data is None else binary_chart_data.chart_data()
+        chart_data = self._chart_data.get(name)
+        if chart_data is None and name in self._on_disk:
+            chart_data = self.read(self.path_for(name))
+        if isinstance(chart_data, BinaryChartData):
+            chart_data = chart_data.chart_data()
+        return chart_data
+
+    def get_response(self, centile_format: str, reference: str, sex: str, measurement_method: str) -> Optional[PreparedResponse]:
+        """
+        Returns the serialised `Centile_Data` response for a standard centile format, or None if no such data set exists.
+        Responses for data sets held in memory are serialised once and kept, with any precompressed variants there are.
+        """
+        self._ensure_loaded()
+        name = chart_data_name(centile_format, reference, sex, measurement_method)
+        if self._shared is not None:
+            return self._shared.prepared_response(name)
+        prepared = self._responses.get(name)
+        if prepared is None:
+            chart_data = self.get(centile_format, reference, sex, measurement_method)
+            if chart_data is None:
+                return None
+            prepared = prepare_chart_response(chart_data)
+            prepared.add_encoded(read_precompressed(self.directory, name, prepared.digest))
+            if name in self._chart_data:
+                self._responses[name] = prepared
+        return prepared
+
+    async def get_response_async(self, centile_format: str, reference: str, sex: str, measurement_method: str) -> Optional[PreparedResponse]:
+        """
+        As `get_response`, for async routes: responses already held (or mapped) are returned directly,
+        anything that has to be read from disk is read in the threadpool.
+        """
+        if self.loaded:
+            if self._shared is not None:
+                return self._shared.prepared_response(chart_data_name(centile_format, reference, sex, measurement_method))
+            prepared = self._responses.get(chart_data_name(centile_format, reference, sex, measurement_method))
+            if prepared is not None:
+                return prepared
+        return await run_in_threadpool(self.get_response, centile_format, reference, sex, measurement_method)
+
+
+chart_store = ChartDataStore(
+    memory_budget=settings.chart_data_memory_budget_mb * 1_000_000,
+    data_format=settings.chart_data_format
+)
@@ -0,0 +1,82 @@
+"""
+Chart coordinates for several sexes and measurement methods in one response.
+
+Each chart is served from the chart store or the custom chart cache as usual, then the charts are merged into a single
+`Centile_Data` response: the centile lines of each reference sit together under their sex and measurement method.
+Merged responses are kept in a bounded LRU cache, keyed by the digests of the charts they were made from.
+"""
+# standard imports
+import json
+import threading
+from collections import OrderedDict
+from typing import List
+
+# local imports
+from .chart_responses import PreparedResponse
+from .executor import run_cpu_bound
+from .json_encoding import render_json
+from .settings import settings
+
+
+def requested(value) -> list:
+    """Returns a request parameter which may be one value or a list of them, as a list without repeats"""
+    return list(dict.fromkeys(value if isinstance(value, list) else [value]))
+
+
+def combined_content(contents: List[dict]) -> dict:
+    """Merges `Centile_Data` contents. References keep the order in which they are first found."""
+    references = {}
+    for content in contents:
+        for reference_data in content['centile_data']:
+            for reference, sexes in reference_data.items():
+                combined_sexes = references.setdefault(reference, {})
+                for sex, measurement_methods in sexes.items():
+                    if combined_sexes.get(sex) is None:
+                        combined_sexes[sex] = measurement_methods
+                    elif measurement_methods is not None:
+                        for measurement_method, centile_lines in measurement_methods.items():
+                            if centile_lines is not None:
+                                combined_sexes[sex][measurement_method] = centile_lines
+    return {'centile_data': [{reference: sexes} for reference, sexes in references.items()]}
+
+
+class CombinedChartCache:
+    """Thread-safe LRU cache of merged chart responses"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cached(self, key: tuple):
+        with self._lock:
+            prepared = self._entries.get(key)
+            if prepared is not None:
+                self._entries.move_to_end(key)
+            return prepared
+
+    def get_response(self, charts: List[PreparedResponse]) -> PreparedResponse:
+        """Returns the charts merged into one response, merging them only if they are not cached"""
+        if len(charts) == 1:
+            return charts[0]
+        key = tuple(chart.digest for chart in charts)
+        prepared = self._cached(key)
+        if prepared is None:
+            prepared = PreparedResponse(render_json(combined_content([json.loads(chart.body) for chart in charts])))
+            with self._lock:
+                self._entries[key] = prepared
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return prepared
+
+    async def get_response_async(self, charts: List[PreparedResponse]) -> PreparedResponse:
+        """As `get_response`, for async routes: cached responses are returned directly, others are merged on the CPU executor"""
+        if len(charts) == 1:
+            return charts[0]
+        prepared = self._cached(tuple(chart.digest for chart in charts))
+        if prepared is not None:
+            return prepared
+        return await run_cpu_bound(self.get_response, charts)
+
+
+combined_chart_cache = CombinedChartCache(max_entries=settings.combined_chart_cache_max_entries)
@@ -0,0 +1,188 @@
+"""
+Response body compression.
+
+Prepared responses (chart coordinates) are compressed once, at the highest level, and kept, or read precompressed
+from the files `python build.py --compressed` writes. Every other response of at least `COMPRESSION_MINIMUM_SIZE`
+bytes is compressed as it is sent by `CompressionMiddleware`, at a lower level which costs less CPU.
+Either way the coding is chosen from the request's `Accept-Encoding`.
+"""
+# standard imports
+import gzip
+import zlib
+from pathlib import Path
+from typing import Optional
+
+# third party imports
+try:
+    import brotli
+except ImportError:  # brotli is optional - gzip is always available
+    brotli = None
+
+GZIP = 'gzip'
+BROTLI = 'br'
+IDENTITY = 'identity'
+
+# levels for responses compressed as they are sent: most of the saving, for a fraction of the CPU of the highest levels
+DYNAMIC_BROTLI_QUALITY = 4
+DYNAMIC_GZIP_LEVEL = 6
+
+# media types worth compressing (images and fonts in `assets/` are compressed already)
+COMPRESSIBLE_MEDIA_TYPES = ('application/json', 'application/x-ndjson', 'text/', 'application/javascript', 'image/svg+xml', 'application/openmetrics-text')
+
+FILE_EXTENSIONS = {BROTLI: 'br', GZIP: 'gz'}
+
+
+def available_encodings() -> list:
+    """Returns the content codings this server can produce, in order of preference"""
+    if brotli is not None:
+        return [BROTLI, GZIP]
+    return [GZIP]
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    """Compresses the body with the given content coding"""
+    if encoding == BROTLI:
+        return brotli.compress(body, quality=9)
+    if encoding == GZIP:
+        return gzip.compress(body, compresslevel=9, mtime=0)
+    return body
+
+
+def precompress(body: bytes, encoding: str) -> bytes:
+    """Compresses the body at the highest level, for responses compressed once at build time"""
+    if encoding == BROTLI:
+        return brotli.compress(body, quality=11)
+    return compress(body, encoding)
+
+
+def precompressed_path(directory: Path, name: str, digest: str, encoding: str) -> Path:
+    """
+    The file holding a prepared response precompressed with the given coding.
+    It is named by the digest of the uncompressed bytes, so a file for any other version of the response is never used.
+    """
+    return Path(directory) / f'{name}.{digest}.json.{FILE_EXTENSIONS[encoding]}'
+
+
+def read_precompressed(directory: Path, name: str, digest: str) -> dict:
+    """Returns {encoding: bytes} for each precompressed file of the response there is"""
+    encoded = {}
+    for encoding in available_encodings():
+        path = precompressed_path(directory, name, digest, encoding)
+        if path.exists():
+            encoded[encoding] = path.read_bytes()
+    return encoded
+
+
+class StreamCompressor:
+    """Compresses a response body sent in parts, flushing each part so that streamed rows are not held back"""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == BROTLI:
+            self._compressor = brotli.Compressor(quality=DYNAMIC_BROTLI_QUALITY)
+        else:
+            # wbits 31 writes the gzip header and trailer
+            self._compressor = zlib.compressobj(DYNAMIC_GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, body: bytes, final: bool = False) -> bytes:
+        if self.encoding == BROTLI:
+            compressed = self._compressor.process(body)
+            return compressed + (self._compressor.finish() if final else self._compressor.flush())
+        compressed = self._compressor.compress(body)
+        return compressed + self._compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+def negotiate_encoding(accept_encoding: str) -> str:
+    """
+    Picks the preferred available content coding from an `Accept-Encoding` header,
+    honouring q-values. Returns `identity` if no compressed coding is acceptable.
+    """
+    if not accept_encoding:
+        return IDENTITY
+    weights = {}
+    for item in accept_encoding.split(','):
+        coding, _, parameters = item.strip().partition(';')
+        coding = coding.strip().lower()
+        quality = 1.0
+        parameters = parameters.strip()
+        if parameters.startswith('q='):
+            try:
+                quality = float(parameters[2:])
+            except ValueError:
+                quality = 0.0
+        weights[coding] = quality
+
+    best = IDENTITY
+    best_quality = 0.0
+    for coding in available_encodings():
+        quality = weights.get(coding, weights.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+def _header(headers: list, name: bytes) -> Optional[bytes]:
+    return next((value for key, value in headers if key.lower() == name), None)
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware which compresses responses in the coding the client prefers.
+    Responses smaller than `minimum_size`, of media types which do not compress, or already encoded
+    (prepared responses, which carry their own precompressed bytes) are sent as they are.
+    Streamed responses are compressed part by part.
+    """
+
+    def __init__(self, app, minimum_size: int = 1000):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        accept_encoding = _header(scope['headers'], b'accept-encoding')
+        encoding = negotiate_encoding(accept_encoding.decode('latin-1') if accept_encoding else '')
+        if encoding == IDENTITY or scope['method'] == 'HEAD':
+            return await self.app(scope, receive, send)
+
+        start_message = None
+        compressor = None
+
+        async def send_compressed(message):
+            nonlocal start_message, compressor
+            if message['type'] == 'http.response.start':
+                # held until the first part of the body shows whether the response is worth compressing
+                start_message = message
+                return
+            if message['type'] == 'http.response.body' and compressor is not None:
+                return await send({**message, 'body': compressor.compress(message.get('body', b''), final=not message.get('more_body', False))})
+            if message['type'] != 'http.response.body' or start_message is None:
+                return await send(message)
+
+            start, start_message = start_message, None
+            headers = list(start.get('headers', []))
+            body = message.get('body', b'')
+            more_body = message.get('more_body', False)
+            media_type = (_header(headers, b'content-type') or b'').decode('latin-1')
+            if not media_type.startswith(COMPRESSIBLE_MEDIA_TYPES) or _header(headers, b'content-encoding') is not None:
+                await send(start)
+                return await send(message)
+            vary = _header(headers, b'vary')
+            if vary is None:
+                headers.append((b'vary', b'Accept-Encoding'))
+            elif b'accept-encoding' not in vary.lower():
+                headers = [(key, value + b', Accept-Encoding' if key.lower() == b'vary' else value) for key, value in headers]
+            if not more_body and len(body) < self.minimum_size:
+                await send({**start, 'headers': headers})
+                return await send(message)
+
+            compressor = StreamCompressor(encoding)
+            headers = [(key, value) for key, value in headers if key.lower() != b'content-length']
+            headers.append((b'content-encoding', encoding.encode('latin-1')))
+            body = compressor.compress(body, final=not more_body)
+            if not more_body:
+                headers.append((b'content-length', str(len(body)).encode('latin-1')))
+            await send({**start, 'headers': headers})
+            await send({**message, 'body': body})
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,140 @@
+"""
+Bounded executors for CPU-heavy work.
+
+Route handlers are async. Cheap work runs on the event loop; CPU-bound work (batch and bulk calculations,
+streamed rows) is sent to a pool of `CPU_EXECUTOR_WORKERS` threads kept apart from the threadpool used for
+blocking I/O, so a burst of expensive requests cannot starve everything else.
+
+The most expensive pure-Python work (custom charts, fictional child data, mid-parental height charts) can
+instead be sent to a pool of `PROCESS_POOL_WORKERS` processes, so it runs outside the worker's GIL and cannot
+stall calculation traffic. The processes are started, with the reference data loaded, when the worker starts.
+
+Each executor accepts a limited number of pending tasks. Beyond that, requests are refused at once with
+`ServerBusy` (503) rather than queued behind work they would have to wait for.
+"""
+# standard imports
+import asyncio
+import functools
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Optional
+
+# local imports
+from .settings import settings
+
+
+class ServerBusy(Exception):
+    """Raised when an executor already has as much pending work as it accepts"""
+
+
+def warm_process():
+    """Loads the reference data and LMS tables in a pool process before it takes any work"""
+    from .lms_engine import all_lms_tables, install_lms_index
+    all_lms_tables()
+    if settings.lms_index:
+        install_lms_index()
+
+
+def process_id() -> int:
+    return os.getpid()
+
+
+class BoundedExecutor:
+    """
+    An executor (created on first use) that refuses new work with `ServerBusy`
+    when `max_pending` tasks are already waiting or running.
+    """
+
+    def __init__(self, name: str, create: Callable[[], Executor], workers: int, max_pending: int):
+        self.name = name
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self._create = create
+        self._executor: Optional[Executor] = None
+        # submitted tasks, so that those not yet started can be cancelled at shutdown
+        self._futures = set()
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            self._executor = self._create()
+        return self._executor
+
+    async def run(self, func, *args, **kwargs):
+        """Runs `func(*args, **kwargs)` on the executor and waits for the result without blocking the event loop"""
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise ServerBusy(f'The {self.name} executor has {self.pending} pending tasks')
+        self.pending += 1
+        future = self.executor.submit(functools.partial(func, *args, **kwargs))
+        self._futures.add(future)
+        try:
+            return await asyncio.wrap_future(future)
+        finally:
+            self._futures.discard(future)
+            self.pending -= 1
+
+    def warm(self) -> set:
+        """
+        Starts every worker of the executor (one task is submitted for each, and each submission starts a worker
+        while none is idle), returning the ids of the processes that ran the tasks.
+        """
+        futures = [self.executor.submit(process_id) for _ in range(self.workers)]
+        return {future.result() for future in futures}
+
+    def shutdown(self):
+        if self._executor is not None:
+            # tasks not yet started are cancelled here, as `shutdown(cancel_futures=True)` needs Python 3.9
+            for future in list(self._futures):
+                future.cancel()
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+thread_executor = BoundedExecutor(
+    'thread',
+    lambda: ThreadPoolExecutor(max_workers=settings.cpu_executor_workers, thread_name_prefix='cpu-bound'),
+    workers=settings.cpu_executor_workers,
+    max_pending=settings.cpu_executor_max_pending
+)
+
+# processes are spawned rather than forked, as forking a process running an event loop and threads is unsafe
+process_executor = BoundedExecutor(
+    'process',
+    lambda: ProcessPoolExecutor(
+        max_workers=settings.process_pool_workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=warm_process),
+    workers=settings.process_pool_workers,
+    max_pending=settings.process_pool_max_pending
+) if settings.process_pool_workers else None
+
+
+async def run_cpu_bound(func, *args, **kwargs):
+    """Runs CPU-bound work on the thread executor"""
+    return await thread_executor.run(func, *args, **kwargs)
+
+
+async def run_cpu_heavy(func, *args, **kwargs):
+    """
+    Runs expensive pure-Python work on the process pool if there is one, otherwise on the thread executor.
+    `func` and its arguments must be picklable.
+    """
+    return await (process_executor or thread_executor).run(func, *args, **kwargs)
+
+
+async def start_executors():
+    """Starts the process pool, if there is one, so the first expensive request does not wait for it"""
+    if process_executor is not None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, process_executor.warm)
+        print(f'Process pool started with {process_executor.workers} processes.')
+
+
+def shutdown_executors():
+    thread_executor.shutdown()
+    if process_executor is not None:
+        process_executor.shutdown()
@@ -0,0 +1,145 @@
+"""
+Fictional cohorts: many fictional children, generated together and streamed as NDJSON.
+
+As `generate_fictional_child_data` does for one child, each child is measured at regular intervals, following
+a starting SDS with optional drift and measurement error. Here the children are generated in chunks, each in
+one vectorised pass over the LMS engine, rather than a `Measurement` at a time, and each chunk is streamed as
+soon as it is ready. Chunks are bounded by their number of measurements, so frequent measurements make chunks
+of fewer children. The random number generator of each chunk is seeded from the request seed and the chunk's
+first child, so the same request always streams the same cohort.
+"""
+# standard imports
+import json
+import math
+
+# third party imports
+import numpy as np
+from starlette.responses import StreamingResponse
+
+# RCPCH imports
+import rcpchgrowth.constants.validation_constants as limits
+
+# local imports
+from .executor import run_cpu_bound
+from .lms_engine import centiles_for_sds, measurements_for_sds, sds_for_measurements
+from .streaming import NDJSON
+
+# measurements generated in one pass (as many children as that allows, and at least one)
+CHUNK_MEASUREMENTS = 1_000_000
+
+# as `generate_fictional_child_data`, every child shares the birth date of the first child to have a growth chart
+BIRTH_DATE = np.datetime64('1759-04-11')
+TERM_PREGNANCY_LENGTH_DAYS = 280
+
+INTERVAL_TYPES_IN_YEARS = {
+    ('d', 'day', 'days'): 1 / 365.25,
+    ('w', 'week', 'weeks'): 1 / 52,
+    ('m', 'month', 'months'): 1 / 12,
+    ('y', 'year', 'years'): 1,
+}
+
+
+def measurement_ages(start_age: float, end_age: float, interval_type: str, interval_number: int) -> np.ndarray:
+    """Returns the decimal ages at which each child is measured, from the start age up to (not including) the end age"""
+    interval = next(years for types, years in INTERVAL_TYPES_IN_YEARS.items() if interval_type in types) * interval_number
+    return start_age + interval * np.arange(max(math.ceil((end_age - start_age) / interval), 0))
+
+
+def cohort_chunk(reference: str, cohort_request, sexes: list, first_child: int, number_of_children: int) -> str:
+    """Generates children `first_child` onwards of a cohort, and returns them as NDJSON, one child per line"""
+    random = np.random.default_rng([cohort_request.seed, first_child])
+    measurement_method = cohort_request.measurement_method
+
+    child_sexes = np.asarray(sexes)[random.integers(len(sexes), size=number_of_children)]
+    start_sds = random.normal(cohort_request.start_sds_mean, cohort_request.start_sds_sd, number_of_children)
+    gestation = np.clip(
+        np.rint(random.normal(cohort_request.gestation_weeks_mean * 7, cohort_request.gestation_weeks_sd * 7, number_of_children)),
+        limits.MINIMUM_GESTATION_WEEKS * 7, limits.MAXIMUM_GESTATION_WEEKS * 7 + 6).astype(int)
+    drift = random.normal(cohort_request.drift_mean, cohort_request.drift_sd, number_of_children)
+    noise_range = random.uniform(0, cohort_request.noise_range_max, number_of_children)
+
+    ages = measurement_ages(
+        cohort_request.start_chronological_age,
+        cohort_request.end_age,
+        cohort_request.measurement_interval_type,
+        cohort_request.measurement_interval_number)
+    days = np.rint(ages * 365.25).astype(int)
+    observation_dates = np.datetime_as_string(BIRTH_DATE + days.astype('timedelta64[D]')).tolist()
+    chronological_ages = days / 365.25
+    # as rcpchgrowth, ages are corrected from the expected date of delivery
+    corrected_ages = (days[np.newaxis, :] - (TERM_PREGNANCY_LENGTH_DAYS - gestation)[:, np.newaxis]) / 365.25
+
+    # each child's SDS drifts by an equal step at each measurement, reaching the start SDS plus drift at the end age
+    steps = max(len(ages) - 1, 1)
+    target_sds = start_sds[:, np.newaxis] + drift[:, np.newaxis] * np.arange(len(ages)) / steps
+
+    shape = corrected_ages.shape
+    sexes_by_measurement = np.repeat(child_sexes, len(ages))
+    methods_by_measurement = np.full(corrected_ages.size, measurement_method)
+    values = measurements_for_sds(reference, corrected_ages.ravel(), sexes_by_measurement, methods_by_measurement, target_sds.ravel()).reshape(shape)
+    values += values * noise_range[:, np.newaxis] * random.uniform(-1, 1, shape)
+    values = np.round(values, 1)
+    # the SDS and centile of each measurement as recorded, measurement error included
+    sds = sds_for_measurements(reference, corrected_ages.ravel(), sexes_by_measurement, methods_by_measurement, values.ravel()).reshape(shape)
+    centiles = centiles_for_sds(sds)
+
+    present = ~np.isnan(values)
+    values, sds, centiles = values.tolist(), np.round(sds, 4).tolist(), np.round(centiles, 2).tolist()
+    corrected_ages = np.round(corrected_ages, 4).tolist()
+    # the JSON of the date and chronological age of each measurement is the same for every child, so is made once
+    measured_at = [
+        f'{{"observation_date":"{observation_date}","chronological_decimal_age":{chronological_age!r},'
+        for observation_date, chronological_age in zip(observation_dates, np.round(chronological_ages, 4).tolist())
+    ]
+    lines = []
+    for child in range(number_of_children):
+        child_values, child_sds, child_centiles, child_corrected_ages = values[child], sds[child], centiles[child], corrected_ages[child]
+        # finite floats are written as JSON numbers by repr
+        measurements = ','.join(
+            f'{measured_at[index]}"corrected_decimal_age":{child_corrected_ages[index]!r},"observation_value":{child_values[index]!r},'
+            f'"sds":{child_sds[index]!r},"centile":{child_centiles[index]!r}}}'
+            for index in np.flatnonzero(present[child]).tolist()
+        )
+        child_json = json.dumps({
+            "child": first_child + child,
+            "birth_date": str(BIRTH_DATE),
+            "sex": str(child_sexes[child]),
+            "gestation_weeks": int(gestation[child] // 7),
+            "gestation_days": int(gestation[child] % 7),
+            "measurement_method": measurement_method,
+            "start_sds": round(float(start_sds[child]), 4),
+            "drift": round(float(drift[child]), 4),
+            "noise_range": round(float(noise_range[child]), 4),
+        }, separators=(',', ':'))
+        lines.append(f'{child_json[:-1]},"measurements":[{measurements}]}}')
+    return '\n'.join(lines) + '\n'
+
+
+def children_per_chunk(cohort_request) -> int:
+    """Returns the number of children generated in one pass: as many as keep the chunk within `CHUNK_MEASUREMENTS`"""
+    measurements_per_child = len(measurement_ages(
+        cohort_request.start_chronological_age,
+        cohort_request.end_age,
+        cohort_request.measurement_interval_type,
+        cohort_request.measurement_interval_number))
+    return max(CHUNK_MEASUREMENTS // max(measurements_per_child, 1), 1)
+
+
+async def streamed_cohort(reference: str, cohort_request, sexes: list) -> StreamingResponse:
+    """
+    Returns a response which streams the cohort as NDJSON, one child per line, a chunk of children at a time.
+    The first chunk is generated before the response starts, so a busy server refuses the request with 503.
+    """
+    chunks = [
+        (first_child, min(chunk_size, cohort_request.number_of_children - first_child))
+        for chunk_size in [children_per_chunk(cohort_request)]
+        for first_child in range(0, cohort_request.number_of_children, chunk_size)
+    ]
+    first_chunk = await run_cpu_bound(cohort_chunk, reference, cohort_request, sexes, *chunks[0])
+
+    async def children():
+        yield first_chunk
+        for first_child, number_of_children in chunks[1:]:
+            yield await run_cpu_bound(cohort_chunk, reference, cohort_request, sexes, first_child, number_of_children)
+
+    return StreamingResponse(children(), media_type=NDJSON)
@@ -0,0 +1,97 @@
+"""
+Pluggable JSON encoding for responses.
+
+`JSON_ENCODER` selects the encoder used for every JSON response: `orjson` (the default, if it is installed),
+or `json`, the standard library encoder FastAPI uses. Both write compact UTF-8 JSON, with dates in ISO format,
+NumPy values as numbers and NaN as null. If `JSON_FLOAT_DECIMALS` is set, floats are rounded to that many decimal places.
+"""
+# standard imports
+import json
+from datetime import date
+from typing import Callable, Optional
+
+# third party imports
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # orjson is optional - the standard library encoder is always available
+    orjson = None
+
+# local imports
+from .settings import settings
+
+ORJSON = 'orjson'
+JSON = 'json'
+
+
+def _default(value):
+    """Encodes the values the standard library encoder does not"""
+    if isinstance(value, date):
+        return value.isoformat()
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def _without_nan(content):
+    if isinstance(content, float):
+        return None if content != content or content in (float('inf'), float('-inf')) else content
+    if isinstance(content, dict):
+        return {key: _without_nan(value) for key, value in content.items()}
+    if isinstance(content, (list, tuple)):
+        return [_without_nan(value) for value in content]
+    return content
+
+
+def encode_json(content) -> bytes:
+    try:
+        return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(',', ':'), default=_default).encode('utf-8')
+    except ValueError:
+        # NaN is not valid JSON
+        return encode_json(_without_nan(content))
+
+
+def encode_orjson(content) -> bytes:
+    return orjson.dumps(content, default=_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+
+
+ENCODERS = {JSON: encode_json}
+if orjson is not None:
+    ENCODERS[ORJSON] = encode_orjson
+
+
+def json_encoder(name: str) -> Callable:
+    """Returns the named encoder, or the standard library encoder if it is not available"""
+    return ENCODERS.get(name, encode_json)
+
+
+def rounded(content, decimals: int):
+    """Returns the content with every float rounded to `decimals` places"""
+    if isinstance(content, float):
+        return round(content, decimals)
+    if isinstance(content, dict):
+        return {key: rounded(value, decimals) for key, value in content.items()}
+    if isinstance(content, (list, tuple)):
+        return [rounded(value, decimals) for value in content]
+    return content
+
+
+def decode_json(body: bytes):
+    """Parses JSON with orjson if it is installed, otherwise the standard library"""
+    return orjson.loads(body) if orjson is not None else json.loads(body)
+
+
+def render_json(content, encoder: Optional[str] = None, float_decimals: Optional[int] = None) -> bytes:
+    """Compact JSON, with the encoder and float precision of the server settings unless given"""
+    float_decimals = settings.json_float_decimals if float_decimals is None else float_decimals
+    if float_decimals is not None:
+        content = rounded(content, float_decimals)
+    return json_encoder(encoder or settings.json_encoder)(content)
+
+
+class FastJSONResponse(JSONResponse):
+    """The default response class of the app: JSON encoded by `render_json`"""
+
+    def render(self, content) -> bytes:
+        return render_json(content)
@@ -0,0 +1,374 @@
+"""
+Vectorised LMS engine for bulk SDS and centile calculations.
+
+Mirrors `rcpchgrowth.sds_for_measurement` (reference selection by age, exact LMS match,
+cubic interpolation with linear interpolation at the edges of each reference)
+but works on NumPy arrays, so millions of measurements can be scored without
+constructing a `Measurement` for each one.
+"""
+# standard imports
+from bisect import bisect_left
+from typing import Optional
+
+# third party imports
+import numpy as np
+from scipy.special import ndtr, ndtri
+
+# RCPCH imports
+from rcpchgrowth import constants, global_functions, trisomy_21, turner, uk_who
+from rcpchgrowth.uk_who import select_reference_data_for_uk_who_chart
+from rcpchgrowth.constants.reference_constants import (
+    UK90_REFERENCE_LOWER_THRESHOLD, UK_WHO_INFANT_LOWER_THRESHOLD, WHO_CHILD_LOWER_THRESHOLD,
+    WHO_CHILDREN_UPPER_THRESHOLD, UK90_UPPER_THRESHOLD)
+
+
+# (name, lower age, upper age, upper age inclusive, reference data) for each part of a reference,
+# in the order rcpchgrowth selects them
+REFERENCE_SEGMENTS = {
+    constants.UK_WHO: [
+        (constants.UK90_PRETERM, UK90_REFERENCE_LOWER_THRESHOLD, UK_WHO_INFANT_LOWER_THRESHOLD, False, uk_who.UK90_PRETERM_DATA),
+        (constants.UK_WHO_INFANT, UK_WHO_INFANT_LOWER_THRESHOLD, WHO_CHILD_LOWER_THRESHOLD, False, uk_who.WHO_INFANTS_DATA),
+        (constants.UK_WHO_CHILD, WHO_CHILD_LOWER_THRESHOLD, WHO_CHILDREN_UPPER_THRESHOLD, False, uk_who.WHO_CHILD_DATA),
+        (constants.UK90_CHILD, WHO_CHILDREN_UPPER_THRESHOLD, UK90_UPPER_THRESHOLD, True, uk_who.UK90_CHILD_DATA),
+    ],
+    constants.TURNERS: [
+        (constants.TURNERS, 1.0, constants.TWENTY_YEARS, True, turner.TURNER_DATA),
+    ],
+    constants.TRISOMY_21: [
+        (constants.TRISOMY_21, 0.0, constants.TWENTY_YEARS, True, trisomy_21.TRISOMY_21_DATA),
+    ],
+}
+
+
+def reference_age_limits(reference: str, sex: str, measurement_method: str) -> tuple:
+    """
+    Returns the (lowest, highest) decimal age for which the reference has data,
+    following the `reference_data_absent` rules of each rcpchgrowth reference module.
+    """
+    if reference == constants.UK_WHO:
+        lowest = UK90_REFERENCE_LOWER_THRESHOLD
+        highest = UK90_UPPER_THRESHOLD
+        if measurement_method == constants.HEIGHT:
+            lowest = constants.TWENTY_FIVE_WEEKS_GESTATION
+        elif measurement_method == constants.BMI:
+            lowest = constants.FORTY_TWO_WEEKS_GESTATION
+        elif measurement_method == constants.HEAD_CIRCUMFERENCE:
+            highest = constants.EIGHTEEN_YEARS if sex == constants.MALE else constants.SEVENTEEN_YEARS
+        return lowest, highest
+    if reference == constants.TRISOMY_21:
+        highest = constants.TWENTY_YEARS
+        if measurement_method == constants.BMI:
+            highest = 18.82
+        elif measurement_method == constants.HEAD_CIRCUMFERENCE:
+            highest = constants.EIGHTEEN_YEARS
+        return 0.0, highest
+    if reference == constants.TURNERS:
+        if sex != constants.FEMALE or measurement_method != constants.HEIGHT:
+            return None
+        return 1.0, constants.TWENTY_YEARS
+    raise ValueError("No or incorrect reference supplied")
+
+
+class LMSTable:
+    """
+    The L, M and S values of one reference data set as arrays, sorted by decimal age, indexed for lookup by age.
+    The coefficients which interpolation needs for each interval between reference ages (the differences between
+    neighbouring ages for cubic interpolation, the slopes for linear interpolation) are calculated once, here,
+    so a lookup is a binary search and a few multiply-adds. The arithmetic is done in the same order as rcpchgrowth,
+    and `lookup` returns values of the same types as `fetch_lms`, so results (and every calculation from them) are identical.
+    """
+
+    def __init__(self, ages: np.ndarray, l: np.ndarray, m: np.ndarray, s: np.ndarray):
+        self.ages = ages
+        self.l = l
+        self.m = m
+        self.s = s
+        n = len(ages)
+        # the ages either side of each interval: i - 1, i, i + 1 and i + 2 (NaN beyond the ends of the table)
+        t0 = np.concatenate([[np.nan], ages[:-1]]) if n else ages
+        t1 = ages
+        t2 = np.concatenate([ages[1:], [np.nan]]) if n else ages
+        t3 = np.concatenate([ages[2:], [np.nan] * min(n, 2)]) if n else ages
+        self.t = (t0, t1, t2, t3)
+        # denominators of the Lagrange weights, as in rcpchgrowth.cubic_interpolation
+        self.differences = (t0 - t1, t0 - t2, t0 - t3, t1 - t2, t1 - t3, t2 - t3)
+        with np.errstate(invalid='ignore'):
+            self.slopes = tuple(
+                np.concatenate([(values[1:] - values[:-1]) / (ages[1:] - ages[:-1]), [np.nan]]) if n else values
+                for values in (l, m, s)
+            )
+        self._scalar = None
+
+    @classmethod
+    def from_lms_array(cls, lms_array: list) -> 'LMSTable':
+        # ages with no data (such as preterm BMI) have empty strings for L, M and S
+        return cls(*(
+            np.array([np.nan if item[key] == '' else item[key] for item in lms_array], dtype=np.float64)
+            for key in ('decimal_age', 'L', 'M', 'S')
+        ))
+
+    def __len__(self):
+        return len(self.ages)
+
+    def lms(self, ages: np.ndarray) -> tuple:
+        """
+        Returns L, M and S for each age. Ages matching a reference age (to 4 d.p.) take its values,
+        otherwise values are interpolated: cubically where there are two reference ages either side,
+        linearly at the edges of the table.
+        """
+        n = len(self.ages)
+        # the index of the nearest reference age below (or an exact match of) each age
+        index = np.searchsorted(self.ages, ages, side='left')
+        exact = (index < n) & (np.round(self.ages[np.minimum(index, n - 1)], 16) == np.round(ages, 16))
+        index = np.where(exact, index, index - 1)
+        index = np.clip(index, 0, n - 1)
+
+        l = self.l[index].copy()
+        m = self.m[index].copy()
+        s = self.s[index].copy()
+
+        interpolate = np.round(self.ages[index], 4) != np.round(ages, 4)
+        interpolate &= index < n - 1
+        if not interpolate.any():
+            return l, m, s
+
+        cubic = interpolate & (index >= 1) & (index < n - 2)
+        linear = interpolate & ~cubic
+
+        if cubic.any():
+            i = index[cubic]
+            t = ages[cubic]
+            tt0, tt1, tt2, tt3 = (t - ti[i] for ti in self.t)
+            t01, t02, t03, t12, t13, t23 = (difference[i] for difference in self.differences)
+            for values, target in ((self.l, l), (self.m, m), (self.s, s)):
+                target[cubic] = (
+                    values[i - 1] * tt1 * tt2 * tt3 / t01 / t02 / t03
+                    - values[i] * tt0 * tt2 * tt3 / t01 / t12 / t13
+                    + values[i + 1] * tt0 * tt1 * tt3 / t02 / t12 / t23
+                    - values[i + 2] * tt0 * tt1 * tt2 / t03 / t13 / t23
+                )
+
+        if linear.any():
+            i = index[linear]
+            offset = ages[linear] - self.ages[i]
+            for values, slopes, target in zip((self.l, self.m, self.s), self.slopes, (l, m, s)):
+                target[linear] = slopes[i] * offset + values[i]
+
+        return l, m, s
+
+    def lookup(self, age: float, lms_array: Optional[list] = None):
+        """
+        Scalar equivalent of `lms`, on Python floats: returns (L, M, S) for one age,
+        or None where rcpchgrowth's own lookup is needed (before the first or past the last reference age, or where values are missing).
+        If the rcpchgrowth reference data is given, an exact match returns its values as they are (some are ints).
+        """
+        if self._scalar is None:
+            self._scalar = (
+                self.ages.tolist(),
+                [round(age, 4) for age in self.ages.tolist()],
+                list(zip(self.l.tolist(), self.m.tolist(), self.s.tolist())),
+                [array.tolist() for array in self.t],
+                list(zip(*(difference.tolist() for difference in self.differences))),
+                list(zip(*(slopes.tolist() for slopes in self.slopes))),
+            )
+        ages, rounded_ages, values, t, differences, slopes = self._scalar
+        n = len(ages)
+        if n == 0:
+            return None
+        index = bisect_left(ages, age)
+        if not (index < n and round(ages[index], 16) == round(age, 16)):
+            index = max(index - 1, 0)
+
+        if rounded_ages[index] == round(age, 4):
+            lms = values[index] if lms_array is None else (lms_array[index]['L'], lms_array[index]['M'], lms_array[index]['S'])
+            if any(value == '' for value in lms):
+                return None
+        elif index >= n - 1 or age < ages[0]:
+            # rcpchgrowth cannot interpolate beyond the reference ages, and raises
+            return None
+        elif 1 <= index < n - 2:
+            tt0, tt1, tt2, tt3 = age - t[0][index], age - t[1][index], age - t[2][index], age - t[3][index]
+            t01, t02, t03, t12, t13, t23 = differences[index]
+            lms = tuple(
+                value_0 * tt1 * tt2 * tt3 / t01 / t02 / t03
+                - value_1 * tt0 * tt2 * tt3 / t01 / t12 / t13
+                + value_2 * tt0 * tt1 * tt3 / t02 / t12 / t23
+                - value_3 * tt0 * tt1 * tt2 / t03 / t13 / t23
+                for value_0, value_1, value_2, value_3 in zip(*values[index - 1:index + 3])
+            )
+        else:
+            offset = age - ages[index]
+            # rcpchgrowth interpolates linearly with scipy, which returns 0-d NumPy arrays rather than floats.
+            # Later arithmetic on them (powers and logarithms, in NumPy rather than the C library) depends on the type
+            lms = tuple(np.array(slope * offset + value) for slope, value in zip(slopes[index], values[index]))
+
+        if lms[0] != lms[0] or lms[1] != lms[1] or lms[2] != lms[2]:
+            return None
+        return lms
+
+
+_lms_tables = {}
+
+
+def lms_table_key(segment: str, sex: str, measurement_method: str) -> str:
+    return f'{segment}/{sex}/{measurement_method}'
+
+
+def lms_table(segment: str, reference_data: dict, sex: str, measurement_method: str) -> LMSTable:
+    key = lms_table_key(segment, sex, measurement_method)
+    if key not in _lms_tables:
+        _lms_tables[key] = LMSTable.from_lms_array(reference_data['measurement'][measurement_method][sex])
+    return _lms_tables[key]
+
+
+def all_lms_tables() -> dict:
+    """Returns every LMS table of every reference, by `lms_table_key`"""
+    return {
+        lms_table_key(segment, sex, measurement_method): lms_table(segment, reference_data, sex, measurement_method)
+        for segments in REFERENCE_SEGMENTS.values()
+        for segment, _, _, _, reference_data in segments
+        for measurement_method, sexes in reference_data['measurement'].items()
+        for sex in sexes
+    }
+
+
+_rcpchgrowth_fetch_lms = global_functions.fetch_lms
+_indexed_arrays = {}
+
+
+def indexed_fetch_lms(age: float, lms_value_array_for_measurement: list) -> dict:
+    """
+    Drop-in replacement for rcpchgrowth's `fetch_lms`, using the indexed LMS table for the reference data
+    where there is one, and rcpchgrowth's linear search otherwise.
+    """
+    key = _indexed_arrays.get(id(lms_value_array_for_measurement))
+    if key is not None:
+        lms = _lms_tables[key].lookup(age, lms_value_array_for_measurement)
+        if lms is not None:
+            return {"l": lms[0], "m": lms[1], "s": lms[2]}
+    return _rcpchgrowth_fetch_lms(age=age, lms_value_array_for_measurement=lms_value_array_for_measurement)
+
+
+def install_lms_index():
+    """
+    Builds the indexed LMS table of every reference, and has rcpchgrowth (so every calculation and chart) use them
+    for LMS lookup.
+    """
+    lms_tables = all_lms_tables()
+    for segments in REFERENCE_SEGMENTS.values():
+        for segment, _, _, _, reference_data in segments:
+            for measurement_method, sexes in reference_data['measurement'].items():
+                for sex, lms_array in sexes.items():
+                    key = lms_table_key(segment, sex, measurement_method)
+                    # a warm-up lookup also builds the scalar index
+                    lms_tables[key].lookup(0.0)
+                    _indexed_arrays[id(lms_array)] = key
+    global_functions.fetch_lms = indexed_fetch_lms
+
+
+def lms_for_ages(reference: str, ages, sexes, measurement_methods) -> tuple:
+    """
+    Returns arrays of L, M and S for each (age, sex, measurement_method).
+    Values are NaN where the reference has no data for that age, sex and measurement method.
+    """
+    ages = np.asarray(ages, dtype=np.float64)
+    sexes = np.asarray(sexes)
+    measurement_methods = np.asarray(measurement_methods)
+    l = np.full(ages.shape, np.nan)
+    m = np.full(ages.shape, np.nan)
+    s = np.full(ages.shape, np.nan)
+
+    for sex in constants.SEXES:
+        for measurement_method in constants.MEASUREMENT_METHODS:
+            selected = (sexes == sex) & (measurement_methods == measurement_method)
+            if not selected.any():
+                continue
+            limits = reference_age_limits(reference, sex, measurement_method)
+            if limits is None:
+                continue
+            lowest, highest = limits
+            selected &= (ages >= lowest) & (ages <= highest)
+            for segment, lower, upper, upper_inclusive, reference_data in REFERENCE_SEGMENTS[reference]:
+                in_segment = selected & (ages >= lower)
+                in_segment &= (ages <= upper) if upper_inclusive else (ages < upper)
+                if not in_segment.any():
+                    continue
+                table = lms_table(segment, reference_data, sex, measurement_method)
+                if len(table) == 0:
+                    continue
+                l[in_segment], m[in_segment], s[in_segment] = table.lms(ages[in_segment])
+    return l, m, s
+
+
+def sds_for_measurements(reference: str, ages, sexes, measurement_methods, observation_values) -> np.ndarray:
+    """
+    Returns the SDS of each observation for its decimal age, sex and measurement method.
+    SDS is NaN where there is no reference data.
+    """
+    observation_values = np.asarray(observation_values, dtype=np.float64)
+    l, m, s = lms_for_ages(reference, ages, sexes, measurement_methods)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        box_cox = ((observation_values / m) ** l - 1) / (l * s)
+        log_normal = np.log(observation_values / m) / s
+    return np.where(l != 0.0, box_cox, log_normal)
+
+
+def measurements_for_sds(reference: str, ages, sexes, measurement_methods, sds) -> np.ndarray:
+    """
+    Returns the measurement at each SDS for its decimal age, sex and measurement method (the inverse of `sds_for_measurements`).
+    The measurement is NaN where there is no reference data.
+    """
+    sds = np.asarray(sds, dtype=np.float64)
+    l, m, s = lms_for_ages(reference, ages, sexes, measurement_methods)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        box_cox = m * (1 + l * s * sds) ** (1 / l)
+        log_normal = m * np.exp(s * sds)
+    return np.where(l != 0.0, box_cox, log_normal)
+
+
+def centiles_for_sds(sds) -> np.ndarray:
+    """Converts SDS to centiles (as percentages)"""
+    return ndtr(np.asarray(sds, dtype=np.float64)) * 100
+
+
+def create_uk_who_chart(measurement_method: str, sex: str, centiles: list) -> list:
+    """
+    Vectorised equivalent of rcpchgrowth `create_chart(UK_WHO, centiles, ...)` for a custom list of centiles.
+    Each centile line is calculated for every age of each UK-WHO reference in one pass, rather than point by point.
+    Returns the same structure: a list of the four UK-WHO references, each holding one line per centile.
+    """
+    reference_data = []
+    for reference_name in constants.UK_WHO_REFERENCES:
+        try:
+            lms_array_for_measurement = select_reference_data_for_uk_who_chart(
+                uk_who_reference_name=reference_name,
+                measurement_method=measurement_method,
+                sex=sex)
+        except LookupError:
+            lms_array_for_measurement = []
+
+        ages = np.round(np.array([item['decimal_age'] for item in lms_array_for_measurement], dtype=np.float64), 4)
+        sexes = np.full(ages.shape, sex)
+        measurement_methods = np.full(ages.shape, measurement_method)
+        # LMS values are the same for every centile, only the SDS changes
+        l, m, s = lms_for_ages(constants.UK_WHO, ages, sexes, measurement_methods)
+        has_reference = ~np.isnan(m)
+
+        centile_lines = []
+        for centile in centiles:
+            z = float(ndtri(centile / 100))
+            rounded_z = round(z, 4)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                first_step = 1 + l * s * rounded_z
+                measurements = np.where(l != 0.0, first_step ** (1 / l) * m, np.exp(s * rounded_z) * m)
+                measurements = np.where(first_step < 0, np.nan, np.round(measurements, 4))
+            centile_lines.append({
+                "sds": round(z * 100) / 100,
+                "centile": centile,
+                "data": [
+                    {"l": centile, "x": age, "y": None if measurement != measurement else measurement}
+                    for age, measurement in zip(ages[has_reference].tolist(), measurements[has_reference].tolist())
+                ]
+            })
+        reference_data.append({reference_name: {sex: {measurement_method: centile_lines}}})
+    return reference_data
@@ -0,0 +1,157 @@
+"""
+Prometheus metrics, served at `/metrics`.
+
+Each worker counts its own requests. When `PROMETHEUS_MULTIPROC_DIR` is set (it must be set, to an empty directory,
+before the workers start), every worker and pool process writes its metrics to files there, and `/metrics`
+adds up the files of all of them, so whichever gunicorn worker answers the scrape reports the whole server.
+Without it, `/metrics` reports the worker that answers.
+"""
+# standard imports
+import os
+import time
+from contextvars import ContextVar
+
+# third party imports
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import multiprocess
+from starlette.responses import Response
+
+# RCPCH imports
+from rcpchgrowth import constants
+
+# latencies range from cached chart bytes (well under a millisecond) to large bulk calculations (seconds)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# the reference of each router, by route prefix
+ROUTE_REFERENCES = {
+    '/uk-who/': constants.UK_WHO,
+    '/turner/': constants.TURNERS,
+    '/trisomy-21/': constants.TRISOMY_21,
+}
+
+# label of requests that did not match a route, so that unknown paths cannot add label values without limit
+UNMATCHED_ROUTE = 'unmatched'
+
+requests_total = Counter(
+    'growth_api_requests_total',
+    'Requests served, by route, reference and status code',
+    ['method', 'route', 'reference', 'status'])
+
+request_duration_seconds = Histogram(
+    'growth_api_request_duration_seconds',
+    'Time taken to serve a request, by route and reference',
+    ['method', 'route', 'reference'],
+    buckets=LATENCY_BUCKETS)
+
+errors_total = Counter(
+    'growth_api_errors_total',
+    'Errors raised while serving requests, by route and exception type',
+    ['route', 'type'])
+
+chart_cache_requests_total = Counter(
+    'growth_api_chart_cache_requests_total',
+    'Custom chart cache lookups, by result (hit, disk_hit, shared_hit or miss)',
+    ['result'])
+
+chart_cache_evictions_total = Counter(
+    'growth_api_chart_cache_evictions_total',
+    'Custom charts evicted from the chart cache')
+
+calculation_cache_requests_total = Counter(
+    'growth_api_calculation_cache_requests_total',
+    'Calculation cache lookups, by result (hit, miss, or bypass if the cache is off or the client opted out)',
+    ['result'])
+
+calculation_cache_evictions_total = Counter(
+    'growth_api_calculation_cache_evictions_total',
+    'Calculation results evicted from the calculation cache')
+
+cache_errors_total = Counter(
+    'growth_api_cache_errors_total',
+    'Errors of the shared cache backends (a miss or a dropped write), by backend (sqlite or redis)',
+    ['backend'])
+
+create_chart_duration_seconds = Histogram(
+    'growth_api_create_chart_duration_seconds',
+    'Time taken by rcpchgrowth create_chart, by reference',
+    ['reference'],
+    buckets=LATENCY_BUCKETS)
+
+
+# (route, reference) labels by endpoint
+_route_labels = {}
+
+# the scope of the request being served, so errors can be counted against its route
+_request_scope: ContextVar = ContextVar('request_scope', default={})
+
+
+def route_labels(scope: dict) -> tuple:
+    """Returns the (route, reference) labels of a routed request: the route's path template, not the requested path"""
+    endpoint = scope.get('endpoint')
+    app = scope.get('app')
+    if endpoint is None or app is None:
+        return UNMATCHED_ROUTE, ''
+    labels = _route_labels.get(endpoint)
+    if labels is None:
+        route = next((route.path for route in app.routes if getattr(route, 'endpoint', None) is endpoint), UNMATCHED_ROUTE)
+        reference = next((reference for prefix, reference in ROUTE_REFERENCES.items() if route.startswith(prefix)), '')
+        labels = _route_labels[endpoint] = (route, reference)
+    return labels
+
+
+def count_error(error: BaseException):
+    """Counts an error, by exception type, against the route of the request being served"""
+    route, _ = route_labels(_request_scope.get())
+    errors_total.labels(route=route, type=type(error).__name__).inc()
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware which counts and times every HTTP request, and counts the exceptions that escape the routes.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        status_code = 500
+        _request_scope.set(scope)
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        except Exception as error:
+            count_error(error)
+            raise
+        finally:
+            # the router adds the matched endpoint to the scope
+            route, reference = route_labels(scope)
+            request_duration_seconds.labels(method=scope['method'], route=route, reference=reference).observe(time.perf_counter() - started)
+            requests_total.labels(method=scope['method'], route=route, reference=reference, status=str(status_code)).inc()
+
+
+def metrics_response(multiprocess_directory: str = None) -> Response:
+    """Returns the metrics in the Prometheus text format, added up across processes if there is a multiprocess directory"""
+    multiprocess_directory = multiprocess_directory or os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if multiprocess_directory:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry, path=multiprocess_directory)
+    else:
+        registry = REGISTRY
+    # as a header rather than a media type, which Starlette would give a second charset
+    return Response(generate_latest(registry), headers={'Content-Type': CONTENT_TYPE_LATEST})
+
+
+def mark_process_dead(pid: int):
+    """Called by gunicorn as a worker exits, to drop its live gauge values (its counts are kept)"""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(pid)
@@ -0,0 +1,95 @@
+"""
+Server settings
+"""
+# standard imports
+from typing import Optional
+
+# third party imports
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+
+class Settings(BaseSettings):
+    """this is a class for use of env files"""
+    model_config = SettingsConfigDict(
+        # `.env.prod` takes priority over `.env.local`. extra~ is for futur use
+        env_file=('.env.local', '.env.prod'), extra='ignore')
+
+    # create missing chart-data files and update openapi.json when a worker starts (as `python build.py` does).
+    # off by default, so workers only load prebuilt assets and start quickly
+    build_on_startup: bool = False
+    # load chart data into memory when a worker starts, rather than on the first chart request
+    preload_chart_data: bool = True
+
+    # upper limit (in megabytes of chart-data JSON) held in memory by each worker.
+    # datasets beyond the budget are still served, but read from disk on each request
+    chart_data_memory_budget_mb: int = 64
+    # `json`, `binary` to use the packed `.bin` chart data written by `python build.py --binary`,
+    # or `mmap` to map the shared chart store written by `python build.py --shared` (one copy of the chart data for all workers)
+    chart_data_format: str = 'json'
+
+    # maximum number of measurements accepted by a single batch calculation request
+    max_batch_size: int = 500
+
+    # maximum number of measurements accepted by a single vectorised bulk calculation request
+    max_bulk_size: int = 1_000_000
+
+    # maximum number of children in a single fictional cohort request
+    max_cohort_size: int = 1_000_000
+
+    # serialise calculation, fictional child and mid-parental height responses straight from rcpchgrowth output,
+    # shaped by (but not validated against) the response models documented in the openAPI spec
+    trusted_output: bool = True
+
+    # encoder of every JSON response: `orjson` (if installed) or `json`, the standard library encoder
+    json_encoder: str = 'orjson'
+    # if set, floats in JSON responses are rounded to this many decimal places
+    json_float_decimals: Optional[int] = None
+
+    # compress responses in the coding the client accepts (brotli or gzip). Responses smaller than the minimum size
+    # (in bytes) are not worth compressing. Turn off if a proxy in front of the server compresses responses
+    compress_responses: bool = True
+    compression_minimum_size: int = 1000
+
+    # limits of the per-worker cache of custom centile charts
+    chart_cache_max_entries: int = 256
+    chart_cache_max_mb: int = 64
+    # if set, charts evicted from the cache are written here and read back instead of being recreated
+    chart_cache_spill_directory: Optional[str] = None
+    chart_cache_max_spill_entries: int = 4096
+    # with a shared CACHE_BACKEND (`sqlite` or `redis`) custom charts are also kept there, so each chart is created once
+    # for every worker. The most charts kept in a `sqlite` cache
+    chart_cache_max_shared_entries: int = 4096
+    # number of charts kept at a requested level of detail (age range or max_points) by each worker
+    chart_detail_cache_max_entries: int = 512
+    # number of charts kept with several sexes or measurement methods merged into one response by each worker
+    combined_chart_cache_max_entries: int = 256
+
+    # where cached calculations and custom charts are kept: `memory` (in each worker), `sqlite` (a file shared by
+    # the workers of a node, at CACHE_SQLITE_PATH or in the temporary directory) or `redis` (a server shared by every node)
+    cache_backend: str = 'memory'
+    cache_sqlite_path: Optional[str] = None
+    cache_redis_url: str = 'redis://localhost:6379/0'
+    # prefix of every cache key, so that several deployments can share a cache server
+    cache_key_prefix: str = 'growth-api:'
+
+    # limits of the cache of single measurement calculations. 0 entries turns the cache off
+    calculation_cache_max_entries: int = 10_000
+    calculation_cache_ttl_seconds: float = 3600
+
+    # index the LMS tables of every reference at startup, and use the index for every LMS lookup rcpchgrowth makes
+    lms_index: bool = True
+
+    # number of threads in each worker for CPU-heavy work (custom charts, fictional child data, batch and bulk calculations),
+    # and the most tasks waiting for or running on them before further requests are refused with 503
+    cpu_executor_workers: int = 4
+    cpu_executor_max_pending: int = 64
+    # if not 0, the number of processes in each worker for custom charts, fictional child data and mid-parental height charts,
+    # so that this work runs outside the worker's GIL. The most tasks waiting for or running on them before 503
+    process_pool_workers: int = 0
+    process_pool_max_pending: int = 16
+
+    # number of parental height pairs for which mid-parental height centile lines are kept
+    mid_parental_height_cache_size: int = 1024
+
+
+settings = Settings()
@@ -0,0 +1,146 @@
+"""
+Memory-mapped chart store, shared read-only by every worker.
+
+One file holds, for each standard chart data set, the prepared response bytes (plain and compressed)
+and the packed chart data. Each worker maps the file rather than reading it, so the pages are held once by the
+operating system however many workers there are. (The reference LMS tables are not in the store: rcpchgrowth
+holds its own copy of the reference data in every worker, so mapping the tables would save nothing.)
+
+The file is an 8 byte magic number and a little-endian uint32 header length (padded to 16 bytes),
+a JSON header of the (offset, length) of each block, padded to a multiple of 8 bytes, and the blocks.
+"""
+# standard imports
+import json
+import mmap
+import os
+import struct
+from pathlib import Path
+from typing import Optional
+
+# local imports
+from .chart_binary import BinaryChartData, pack_chart_data
+from .chart_responses import PreparedResponse, prepare_chart_response
+from .compression import IDENTITY, available_encodings, compress, precompress
+
+MAGIC = b'RCPCHCS1'
+PREAMBLE = struct.Struct('<8sI4x')
+ALIGNMENT = 8
+
+SHARED_CHART_STORE_NAME = 'chart-store.bin'
+
+
+def _padding(length: int) -> bytes:
+    return b'\0' * (-length % ALIGNMENT)
+
+
+def write_shared_chart_store(path: Path, chart_data_sets: dict):
+    """
+    Writes the chart data sets (by name) to a shared chart store file.
+    The file is replaced in one step, so workers that have mapped the old file keep a consistent copy.
+    """
+    blocks = []
+    offset = 0
+
+    def add(block: bytes) -> list:
+        nonlocal offset
+        span = [offset, len(block)]
+        blocks.extend((block, _padding(len(block))))
+        offset += len(block) + len(_padding(len(block)))
+        return span
+
+    charts = {}
+    for name, chart_data in chart_data_sets.items():
+        prepared = prepare_chart_response(chart_data)
+        charts[name] = {
+            "digest": prepared.digest,
+            "media_type": prepared.media_type,
+            "packed": add(pack_chart_data(chart_data)),
+            "encodings": {
+                IDENTITY: add(prepared.body),
+                # compressed once here, so at the highest level
+                **{encoding: add(precompress(prepared.body, encoding)) for encoding in available_encodings()},
+            },
+        }
+
+    header = json.dumps({"charts": charts}, separators=(',', ':')).encode('utf-8')
+    header += b' ' * (-len(header) % ALIGNMENT)
+    path = Path(path)
+    temporary_path = path.with_suffix(f'.{os.getpid()}.tmp')
+    with open(temporary_path, 'wb') as file:
+        file.write(PREAMBLE.pack(MAGIC, len(header)))
+        file.write(header)
+        for block in blocks:
+            file.write(block)
+    os.replace(temporary_path, path)
+
+
+class MappedPreparedResponse(PreparedResponse):
+    """
+    A prepared response whose bytes stay in the shared memory map.
+    Bytes are copied out of the map only for the request being served.
+    Encodings not built into the store are compressed once, and kept in this process as `PreparedResponse` keeps them.
+    """
+
+    def __init__(self, buffer: mmap.mmap, data_offset: int, entry: dict):
+        self.media_type = entry['media_type']
+        self.digest = entry['digest']
+        self._buffer = buffer
+        self._spans = {encoding: (data_offset + offset, length) for encoding, (offset, length) in entry['encodings'].items()}
+        self._encoded = {}
+
+    @property
+    def body(self) -> bytes:
+        return self.encoded(IDENTITY)
+
+    def encoded(self, encoding: str) -> bytes:
+        span = self._spans.get(encoding)
+        if span is None:
+            # not built into the store (for example, brotli was installed after the build)
+            if encoding not in self._encoded:
+                self._encoded[encoding] = compress(self.body, encoding)
+            return self._encoded[encoding]
+        offset, length = span
+        return self._buffer[offset:offset + length]
+
+
+class SharedChartStore:
+    """Read-only view of a shared chart store file"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(self.path, 'rb') as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_length = PREAMBLE.unpack_from(self.buffer, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{self.path} is not a shared chart store')
+        header = json.loads(self.buffer[PREAMBLE.size:PREAMBLE.size + header_length])
+        self.data_offset = PREAMBLE.size + header_length
+        self._charts = header['charts']
+        self._responses = {}
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._charts
+
+    def __len__(self):
+        return len(self._charts)
+
+    def size(self) -> int:
+        return len(self.buffer)
+
+    def prepared_response(self, name: str) -> Optional[MappedPreparedResponse]:
+        response = self._responses.get(name)
+        if response is None:
+            entry = self._charts.get(name)
+            if entry is None:
+                return None
+            # kept, so encodings compressed on the fly are compressed once
+            response = self._responses[name] = MappedPreparedResponse(self.buffer, self.data_offset, entry)
+        return response
+
+    def chart_data(self, name: str) -> Optional[BinaryChartData]:
+        entry = self._charts.get(name)
+        if entry is None:
+            return None
+        offset, length = entry['packed']
+        offset += self.data_offset
+        return BinaryChartData(memoryview(self.buffer)[offset:offset + length])
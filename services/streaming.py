@@ -0,0 +1,204 @@
+"""
+Streaming NDJSON and CSV calculations.
+
+Rows are read from the request body, calculated and written to the response one at a time,
+so memory use does not grow with the size of the upload.
+"""
+# standard imports
+import csv
+import io
+import json
+
+# third party imports
+from fastapi import Request
+from fastapi.encoders import jsonable_encoder
+from starlette.responses import StreamingResponse
+
+# local imports
+from .calculation_cache import cache_control
+from .calculations import calculate_item
+from .executor import ServerBusy, run_cpu_bound
+
+NDJSON = 'application/x-ndjson'
+CSV = 'text/csv'
+
+CSV_COLUMNS = [
+    'row',
+    'birth_date',
+    'observation_date',
+    'sex',
+    'measurement_method',
+    'observation_value',
+    'gestation_weeks',
+    'gestation_days',
+    'chronological_decimal_age',
+    'corrected_decimal_age',
+    'chronological_sds',
+    'chronological_centile',
+    'chronological_centile_band',
+    'corrected_sds',
+    'corrected_centile',
+    'corrected_centile_band',
+    'error',
+]
+
+STREAM_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            NDJSON: {
+                "schema": {"$ref": "#/components/schemas/MeasurementRequest"},
+                "example": '{"birth_date": "2020-04-12", "observation_date": "2028-06-12", "observation_value": 115, "sex": "female", "measurement_method": "height"}\n'
+            },
+            CSV: {
+                "schema": {"type": "string"},
+                "example": "birth_date,observation_date,observation_value,sex,measurement_method\n2020-04-12,2028-06-12,115,female,height\n"
+            },
+        },
+    }
+}
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    """
+    A streaming response whose body is written while the request body is still being read.
+    Starlette's StreamingResponse watches for disconnection by reading from `receive`,
+    which would take request body chunks from under the body iterator.
+    Here the body iterator alone reads `receive`; a disconnection ends the request stream.
+    """
+
+    async def __call__(self, scope, receive, send) -> None:
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+async def request_lines(request: Request):
+    """Yields the non-blank lines of the request body as they arrive, undecoded"""
+    remainder = b''
+    async for chunk in request.stream():
+        remainder += chunk
+        *lines, remainder = remainder.split(b'\n')
+        for line in lines:
+            if line.strip():
+                yield line.rstrip(b'\r')
+    if remainder.strip():
+        yield remainder.rstrip(b'\r')
+
+
+def csv_row(line: str) -> list:
+    return next(csv.reader([line]))
+
+
+def csv_line(values: list) -> str:
+    output = io.StringIO()
+    csv.writer(output, lineterminator='\n').writerow(values)
+    return output.getvalue()
+
+
+async def request_items(request: Request, media_type: str):
+    """
+    Yields each row of an NDJSON or CSV body as a dict shaped like `MeasurementRequest`.
+    The first CSV line must be a header naming the `MeasurementRequest` fields. Empty CSV cells are omitted.
+    Rows which cannot be decoded or parsed are yielded as the parsing exception.
+    If the CSV header cannot be, no row can be read, so every row is yielded as the header's exception.
+    """
+    header = None
+    async for line in request_lines(request):
+        if isinstance(header, Exception):
+            yield header
+            continue
+        try:
+            if media_type == CSV:
+                values = csv_row(line.decode('utf-8'))
+                if header is None:
+                    header = [column.strip() for column in values]
+                    continue
+                item = {column: value for column, value in zip(header, values) if value != ''}
+            else:
+                item = json.loads(line.decode('utf-8'))
+        except (ValueError, csv.Error) as err:
+            if media_type == CSV and header is None:
+                header = ValueError(f'the CSV header could not be parsed ({err})')
+                continue
+            item = err
+        yield item
+
+
+def calculated_csv_values(row: int, item: dict, result: dict) -> list:
+    measurement = result['measurement']
+    if measurement is None:
+        values = {'row': row, 'error': result['error']}
+        if isinstance(item, dict):
+            values.update({column: item.get(column) for column in CSV_COLUMNS[1:8]})
+    else:
+        birth_data = measurement['birth_data']
+        dates = measurement['measurement_dates']
+        observation = measurement['child_observation_value']
+        calculated = measurement['measurement_calculated_values']
+        values = {
+            'row': row,
+            'birth_date': birth_data['birth_date'],
+            'observation_date': dates['observation_date'],
+            'sex': birth_data['sex'],
+            'measurement_method': observation['measurement_method'],
+            'observation_value': observation['observation_value'],
+            'gestation_weeks': birth_data['gestation_weeks'],
+            'gestation_days': birth_data['gestation_days'],
+            'chronological_decimal_age': dates['chronological_decimal_age'],
+            'corrected_decimal_age': dates['corrected_decimal_age'],
+            'chronological_sds': calculated['chronological_sds'],
+            'chronological_centile': calculated['chronological_centile'],
+            'chronological_centile_band': calculated['chronological_centile_band'],
+            'corrected_sds': calculated['corrected_sds'],
+            'corrected_centile': calculated['corrected_centile'],
+            'corrected_centile_band': calculated['corrected_centile_band'],
+            'error': None,
+        }
+    return ['' if values.get(column) is None else values.get(column) for column in CSV_COLUMNS]
+
+
+def stream_media_types(request: Request) -> tuple:
+    """
+    Returns the (request, response) media types. The request is CSV if sent as `text/csv`, otherwise NDJSON.
+    The response follows `Accept` if it names CSV or NDJSON, otherwise matches the request.
+    """
+    content_type = request.headers.get('content-type', '')
+    request_media_type = CSV if content_type.startswith(CSV) else NDJSON
+    accept = request.headers.get('accept', '')
+    if CSV in accept:
+        return request_media_type, CSV
+    if NDJSON in accept:
+        return request_media_type, NDJSON
+    return request_media_type, request_media_type
+
+
+def streamed_calculations(reference: str, request: Request) -> DuplexStreamingResponse:
+    """
+    Returns a response which streams one calculated row for each row of the request body, in order.
+    As with batch calculations, a row which cannot be parsed or calculated carries an error rather than failing the stream.
+    The response has started by the time most rows are read, so a row refused by a busy executor also carries an error
+    (the client may resend it) rather than the stream ending with a 503.
+    """
+    request_media_type, response_media_type = stream_media_types(request)
+    use_cache = cache_control(request.headers)
+
+    async def calculated_rows():
+        if response_media_type == CSV:
+            yield csv_line(CSV_COLUMNS)
+        row = 0
+        async for item in request_items(request, request_media_type):
+            row += 1
+            if isinstance(item, Exception):
+                result = {'measurement': None, 'error': f'Row could not be parsed: {item}'}
+            else:
+                try:
+                    result = await run_cpu_bound(calculate_item, reference, item, use_cache)
+                except ServerBusy as err:
+                    result = {'measurement': None, 'error': f'Row could not be calculated: {err}'}
+            if response_media_type == CSV:
+                yield csv_line(calculated_csv_values(row, item, result))
+            else:
+                yield json.dumps(jsonable_encoder(result), separators=(',', ':')) + '\n'
+
+    return DuplexStreamingResponse(calculated_rows(), media_type=response_media_type)
@@ -0,0 +1,119 @@
+"""
+Trusted output: responses serialised straight from rcpchgrowth output, without response model validation.
+
+A route's `response_model` still documents the response in the openAPI spec, but when `TRUSTED_OUTPUT` is set
+the content is not validated against it. It is shaped as the model would serialise it instead: the model's fields
+in order (missing fields as their default, or null), extra keys dropped, numbers as the model's float or int,
+dates in ISO format and NaN as null. The shaping for each model is worked out once, from its fields.
+"""
+# standard imports
+from datetime import date
+from functools import lru_cache
+from inspect import isclass
+from typing import Any, Callable, Dict, List, Literal, Union, get_args, get_origin
+
+# third party imports
+from fastapi import Response
+from pydantic import BaseModel
+
+# local imports
+from .json_encoding import render_json
+from .settings import settings
+
+
+def _plain(value):
+    """Values of untyped fields (lists of event text, for example) are passed through, with NumPy scalars as Python values"""
+    if isinstance(value, list):
+        return [_plain(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _plain(item) for key, item in value.items()}
+    if hasattr(value, 'item') and not isinstance(value, (str, bytes)):
+        return value.item()
+    return value
+
+
+def _float(value):
+    if value is None:
+        return None
+    value = float(value)
+    # as pydantic, NaN and infinity are serialised as null
+    return None if value != value or value in (float('inf'), float('-inf')) else value
+
+
+def _int(value):
+    return None if value is None else int(value)
+
+
+def _str(value):
+    # numbers in text fields (centile labels, for example) are written as text, as pydantic 1 coerced them
+    return value if value is None or isinstance(value, str) else str(value)
+
+
+def _date(value):
+    return value.isoformat() if isinstance(value, date) else value
+
+
+def _optional(project: Callable) -> Callable:
+    return lambda value: None if value is None else project(value)
+
+
+@lru_cache(maxsize=None)
+def projector(annotation) -> Callable:
+    """Returns a function which shapes a value as `annotation` serialises it"""
+    origin = get_origin(annotation)
+    arguments = get_args(annotation)
+    if origin is Union:
+        types = [argument for argument in arguments if argument is not type(None)]
+        return _optional(projector(types[0])) if len(types) == 1 else _plain
+    if origin in (list, List):
+        item = projector(arguments[0]) if arguments else _plain
+        return _optional(lambda values: [item(value) for value in values])
+    if origin in (dict, Dict):
+        item = projector(arguments[1]) if arguments else _plain
+        return _optional(lambda values: {key: item(value) for key, value in values.items()})
+    if origin is Literal or annotation in (Any, list, dict):
+        return _plain
+    if annotation is str:
+        return _str
+    if annotation is float:
+        return _float
+    if annotation is int:
+        return _int
+    if annotation is date:
+        return _date
+    if isclass(annotation) and issubclass(annotation, BaseModel):
+        return _model_projector(annotation)
+    return _plain
+
+
+def _model_projector(model) -> Callable:
+    fields = [
+        (name, projector(field.annotation), None if field.is_required() else field.get_default(call_default_factory=True))
+        for name, field in model.model_fields.items()
+    ]
+    if [name for name, _, _ in fields] == ['root']:
+        # written as a root model (the `__root__` of pydantic 1), so the value is the root itself
+        return fields[0][1]
+
+    def project(value):
+        if value is None:
+            return None
+        if isinstance(value, BaseModel):
+            value = value.__dict__
+        return {name: project_field(value.get(name, default)) for name, project_field, default in fields}
+    return project
+
+
+def trusted_content(response_model, content):
+    """Returns the content shaped as the response model serialises it, without validating it"""
+    return projector(response_model)(content)
+
+
+def trusted_response(response_model, content):
+    """
+    Returns the content as a JSON response shaped by the response model, if trusted output is on.
+    Otherwise the content is returned as it is, for FastAPI to validate against the route's response model.
+    """
+    if not settings.trusted_output:
+        return content
+    return Response(content=render_json(trusted_content(response_model, content)), media_type='application/json')
@@ -0,0 +1,145 @@
+"""
+Tests for MessagePack and Arrow responses, chosen by the request's Accept header
+"""
+
+# third party imports
+import msgpack
+import pyarrow
+from fastapi.testclient import TestClient
+
+# local / rcpch imports
+from main import app
+from services.binary_encoding import ARROW_STREAM, JSON, MSGPACK, negotiate_media_type
+
+client = TestClient(app)
+
+MEASUREMENT = {
+    "birth_date": "2015-04-12",
+    "observation_date": "2023-06-12",
+    "observation_value": 125,
+    "sex": "female",
+    "gestation_weeks": 40,
+    "gestation_days": 0,
+    "measurement_method": "height",
+    "events_text": ["Growth hormone start"]
+}
+
+FICTIONAL_CHILD = {
+    "measurement_method": "height",
+    "sex": "male",
+    "start_chronological_age": 0,
+    "end_age": 10,
+    "gestation_weeks": 40,
+    "gestation_days": 0,
+    "measurement_interval_type": "months",
+    "measurement_interval_number": 6,
+    "start_sds": 0,
+    "drift": False,
+    "drift_range": -0.05,
+    "noise": False,
+    "noise_range": 0.005
+}
+
+
+def arrow_table(content: bytes):
+    return pyarrow.ipc.open_stream(content).read_all()
+
+
+def test_negotiate_media_type():
+    assert negotiate_media_type('') == JSON
+    assert negotiate_media_type('*/*') == JSON
+    assert negotiate_media_type('application/msgpack') == MSGPACK
+    assert negotiate_media_type('application/x-msgpack') == MSGPACK
+    assert negotiate_media_type('application/msgpack, */*') == MSGPACK
+    assert negotiate_media_type(f'{ARROW_STREAM}, {MSGPACK}') == ARROW_STREAM
+    assert negotiate_media_type(f'{ARROW_STREAM};q=0.5, {MSGPACK}') == MSGPACK
+    assert negotiate_media_type(f'{MSGPACK};q=0.5, application/json') == JSON
+    assert negotiate_media_type('text/csv') == JSON
+
+
+def test_calculation_as_msgpack_matches_json():
+    calculated = client.post("/uk-who/calculation", json=MEASUREMENT)
+    packed = client.post("/uk-who/calculation", json=MEASUREMENT, headers={"Accept": MSGPACK})
+
+    assert packed.status_code == 200
+    assert packed.headers['content-type'] == MSGPACK
+    assert msgpack.unpackb(packed.content) == calculated.json()
+
+
+def test_calculation_as_arrow_has_typed_columns():
+    calculated = client.post("/uk-who/calculation", json=MEASUREMENT).json()
+    response = client.post("/uk-who/calculation", json=MEASUREMENT, headers={"Accept": ARROW_STREAM})
+
+    assert response.status_code == 200
+    table = arrow_table(response.content)
+    assert table.num_rows == 1
+    assert table.schema.field('chronological_sds').type == pyarrow.float64()
+    assert table.schema.field('observation_date').type == pyarrow.date32()
+    assert table.schema.field('gestation_weeks').type == pyarrow.int64()
+    row = table.to_pylist()[0]
+    assert row['corrected_centile'] == calculated['measurement_calculated_values']['corrected_centile']
+    assert row['observation_date'].isoformat() == calculated['measurement_dates']['observation_date']
+    assert row['events_text'] == ["Growth hormone start"]
+
+
+def test_fictional_child_as_arrow_has_a_row_for_each_measurement():
+    measurements = client.post("/trisomy-21/fictional-child-data", json=FICTIONAL_CHILD).json()
+    response = client.post("/trisomy-21/fictional-child-data", json=FICTIONAL_CHILD, headers={"Accept": ARROW_STREAM})
+
+    assert response.status_code == 200
+    table = arrow_table(response.content)
+    assert table.column('chronological_sds').to_pylist() == [
+        measurement['measurement_calculated_values']['chronological_sds'] for measurement in measurements]
+
+
+def test_chart_coordinates_in_each_media_type():
+    body = {"sex": "female", "measurement_method": "weight", "max_points": 20}
+    points = client.post("/uk-who/chart-coordinates", json=body)
+    packed = client.post("/uk-who/chart-coordinates", json=body, headers={"Accept": MSGPACK})
+    arrow = client.post("/uk-who/chart-coordinates", json={**body, "format": "columnar"}, headers={"Accept": ARROW_STREAM})
+
+    assert 'Accept' in points.headers['vary']
+    assert packed.headers['content-type'] == MSGPACK
+    assert msgpack.unpackb(packed.content) == points.json()
+    assert packed.headers['etag'] != points.headers['etag']
+    table = arrow_table(arrow.content)
+    ages = [
+        point['x']
+        for reference_data in points.json()['centile_data']
+        for sexes in reference_data.values()
+        for centile_line in sexes['female']['weight']
+        for point in centile_line['data'] or []
+    ]
+    assert table.column('x').to_pylist() == ages
+    assert set(table.column('sex').to_pylist()) == {'female'}
+
+
+def test_batch_calculations_in_each_media_type():
+    body = [MEASUREMENT, {**MEASUREMENT, "sex": "invalid_sex"}]
+    calculated = client.post("/uk-who/calculations", json=body).json()
+    packed = client.post("/uk-who/calculations", json=body, headers={"Accept": MSGPACK})
+    response = client.post("/uk-who/calculations", json=body, headers={"Accept": ARROW_STREAM})
+
+    assert packed.headers['content-type'] == MSGPACK
+    assert msgpack.unpackb(packed.content) == calculated
+    assert response.headers['content-type'] == ARROW_STREAM
+    rows = arrow_table(response.content).to_pylist()
+    assert len(rows) == 2
+    assert rows[0]['corrected_centile'] == calculated[0]['measurement']['measurement_calculated_values']['corrected_centile']
+    assert rows[0]['error'] is None
+    assert rows[1]['corrected_centile'] is None
+    assert rows[1]['error'] == calculated[1]['error']
+
+
+def test_bulk_calculation_in_each_media_type():
+    body = {"decimal_ages": [4.5, 30.0], "sexes": ["male", "female"], "measurement_methods": ["height", "height"], "observation_values": [105.0, 160.0]}
+    calculated = client.post("/trisomy-21/bulk-calculation", json=body).json()
+    packed = client.post("/trisomy-21/bulk-calculation", json=body, headers={"Accept": MSGPACK})
+    response = client.post("/trisomy-21/bulk-calculation", json=body, headers={"Accept": ARROW_STREAM})
+
+    assert msgpack.unpackb(packed.content) == calculated
+    table = arrow_table(response.content)
+    assert table.schema.field('sds').type == pyarrow.float64()
+    assert table.column('sds').to_pylist() == calculated['sds']
+    assert table.column('centiles').to_pylist() == calculated['centiles']
+    assert calculated['sds'][1] is None
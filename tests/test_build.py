@@ -0,0 +1,11 @@
+"""
+Tests for the build of the chart data and openapi.json assets
+"""
+
+# local / rcpch imports
+import build
+
+
+def test_prebuilt_assets_are_up_to_date():
+    # chart-data/ and openapi.json are committed, so they must match what `python build.py` would produce
+    assert build.main(['--check']) == 0
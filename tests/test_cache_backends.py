@@ -0,0 +1,290 @@
+"""
+Tests which every cache backend passes: in-process, SQLite, and Redis protocol (against a local fake server)
+"""
+
+# standard imports
+import socketserver
+import sqlite3
+import threading
+import time
+
+# third party imports
+import pytest
+
+# local / rcpch imports
+from rcpchgrowth import constants
+from services.cache_backends import MemoryCache, RedisCache, SQLiteCache
+from services.chart_cache import ChartCache
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    """Answers the Redis protocol commands the cache uses, from a dictionary held by the server"""
+
+    def read_command(self) -> list:
+        line = self.rfile.readline()
+        if not line:
+            return None
+        arguments = []
+        for _ in range(int(line[1:-2])):
+            length = int(self.rfile.readline()[1:-2])
+            arguments.append(self.rfile.read(length + 2)[:-2])
+        return arguments
+
+    def bulk(self, value: bytes) -> bytes:
+        return b'$-1\r\n' if value is None else b'$%d\r\n%s\r\n' % (len(value), value)
+
+    def handle(self):
+        entries = self.server.entries
+        password = getattr(self.server, 'password', None)
+        errors = getattr(self.server, 'errors', {})
+        authenticated = password is None
+        while True:
+            command = self.read_command()
+            if command is None:
+                return
+            name, arguments = command[0].upper(), command[1:]
+            if name == b'AUTH':
+                authenticated = arguments[-1] == password
+                reply = b'+OK\r\n' if authenticated else b'-WRONGPASS invalid username-password pair\r\n'
+            elif not authenticated:
+                reply = b'-NOAUTH Authentication required.\r\n'
+            elif name in errors:
+                reply = b'-%s\r\n' % errors[name]
+            elif name == b'PING':
+                reply = b'+PONG\r\n'
+            elif name == b'GET':
+                value, expires = entries.get(arguments[0], (None, None))
+                if expires is not None and expires <= time.monotonic():
+                    del entries[arguments[0]]
+                    value = None
+                reply = self.bulk(value)
+            elif name == b'SET':
+                expires = time.monotonic() + int(arguments[3]) / 1000 if len(arguments) > 2 and arguments[2].upper() == b'PX' else None
+                entries[arguments[0]] = (arguments[1], expires)
+                reply = b'+OK\r\n'
+            elif name == b'DEL':
+                reply = b':%d\r\n' % sum(entries.pop(key, None) is not None for key in arguments)
+            elif name == b'SCAN':
+                pattern = arguments[arguments.index(b'MATCH') + 1].rstrip(b'*')
+                keys = [key for key in list(entries) if key.startswith(pattern)]
+                reply = b'*2\r\n' + self.bulk(b'0') + b'*%d\r\n' % len(keys) + b''.join(self.bulk(key) for key in keys)
+            else:
+                reply = b'-ERR unknown command\r\n'
+            self.wfile.write(reply)
+
+
+def start_fake_redis_server(password: str = None, errors: dict = None):
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), FakeRedisHandler)
+    server.daemon_threads = True
+    server.entries = {}
+    server.password = password
+    server.errors = errors or {}
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+@pytest.fixture(scope='module')
+def fake_redis_server():
+    server = start_fake_redis_server()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(params=['memory', 'sqlite', 'redis'])
+def backend(request, tmp_path, fake_redis_server):
+    if request.param == 'memory':
+        cache = MemoryCache(max_entries=100)
+    elif request.param == 'sqlite':
+        cache = SQLiteCache(str(tmp_path / 'cache.sqlite3'), 'cache_test', max_entries=100)
+    else:
+        host, port = fake_redis_server.server_address
+        cache = RedisCache(f'redis://{host}:{port}/0', namespace=f'test:{tmp_path.name}')
+    yield cache
+    cache.clear()
+
+
+def test_set_and_get(backend):
+    assert backend.get('missing') is None
+
+    backend.set('chart', b'{"centile_data":[]}')
+
+    assert backend.get('chart') == b'{"centile_data":[]}'
+
+
+def test_set_replaces_value(backend):
+    backend.set('calculation', b'1')
+    backend.set('calculation', b'2')
+
+    assert backend.get('calculation') == b'2'
+
+
+def test_entries_expire(backend):
+    backend.set('short', b'value', ttl=0.05)
+    backend.set('long', b'value', ttl=60)
+    time.sleep(0.1)
+
+    assert backend.get('short') is None
+    assert backend.get('long') == b'value'
+
+
+def test_delete_and_clear(backend):
+    backend.set('first', b'1')
+    backend.set('second', b'2')
+    backend.delete('first')
+
+    assert backend.get('first') is None
+    assert backend.get('second') == b'2'
+
+    backend.clear()
+
+    assert backend.get('second') is None
+
+
+def test_values_are_bytes_unchanged(backend):
+    value = bytes(range(256)) * 1000 + b'\r\n$-1\r\n'
+    backend.set('binary', value)
+
+    assert backend.get('binary') == value
+
+
+def test_backend_is_shared_between_threads(backend):
+    def write(index):
+        backend.set(f'thread-{index}', str(index).encode())
+
+    threads = [threading.Thread(target=write, args=(index,)) for index in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert [backend.get(f'thread-{index}') for index in range(8)] == [str(index).encode() for index in range(8)]
+
+
+def test_sqlite_cache_is_bounded(tmp_path):
+    evicted = []
+    cache = SQLiteCache(str(tmp_path / 'cache.sqlite3'), 'cache_test', max_entries=10, on_evict=evicted.append)
+    for index in range(25):
+        cache.set(f'key-{index}', b'value')
+    cache.prune()
+
+    assert len(cache) == 10
+    assert cache.get('key-24') == b'value'
+    assert cache.get('key-0') is None
+    assert sum(evicted) == 15
+
+
+def test_locked_or_broken_sqlite_cache_misses(tmp_path):
+    path = str(tmp_path / 'cache.sqlite3')
+    cache = SQLiteCache(path, 'cache_test', max_entries=10, timeout=0.05)
+    cache.set('chart', b'value')
+    other_worker = sqlite3.connect(path, isolation_level=None)
+    other_worker.execute('BEGIN EXCLUSIVE')
+
+    cache.set('calculation', b'value')
+
+    other_worker.execute('ROLLBACK')
+    assert cache.get('calculation') is None
+
+    other_worker.execute('DROP TABLE cache_test')
+
+    assert cache.get('chart') is None
+    cache.delete('chart')
+
+
+def test_cache_errors_are_counted_and_logged_once(tmp_path, capsys):
+    from prometheus_client import REGISTRY
+    cache = SQLiteCache(str(tmp_path / 'cache.sqlite3'), 'cache_test', max_entries=10)
+    sqlite3.connect(str(tmp_path / 'cache.sqlite3'), isolation_level=None).execute('DROP TABLE cache_test')
+    errors = REGISTRY.get_sample_value('growth_api_cache_errors_total', {'backend': 'sqlite'}) or 0
+
+    for _ in range(3):
+        assert cache.get('chart') is None
+
+    assert REGISTRY.get_sample_value('growth_api_cache_errors_total', {'backend': 'sqlite'}) == errors + 3
+    assert capsys.readouterr().out.count('unavailable') == 1
+
+
+def test_sqlite_tables_of_other_versions_are_dropped(tmp_path):
+    path = str(tmp_path / 'cache.sqlite3')
+    old_version = SQLiteCache(path, 'cache_growth_4_2_7_charts', max_entries=10, family='growth:charts')
+    old_version.set('chart', b'value')
+    other_cache = SQLiteCache(path, 'cache_growth_4_2_7_calculations', max_entries=10, family='growth:calculations')
+
+    SQLiteCache(path, 'cache_growth_4_2_8_charts', max_entries=10, family='growth:charts')
+
+    tables = {name for name, in sqlite3.connect(path).execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert 'cache_growth_4_2_7_charts' not in tables
+    assert {'cache_growth_4_2_8_charts', 'cache_growth_4_2_7_calculations'} <= tables
+    other_cache.set('calculation', b'value')
+    assert other_cache.get('calculation') == b'value'
+
+
+def test_cache_backends_must_provide_every_operation():
+    from services.cache_backends import CacheBackend
+
+    class GetOnly(CacheBackend):
+        def get(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        GetOnly()
+
+def test_unavailable_redis_server_misses():
+    with socketserver.TCPServer(('127.0.0.1', 0), socketserver.BaseRequestHandler) as server:
+        host, port = server.server_address
+    # the port is closed again, so nothing is listening
+    cache = RedisCache(f'redis://{host}:{port}/0', namespace='test')
+
+    cache.set('chart', b'value')
+
+    assert cache.get('chart') is None
+
+
+def test_redis_error_replies_miss():
+    server = start_fake_redis_server(errors={b'SET': b'OOM command not allowed when used memory > maxmemory', b'GET': b'READONLY replica'})
+    host, port = server.server_address
+    cache = RedisCache(f'redis://{host}:{port}/0', namespace='test')
+    try:
+        cache.set('chart', b'value')
+
+        assert cache.get('chart') is None
+        assert server.entries == {}
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_failed_redis_login_is_not_kept():
+    server = start_fake_redis_server(password=b'secret')
+    host, port = server.server_address
+    try:
+        cache = RedisCache(f'redis://:wrong@{host}:{port}/0', namespace='test')
+        cache.set('chart', b'value')
+
+        assert cache.get('chart') is None
+        assert getattr(cache._local, 'connection', None) is None
+
+        cache = RedisCache(f'redis://:secret@{host}:{port}/0', namespace='test')
+        cache.set('chart', b'value')
+
+        assert cache.get('chart') == b'value'
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_custom_chart_is_created_once_for_workers_sharing_a_backend(tmp_path):
+    path = str(tmp_path / 'cache.sqlite3')
+    # two workers, each with its own chart cache, sharing a SQLite cache
+    first_worker = ChartCache(max_entries=2, max_bytes=10_000_000, shared=SQLiteCache(path, 'cache_charts', max_entries=100))
+    second_worker = ChartCache(max_entries=2, max_bytes=10_000_000, shared=SQLiteCache(path, 'cache_charts', max_entries=100))
+
+    created = first_worker.get_response(constants.TURNERS, [50], constants.HEIGHT, constants.FEMALE, False)
+    shared = second_worker.get_response(constants.TURNERS, [50.0], constants.HEIGHT, constants.FEMALE, False)
+
+    assert shared.body == created.body
+    assert shared.etag() == created.etag()
+    assert second_worker.stats()['shared_hits'] == 1
+    assert second_worker.stats()['misses'] == 0
@@ -0,0 +1,119 @@
+"""
+Tests for the calculation cache
+"""
+
+# standard imports
+import asyncio
+
+# third party imports
+from fastapi.testclient import TestClient
+
+# local / rcpch imports
+from main import app
+from schemas import MeasurementRequest
+from services.cache_backends import MemoryCache
+from services.calculation_cache import BYPASS, REFRESH, CalculationCache, calculation_cache, calculation_cache_key
+
+client = TestClient(app)
+
+BODY = {
+    "birth_date": "2015-04-12",
+    "observation_date": "2023-06-12",
+    "observation_value": 125,
+    "sex": "female",
+    "gestation_weeks": 40,
+    "gestation_days": 0,
+    "measurement_method": "height",
+    "events_text": ["Growth hormone start"],
+    "bone_age_text": "This bone age is advanced"
+}
+
+
+def counting_calculation(calls: list):
+    def calculate():
+        calls.append(1)
+        return {"events_data": {"events_text": None}, "plottable_data": {}, "bone_age": {"bone_age_text": None}, "sds": len(calls)}
+    return calculate
+
+
+def test_free_text_is_not_part_of_the_key():
+    with_text = MeasurementRequest.model_validate(BODY)
+    without_text = MeasurementRequest.model_validate({**BODY, "events_text": None, "bone_age_text": None, "observation_value": 125.0})
+
+    assert calculation_cache_key('uk-who', with_text) == calculation_cache_key('uk-who', without_text)
+    assert calculation_cache_key('uk-who', with_text) != calculation_cache_key('trisomy-21', with_text)
+
+
+def test_cached_result_carries_the_free_text_of_each_request():
+    cache = CalculationCache(MemoryCache(max_entries=10), ttl_seconds=60)
+    calls = []
+
+    first = cache.get(('key',), counting_calculation(calls), bone_age_text="advanced", events_text=["first"])
+    second = cache.get(('key',), counting_calculation(calls), bone_age_text=None, events_text=["second"])
+
+    assert len(calls) == 1
+    assert first["events_data"]["events_text"] == ["first"]
+    assert second["events_data"]["events_text"] == ["second"]
+    assert second["bone_age"]["bone_age_text"] is None
+    assert cache.stats()["hits"] == 1
+
+
+def test_entries_expire_and_are_evicted():
+    calls = []
+    expired = CalculationCache(MemoryCache(max_entries=10), ttl_seconds=0)
+    expired.get(('key',), counting_calculation(calls))
+    expired.get(('key',), counting_calculation(calls))
+
+    assert len(calls) == 2
+
+    evicted = []
+    bounded = CalculationCache(MemoryCache(max_entries=2, on_evict=evicted.append), ttl_seconds=60)
+    for key in ['a', 'b', 'c']:
+        bounded.get((key,), counting_calculation(calls))
+
+    assert len(bounded.backend) == 2
+    assert sum(evicted) == 1
+
+
+def test_opting_out_recalculates():
+    cache = CalculationCache(MemoryCache(max_entries=10), ttl_seconds=60)
+    calls = []
+    cache.get(('key',), counting_calculation(calls), use_cache=BYPASS)
+    cache.get(('key',), counting_calculation(calls), use_cache=REFRESH)
+    cache.get(('key',), counting_calculation(calls))
+
+    # a bypassed result is not kept, a refreshed one is
+    assert len(calls) == 2
+
+
+def test_cached_calculation_response_matches_calculated_response():
+    calculated = client.post("/uk-who/calculation", json=BODY, headers={"Cache-Control": "no-store"})
+    client.post("/uk-who/calculation", json={**BODY, "events_text": None})
+    hits = calculation_cache.stats()["hits"]
+
+    cached = client.post("/uk-who/calculation", json=BODY)
+
+    assert cached.status_code == calculated.status_code == 200
+    assert calculation_cache.stats()["hits"] == hits + 1
+    assert cached.content == calculated.content
+
+
+def test_blocking_backend_is_not_called_from_the_event_loop(monkeypatch):
+    class RecordingCache(MemoryCache):
+        blocking = True
+
+        def get(self, key):
+            try:
+                asyncio.get_running_loop()
+                calls.append('event loop')
+            except RuntimeError:
+                calls.append('thread')
+            return super().get(key)
+
+    calls = []
+    monkeypatch.setattr(calculation_cache, 'backend', RecordingCache(max_entries=10))
+
+    response = client.post("/uk-who/calculation", json=BODY)
+
+    assert response.status_code == 200
+    assert calls == ['thread']
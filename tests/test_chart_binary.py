@@ -0,0 +1,83 @@
+"""
+Tests for the packed binary chart data format
+"""
+
+# standard imports
+import json
+import threading
+import time
+
+# third party imports
+import numpy as np
+import pytest
+
+# local / rcpch imports
+from services.chart_binary import BinaryChartData, pack_chart_data, unpack_chart_data
+from services.chart_store import CHART_DATA_DIRECTORY, ChartDataStore, chart_data_name, standard_chart_data_parameters
+
+
+@pytest.mark.parametrize("name", [chart_data_name(*parameters) for parameters in standard_chart_data_parameters()])
+def test_binary_chart_data_round_trip(name):
+    with open(CHART_DATA_DIRECTORY / f'{name}.json', 'r') as file:
+        chart_data = json.load(file)
+
+    packed = pack_chart_data(chart_data)
+
+    assert len(packed) < len(json.dumps(chart_data)) / 4
+    assert unpack_chart_data(packed) == chart_data
+    assert unpack_chart_data(pack_chart_data(chart_data, dtype='<f8', decimals=None)) == chart_data
+
+
+def test_binary_chart_data_arrays_read_from_memoryview():
+    chart_data = [{"uk90_child": {"male": {"height": [
+        {"sds": 0.0, "centile": 50, "data": [{"l": 50, "x": 4.0, "y": 102.8}, {"l": 50, "x": 4.0833, "y": None}]},
+        {"sds": 2.0, "centile": 97.7, "data": None},
+    ], "weight": None}, "female": None}}]
+
+    binary_chart_data = BinaryChartData(memoryview(pack_chart_data(chart_data)))
+    lines = list(binary_chart_data.lines())
+
+    assert len(lines) == 1
+    reference, sex, measurement_method, sds, centile, x, y = lines[0]
+    assert (reference, sex, measurement_method, sds, centile) == ("uk90_child", "male", "height", 0.0, 50)
+    assert np.allclose(x, [4.0, 4.0833])
+    assert np.isnan(y[1])
+    assert binary_chart_data.chart_data() == chart_data
+
+
+def test_chart_data_store_serves_the_same_response_from_binary(tmp_path):
+    name = chart_data_name(*next(standard_chart_data_parameters()))
+    json_path = CHART_DATA_DIRECTORY / f'{name}.json'
+    (tmp_path / f'{name}.json').write_bytes(json_path.read_bytes())
+    with open(json_path, 'r') as file:
+        (tmp_path / f'{name}.bin').write_bytes(pack_chart_data(json.load(file)))
+
+    json_store = ChartDataStore(tmp_path, memory_budget=100_000_000)
+    binary_store = ChartDataStore(tmp_path, memory_budget=100_000_000, data_format='binary')
+    parameters = next(standard_chart_data_parameters())
+
+    assert binary_store.get_response(*parameters).body == json_store.get_response(*parameters).body
+    assert binary_store.loaded_bytes < json_store.loaded_bytes
+
+
+def test_chart_data_store_loaded_by_concurrent_first_requests(monkeypatch):
+    # as with PRELOAD_CHART_DATA=false: the store is loaded by the first requests, from several threads at once
+    store = ChartDataStore(CHART_DATA_DIRECTORY, memory_budget=100_000_000)
+    read = ChartDataStore.read
+    reads = []
+    monkeypatch.setattr(ChartDataStore, 'read', staticmethod(lambda path: reads.append(path) or time.sleep(0.001) or read(path)))
+    parameters = list(standard_chart_data_parameters())
+    results = []
+
+    def first_request(chart_parameters):
+        results.append(store.get_response(*chart_parameters))
+
+    threads = [threading.Thread(target=first_request, args=(parameters[index % len(parameters)],)) for index in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == 8 and all(result is not None for result in results)
+    # loaded once
+    assert len(reads) == len(parameters)
@@ -0,0 +1,54 @@
+"""
+Tests for the custom chart LRU cache
+"""
+
+# standard imports
+import json
+
+# local / rcpch imports
+from rcpchgrowth import constants
+from services.chart_cache import ChartCache
+
+
+def test_chart_cache_returns_cached_chart():
+    cache = ChartCache(max_entries=2, max_bytes=10_000_000)
+
+    first = cache.get_response(constants.UK_WHO, [50], constants.HEIGHT, constants.MALE, False)
+    # the same chart, with the centile supplied as a float, should come from the cache
+    second = cache.get_response(constants.UK_WHO, [50.0], constants.HEIGHT, constants.MALE, False)
+
+    assert second is first
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+    assert len(json.loads(first.body)['centile_data']) > 0
+
+
+def test_chart_cache_evicts_least_recently_used():
+    cache = ChartCache(max_entries=2, max_bytes=10_000_000)
+
+    cache.get_response(constants.TURNERS, [10], constants.HEIGHT, constants.FEMALE, False)
+    cache.get_response(constants.TURNERS, [50], constants.HEIGHT, constants.FEMALE, False)
+    cache.get_response(constants.TURNERS, [10], constants.HEIGHT, constants.FEMALE, False)
+    cache.get_response(constants.TURNERS, [90], constants.HEIGHT, constants.FEMALE, False)
+
+    # [50] was least recently used, so was evicted and has to be created again
+    cache.get_response(constants.TURNERS, [50], constants.HEIGHT, constants.FEMALE, False)
+
+    stats = cache.stats()
+    assert stats['entries'] == 2
+    assert stats['hits'] == 1
+    assert stats['misses'] == 4
+    assert stats['evictions'] == 2
+
+
+def test_chart_cache_reads_back_spilled_charts(tmp_path):
+    cache = ChartCache(max_entries=1, max_bytes=10_000_000, spill_directory=tmp_path)
+
+    first = cache.get_response(constants.TURNERS, [10], constants.HEIGHT, constants.FEMALE, False)
+    cache.get_response(constants.TURNERS, [90], constants.HEIGHT, constants.FEMALE, False)
+    spilled = cache.get_response(constants.TURNERS, [10], constants.HEIGHT, constants.FEMALE, False)
+
+    assert spilled.body == first.body
+    assert spilled.etag() == first.etag()
+    assert cache.stats()['disk_hits'] == 1
+    assert cache.stats()['misses'] == 2
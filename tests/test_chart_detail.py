@@ -0,0 +1,105 @@
+"""
+Tests for the level of detail (max_points, age_min and age_max) and the columnar format of chart coordinates
+"""
+
+# third party imports
+from fastapi.testclient import TestClient
+
+# local / rcpch imports
+from main import app
+from services.chart_detail import age_window, removal_ranks
+
+client = TestClient(app)
+
+
+def centile_lines(content: dict, sex: str, measurement_method: str) -> list:
+    return [
+        (reference, centile_line)
+        for reference_data in content['centile_data']
+        for reference, sexes in reference_data.items()
+        for centile_line in sexes[sex][measurement_method]
+        if centile_line.get('data') or centile_line.get('x')
+    ]
+
+
+def test_removal_ranks_keep_corners_longest():
+    # a straight line with a single corner at x=2
+    ranks = removal_ranks([0, 1, 2, 3, 4], [0, 0, 0, 1, 2])
+
+    assert ranks[0] > ranks[2] and ranks[4] > ranks[2]
+    assert ranks[2] == max(ranks[1:4])
+
+
+def test_age_window_includes_a_point_either_side():
+    ages = [0.0, 1.0, 2.0, 3.0, 4.0]
+
+    assert list(age_window(ages, 1.5, 2.5)) == [1, 2, 3]
+    assert list(age_window(ages, 1.0, None)) == [1, 2, 3, 4]
+    assert list(age_window(ages, 5.0, 6.0)) == []
+
+
+def test_max_points_reduces_payload_and_keeps_chart_extent():
+    body = {"sex": "female", "measurement_method": "weight"}
+    full = client.post("/uk-who/chart-coordinates", json=body)
+    simplified = client.post("/uk-who/chart-coordinates", json={**body, "max_points": 20})
+
+    assert simplified.status_code == 200
+    assert len(simplified.content) * 10 < len(full.content)
+    full_lines = centile_lines(full.json(), 'female', 'weight')
+    simplified_lines = centile_lines(simplified.json(), 'female', 'weight')
+    assert len(full_lines) == len(simplified_lines)
+    for (reference, full_line), (_, simplified_line) in zip(full_lines, simplified_lines):
+        # every reference segment still starts and ends where it did, with a subset of its points
+        assert simplified_line['data'][0] == full_line['data'][0]
+        assert simplified_line['data'][-1] == full_line['data'][-1]
+        assert all(point in full_line['data'] for point in simplified_line['data'])
+    assert simplified.headers['etag'] != full.headers['etag']
+
+
+def test_age_window_of_custom_chart():
+    response = client.post("/turner/chart-coordinates", json={
+        "sex": "female", "measurement_method": "height", "centile_format": [3, 50, 97], "age_min": 5, "age_max": 10})
+
+    assert response.status_code == 200
+    for _, centile_line in centile_lines(response.json(), 'female', 'height'):
+        ages = [point['x'] for point in centile_line['data']]
+        # the point either side of the window is kept, so the line reaches the edges of the chart
+        assert ages[0] <= 5 < ages[1] and ages[-2] < 10 <= ages[-1]
+
+
+def test_age_max_must_follow_age_min():
+    response = client.post("/trisomy-21/chart-coordinates", json={
+        "sex": "male", "measurement_method": "height", "age_min": 4, "age_max": 2})
+
+    assert response.status_code == 422
+
+
+def test_columnar_format_matches_points():
+    body = {"sex": "male", "measurement_method": "height"}
+    points = client.post("/uk-who/chart-coordinates", json=body)
+    columnar = client.post("/uk-who/chart-coordinates", json={**body, "format": "columnar"})
+
+    assert columnar.status_code == 200
+    assert len(columnar.content) * 2 < len(points.content)
+    columnar_lines = centile_lines(columnar.json(), 'male', 'height')
+    point_lines = centile_lines(points.json(), 'male', 'height')
+    assert len(columnar_lines) == len(point_lines)
+    for (_, columnar_line), (_, point_line) in zip(columnar_lines, point_lines):
+        assert 'data' not in columnar_line
+        assert columnar_line['centile'] == point_line['centile']
+        assert {point['l'] for point in point_line['data']} == {columnar_line['l']}
+        assert columnar_line['x'] == [point['x'] for point in point_line['data']]
+        assert columnar_line['y'] == [point['y'] for point in point_line['data']]
+
+
+def test_columnar_format_at_a_level_of_detail():
+    body = {"sex": "female", "measurement_method": ["height", "weight"], "max_points": 20}
+    points = client.post("/trisomy-21/chart-coordinates", json=body)
+    columnar = client.post("/trisomy-21/chart-coordinates", json={**body, "format": "columnar"})
+
+    assert columnar.status_code == 200
+    for measurement_method in ["height", "weight"]:
+        for (_, columnar_line), (_, point_line) in zip(
+                centile_lines(columnar.json(), 'female', measurement_method), centile_lines(points.json(), 'female', measurement_method)):
+            assert columnar_line['x'] == [point['x'] for point in point_line['data']]
+    assert columnar.headers['etag'] != points.headers['etag']
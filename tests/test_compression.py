@@ -0,0 +1,102 @@
+"""
+Tests for response compression: negotiation, the compression middleware and precompressed chart responses
+"""
+
+# standard imports
+import gzip
+import json
+
+# third party imports
+import brotli
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.testclient import TestClient
+
+# local / rcpch imports
+from services.chart_store import CHART_DATA_DIRECTORY, ChartDataStore, chart_data_name, standard_chart_data_parameters
+from services.compression import BROTLI, GZIP, IDENTITY, CompressionMiddleware, negotiate_encoding, precompressed_path
+
+LARGE_CONTENT = [{"x": index, "y": index * 0.5, "l": "50"} for index in range(1000)]
+
+
+def compressing_app() -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, minimum_size=1000)
+
+    @app.get('/large')
+    def large():
+        return LARGE_CONTENT
+
+    @app.get('/small')
+    def small():
+        return {"detail": "small"}
+
+    @app.get('/stream')
+    def stream():
+        return StreamingResponse((f'{{"row":{row}}}\n' for row in range(100)), media_type='application/x-ndjson')
+
+    @app.get('/encoded')
+    def encoded():
+        return PlainTextResponse(gzip.compress(b'already compressed' * 100), headers={'Content-Encoding': 'gzip'})
+
+    return app
+
+
+client = TestClient(compressing_app())
+
+
+def test_negotiate_encoding():
+    assert negotiate_encoding('gzip, deflate, br') == BROTLI
+    assert negotiate_encoding('gzip') == GZIP
+    assert negotiate_encoding('br;q=0.5, gzip') == GZIP
+    assert negotiate_encoding('br;q=0, gzip;q=0') == IDENTITY
+    assert negotiate_encoding('') == IDENTITY
+
+
+def test_large_response_is_compressed_as_accepted():
+    for encoding, decompress in [(GZIP, gzip.decompress), (BROTLI, brotli.decompress)]:
+        response = client.get('/large', headers={'Accept-Encoding': encoding})
+
+        assert response.headers['content-encoding'] == encoding
+        assert response.headers['vary'] == 'Accept-Encoding'
+        assert int(response.headers['content-length']) == response.num_bytes_downloaded < len(response.content)
+        assert response.json() == LARGE_CONTENT
+
+    response = client.get('/large', headers={'Accept-Encoding': 'identity'})
+
+    assert 'content-encoding' not in response.headers
+    assert response.json() == LARGE_CONTENT
+
+
+def test_small_and_encoded_responses_are_sent_as_they_are():
+    response = client.get('/small', headers={'Accept-Encoding': 'gzip'})
+
+    assert 'content-encoding' not in response.headers
+    assert response.json() == {"detail": "small"}
+
+    response = client.get('/encoded', headers={'Accept-Encoding': 'br'})
+
+    assert response.headers['content-encoding'] == 'gzip'
+    assert response.text == 'already compressed' * 100
+
+
+def test_streamed_response_is_compressed_in_parts():
+    response = client.get('/stream', headers={'Accept-Encoding': 'br'})
+
+    assert response.headers['content-encoding'] == BROTLI
+    assert [json.loads(line)['row'] for line in response.text.splitlines()] == list(range(100))
+
+
+def test_chart_store_serves_precompressed_responses(tmp_path):
+    parameters = next(standard_chart_data_parameters())
+    name = chart_data_name(*parameters)
+    (tmp_path / f'{name}.json').write_bytes((CHART_DATA_DIRECTORY / f'{name}.json').read_bytes())
+    digest = ChartDataStore(tmp_path, memory_budget=100_000_000).get_response(*parameters).digest
+    # a marker in place of the compressed bytes, to show they are read from the file rather than compressed again
+    precompressed_path(tmp_path, name, digest, BROTLI).write_bytes(b'precompressed')
+    precompressed_path(tmp_path, name, 'out-of-date', GZIP).write_bytes(b'out of date')
+
+    prepared = ChartDataStore(tmp_path, memory_budget=100_000_000).get_response(*parameters)
+
+    assert prepared.encoded(BROTLI) == b'precompressed'
+    assert gzip.decompress(prepared.encoded(GZIP)) == prepared.body
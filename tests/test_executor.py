@@ -0,0 +1,104 @@
+"""
+Tests for the CPU executor used by the async routes
+"""
+
+# standard imports
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# third party imports
+import pytest
+
+# local / rcpch imports
+from rcpchgrowth import constants
+from services.chart_cache import custom_chart_body
+from services.executor import BoundedExecutor, ServerBusy, run_cpu_bound, shutdown_executors, warm_process
+
+
+def blocking_work(seconds):
+    time.sleep(seconds)
+    return threading.current_thread().name
+
+
+def test_cpu_bound_work_does_not_block_the_event_loop():
+    async def scenario():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticking = asyncio.create_task(ticker())
+        thread_name = await run_cpu_bound(blocking_work, 0.2)
+        ticking.cancel()
+        return thread_name, ticks
+
+    thread_name, ticks = asyncio.run(scenario())
+    shutdown_executors()
+
+    assert thread_name.startswith('cpu-bound')
+    # the event loop kept running while the work was done
+    assert ticks >= 5
+
+
+def test_saturated_executor_refuses_work_at_once():
+    executor = BoundedExecutor('test', lambda: ThreadPoolExecutor(max_workers=1), workers=1, max_pending=2)
+
+    async def scenario():
+        running = [asyncio.create_task(executor.run(blocking_work, 0.2)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        started = time.monotonic()
+        with pytest.raises(ServerBusy):
+            await executor.run(blocking_work, 0.2)
+        refused_in = time.monotonic() - started
+        await asyncio.gather(*running)
+        return refused_in
+
+    refused_in = asyncio.run(scenario())
+    executor.shutdown()
+
+    assert refused_in < 0.05
+    assert executor.rejected == 1
+    assert executor.pending == 0
+
+
+def test_shutdown_cancels_work_not_yet_started():
+    executor = BoundedExecutor('test', lambda: ThreadPoolExecutor(max_workers=1), workers=1, max_pending=2)
+
+    async def scenario():
+        running = asyncio.create_task(executor.run(blocking_work, 0.2))
+        queued = asyncio.create_task(executor.run(blocking_work, 0.2))
+        await asyncio.sleep(0.01)
+        executor.shutdown()
+        return await asyncio.gather(running, queued, return_exceptions=True)
+
+    running, queued = asyncio.run(scenario())
+
+    assert isinstance(running, str)
+    assert isinstance(queued, asyncio.CancelledError)
+    assert executor.pending == 0
+
+
+def test_process_pool_runs_custom_charts_in_warmed_processes():
+    executor = BoundedExecutor(
+        'process',
+        lambda: ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context('spawn'), initializer=warm_process),
+        workers=2,
+        max_pending=4
+    )
+    process_ids = executor.warm()
+
+    async def scenario():
+        return await executor.run(custom_chart_body, constants.UK_WHO, [50], constants.HEIGHT, constants.MALE, False)
+
+    body = asyncio.run(scenario())
+    executor.shutdown()
+
+    assert process_ids and os.getpid() not in process_ids
+    assert body == custom_chart_body(constants.UK_WHO, [50], constants.HEIGHT, constants.MALE, False)
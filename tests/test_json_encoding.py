@@ -0,0 +1,49 @@
+"""
+Tests for the pluggable JSON encoders
+"""
+
+# standard imports
+import json
+from datetime import date
+
+# third party imports
+import numpy as np
+import pytest
+
+# local / rcpch imports
+from services.json_encoding import ENCODERS, JSON, ORJSON, render_json
+
+CONTENT = {
+    "birth_data": {"birth_date": date(2020, 4, 12), "sex": "female"},
+    "sds": [np.float64(-2.406593606646068), 0.1, None, float('nan')],
+    "centile": np.float32(0.5),
+    "label": "0.4th – 2nd",
+}
+
+EXPECTED = {
+    "birth_data": {"birth_date": "2020-04-12", "sex": "female"},
+    "sds": [-2.406593606646068, 0.1, None, None],
+    "centile": 0.5,
+    "label": "0.4th – 2nd",
+}
+
+
+@pytest.mark.parametrize('encoder', sorted(ENCODERS))
+def test_encoders_write_the_same_json(encoder):
+    encoded = render_json(CONTENT, encoder=encoder)
+
+    assert json.loads(encoded) == EXPECTED
+    assert b' ' not in encoded.replace('0.4th – 2nd'.encode('utf-8'), b'')
+
+
+def test_orjson_matches_standard_library_bytes():
+    pytest.importorskip('orjson')
+    content = {"centile_data": [{"x": x, "y": x * 3.7, "l": "50"} for x in np.linspace(-0.3, 20, 500).tolist()]}
+
+    assert render_json(content, encoder=ORJSON) == render_json(content, encoder=JSON)
+
+
+def test_float_precision():
+    encoded = render_json({"values": [1.23456789, [2.00049]], "count": 3}, float_decimals=3)
+
+    assert encoded == b'{"values":[1.235,[2.0]],"count":3}'
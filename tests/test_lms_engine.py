@@ -0,0 +1,206 @@
+"""
+Tests for the vectorised LMS engine against the scalar rcpchgrowth calculations
+"""
+
+# standard imports
+import math
+from datetime import date, timedelta
+
+# third party imports
+import numpy as np
+import pytest
+
+# local / rcpch imports
+from rcpchgrowth import Measurement, constants, create_chart, global_functions, sds_for_measurement
+from services import lms_engine
+from services.lms_engine import centiles_for_sds, create_uk_who_chart, measurements_for_sds, reference_age_limits, sds_for_measurements
+
+TOLERANCE = 1e-9
+
+OBSERVATION_RANGES = {
+    constants.HEIGHT: (40, 180),
+    constants.WEIGHT: (2, 80),
+    constants.HEAD_CIRCUMFERENCE: (30, 58),
+    constants.BMI: (12, 30),
+}
+
+
+def scalar_sds(reference, age, measurement_method, observation_value, sex):
+    try:
+        return sds_for_measurement(reference=reference, age=age, measurement_method=measurement_method, observation_value=observation_value, sex=sex)
+    except LookupError:
+        return None
+
+
+@pytest.mark.parametrize("reference", [constants.UK_WHO, constants.TURNERS, constants.TRISOMY_21])
+def test_vectorised_sds_matches_scalar_sds(reference):
+    random = np.random.default_rng(seed=21)
+
+    for sex in constants.SEXES:
+        for measurement_method in constants.MEASUREMENT_METHODS:
+            limits = reference_age_limits(reference, sex, measurement_method)
+            if limits is None:
+                continue
+            # random ages, plus the ages at the edges and joins of the reference data
+            ages = np.concatenate([random.uniform(limits[0], limits[1], 200), [limits[0], limits[1], 2.0, 4.0]])
+            ages = ages[(ages >= limits[0]) & (ages <= limits[1])]
+            observation_values = random.uniform(*OBSERVATION_RANGES[measurement_method], len(ages))
+
+            sds = sds_for_measurements(reference, ages, [sex] * len(ages), [measurement_method] * len(ages), observation_values)
+
+            for age, observation_value, vectorised in zip(ages, observation_values, sds):
+                expected = scalar_sds(reference, float(age), measurement_method, float(observation_value), sex)
+                assert expected is not None
+                assert abs(vectorised - expected) < TOLERANCE
+
+
+def test_vectorised_sds_is_nan_without_reference_data():
+    sds = sds_for_measurements(
+        constants.UK_WHO,
+        ages=[21.0, 18.5, -0.3, 0.01],
+        sexes=[constants.MALE, constants.MALE, constants.FEMALE, constants.FEMALE],
+        measurement_methods=[constants.HEIGHT, constants.HEAD_CIRCUMFERENCE, constants.HEIGHT, constants.BMI],
+        observation_values=[180, 58, 30, 14]
+    )
+
+    assert np.isnan(sds).all()
+
+    sds = sds_for_measurements(constants.TURNERS, ages=[10.0], sexes=[constants.MALE], measurement_methods=[constants.HEIGHT], observation_values=[130])
+
+    assert np.isnan(sds).all()
+
+
+def test_vectorised_centiles_match_measurement():
+    observations = [
+        (date(2020, 4, 12), date(2028, 6, 12), constants.HEIGHT, 115, constants.FEMALE),
+        (date(2020, 4, 12), date(2021, 4, 12), constants.WEIGHT, 9.2, constants.FEMALE),
+        (date(2019, 1, 1), date(2020, 2, 3), constants.HEAD_CIRCUMFERENCE, 47.1, constants.MALE),
+        (date(2012, 6, 30), date(2024, 1, 15), constants.BMI, 19.4, constants.MALE),
+    ]
+
+    for birth_date, observation_date, measurement_method, observation_value, sex in observations:
+        measurement = Measurement(
+            reference=constants.UK_WHO,
+            birth_date=birth_date,
+            observation_date=observation_date,
+            measurement_method=measurement_method,
+            observation_value=observation_value,
+            sex=sex,
+            gestation_weeks=40,
+            gestation_days=0
+        ).measurement
+        age = measurement['measurement_dates']['chronological_decimal_age']
+        expected = measurement['measurement_calculated_values']
+
+        sds = sds_for_measurements(constants.UK_WHO, [age], [sex], [measurement_method], [observation_value])
+        centiles = centiles_for_sds(sds)
+
+        assert math.isclose(sds[0], expected['chronological_sds'], abs_tol=TOLERANCE)
+        assert math.isclose(centiles[0], expected['chronological_centile'], abs_tol=TOLERANCE)
+
+
+@pytest.mark.parametrize("measurement_method", [constants.HEIGHT, constants.BMI])
+def test_vectorised_chart_matches_create_chart(measurement_method):
+    centiles = [0.4, 37.2, 50, 99.6]
+
+    expected = create_chart(constants.UK_WHO, centiles, measurement_method=measurement_method, sex=constants.FEMALE)
+    chart = create_uk_who_chart(measurement_method, constants.FEMALE, centiles)
+
+    assert chart == expected
+
+
+def fetch_lms_or_error(fetch_lms, age: float, lms_array: list):
+    try:
+        return fetch_lms(age=age, lms_value_array_for_measurement=lms_array)
+    except Exception as error:
+        return error
+
+
+@pytest.mark.parametrize("reference", [constants.UK_WHO, constants.TURNERS, constants.TRISOMY_21])
+def test_indexed_lms_lookup_is_identical_to_rcpchgrowth(reference, monkeypatch):
+    monkeypatch.setattr(global_functions, 'fetch_lms', lms_engine._rcpchgrowth_fetch_lms)
+    lms_engine.install_lms_index()
+    random = np.random.default_rng(seed=13)
+
+    for segment, _, _, _, reference_data in lms_engine.REFERENCE_SEGMENTS[reference]:
+        for measurement_method, sexes in reference_data['measurement'].items():
+            for sex, lms_array in sexes.items():
+                if not lms_array or lms_array[0]['L'] == '':
+                    continue
+                reference_ages = [item['decimal_age'] for item in lms_array]
+                # random ages, every reference age, and ages just either side of them
+                ages = random.uniform(reference_ages[0], reference_ages[-1], 50).tolist()
+                ages += reference_ages + [age + 0.00004 for age in reference_ages[:-1]] + [age - 0.003 for age in reference_ages[1:]]
+                # rcpchgrowth cannot interpolate before the first reference age (other than to 4 decimal places)
+                for age in [reference_ages[0] - 0.00004, reference_ages[0] - 0.003, reference_ages[0] - 1]:
+                    expected = fetch_lms_or_error(lms_engine._rcpchgrowth_fetch_lms, age, lms_array)
+                    indexed = fetch_lms_or_error(global_functions.fetch_lms, age, lms_array)
+                    assert repr(indexed) == repr(expected)
+                for age in ages:
+                    expected = lms_engine._rcpchgrowth_fetch_lms(age=age, lms_value_array_for_measurement=lms_array)
+                    indexed = global_functions.fetch_lms(age=age, lms_value_array_for_measurement=lms_array)
+                    assert [float(indexed[key]) for key in 'lms'] == [float(expected[key]) for key in 'lms']
+                    # the types matter too: later arithmetic on NumPy values can differ from that on floats in the last place
+                    assert [type(indexed[key]) for key in 'lms'] == [type(expected[key]) for key in 'lms']
+
+
+def random_measurements(count: int, seed: int) -> list:
+    random = np.random.default_rng(seed)
+    measurements = [
+        # measurements once differing in the last place, at the edges of reference data sets
+        dict(reference=constants.TRISOMY_21, sex=constants.MALE, measurement_method=constants.BMI, birth_date=date(2000, 11, 16),
+             observation_date=date(2000, 12, 3), observation_value=23.933883324910834, gestation_weeks=33, gestation_days=2),
+        dict(reference=constants.UK_WHO, sex=constants.FEMALE, measurement_method=constants.WEIGHT, birth_date=date(2005, 12, 31),
+             observation_date=date(2009, 12, 11), observation_value=21.592514450948563, gestation_weeks=33, gestation_days=0),
+        dict(reference=constants.UK_WHO, sex=constants.FEMALE, measurement_method=constants.BMI, birth_date=date(2007, 8, 18),
+             observation_date=date(2011, 8, 22), observation_value=14.355303041605536, gestation_weeks=37, gestation_days=0),
+    ]
+    for _ in range(count):
+        reference = random.choice([constants.UK_WHO, constants.TURNERS, constants.TRISOMY_21])
+        sex = constants.FEMALE if reference == constants.TURNERS else random.choice(constants.SEXES)
+        measurement_method = constants.HEIGHT if reference == constants.TURNERS else random.choice(constants.MEASUREMENT_METHODS)
+        birth_date = date(2000, 1, 1) + timedelta(days=int(random.integers(0, 3000)))
+        measurements.append(dict(
+            reference=reference, sex=sex, measurement_method=measurement_method, birth_date=birth_date,
+            observation_date=birth_date + timedelta(days=int(random.integers(1, 18 * 365))),
+            observation_value=float(random.uniform(*OBSERVATION_RANGES[measurement_method])),
+            gestation_weeks=int(random.integers(24, 43)), gestation_days=int(random.integers(0, 7))))
+    return measurements
+
+
+def measurement_results(measurements: list) -> list:
+    results = []
+    for measurement in measurements:
+        try:
+            results.append(repr(Measurement(**measurement).measurement))
+        except Exception as error:
+            results.append(repr(error))
+    return results
+
+
+def test_measurements_with_indexed_lms_lookup_are_identical_to_rcpchgrowth(monkeypatch):
+    measurements = random_measurements(500, seed=7)
+    monkeypatch.setattr(global_functions, 'fetch_lms', lms_engine._rcpchgrowth_fetch_lms)
+    expected = measurement_results(measurements)
+
+    lms_engine.install_lms_index()
+
+    assert measurement_results(measurements) == expected
+
+
+@pytest.mark.parametrize('reference', [constants.UK_WHO, constants.TURNERS, constants.TRISOMY_21])
+def test_vectorised_measurements_match_measurement_from_sds(reference):
+    random = np.random.default_rng(16)
+    for sex in constants.SEXES:
+        for measurement_method in constants.MEASUREMENT_METHODS:
+            limits = reference_age_limits(reference, sex, measurement_method)
+            if limits is None:
+                continue
+            ages = random.uniform(max(limits[0], 0.0), limits[1], 20)
+            sds = random.normal(0, 1.5, 20)
+            measurements = measurements_for_sds(reference, ages, [sex] * 20, [measurement_method] * 20, sds)
+            for age, requested_sds, measurement in zip(ages, sds, measurements):
+                expected = global_functions.measurement_from_sds(
+                    reference=reference, requested_sds=requested_sds, measurement_method=measurement_method, sex=sex, age=age)
+                # rcpchgrowth rounds measurements to 4 decimal places
+                assert measurement == pytest.approx(expected, abs=0.00005 + TOLERANCE)
@@ -0,0 +1,85 @@
+"""
+Tests for the Prometheus metrics endpoint
+"""
+
+# standard imports
+import os
+import subprocess
+import sys
+
+# third party imports
+from fastapi.testclient import TestClient
+from prometheus_client import CONTENT_TYPE_LATEST
+from prometheus_client.parser import text_string_to_metric_families
+
+# local / rcpch imports
+from main import app
+from services.metrics import metrics_response
+
+client = TestClient(app)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def sample_values(text: str) -> dict:
+    """Returns {(sample name, sorted labels): value} for every sample in the exposition text"""
+    return {
+        (sample.name, tuple(sorted(sample.labels.items()))): sample.value
+        for family in text_string_to_metric_families(text)
+        for sample in family.samples
+    }
+
+
+def metric(name: str, **labels) -> float:
+    return sample_values(client.get('/metrics').text).get((name, tuple(sorted(labels.items()))), 0.0)
+
+
+def test_metrics_count_requests_by_route_and_reference():
+    labels = {"method": "POST", "route": "/turner/chart-coordinates", "reference": "turners-syndrome"}
+    before = metric('growth_api_requests_total', status='200', **labels)
+
+    response = client.post('/turner/chart-coordinates', json={"sex": "female", "measurement_method": "height"})
+
+    assert response.status_code == 200
+    assert metric('growth_api_requests_total', status='200', **labels) == before + 1
+    assert metric('growth_api_request_duration_seconds_count', **labels) >= 1
+    assert client.get('/metrics').headers['content-type'] == CONTENT_TYPE_LATEST
+
+
+def test_metrics_count_chart_cache_results_and_create_chart_duration():
+    body = {"sex": "female", "measurement_method": "height", "centile_format": [3.3]}
+    misses = metric('growth_api_chart_cache_requests_total', result='miss')
+    hits = metric('growth_api_chart_cache_requests_total', result='hit')
+    charts_created = metric('growth_api_create_chart_duration_seconds_count', reference='turners-syndrome')
+
+    client.post('/turner/chart-coordinates', json=body)
+    client.post('/turner/chart-coordinates', json=body)
+
+    assert metric('growth_api_chart_cache_requests_total', result='miss') == misses + 1
+    assert metric('growth_api_chart_cache_requests_total', result='hit') == hits + 1
+    assert metric('growth_api_create_chart_duration_seconds_count', reference='turners-syndrome') == charts_created + 1
+
+
+def test_metrics_count_errors_by_type():
+    before = metric('growth_api_errors_total', route='/uk-who/chart-coordinates', type='RequestValidationError')
+
+    response = client.post('/uk-who/chart-coordinates', json={"sex": "other", "measurement_method": "height"})
+
+    assert response.status_code == 422
+    assert metric('growth_api_errors_total', route='/uk-who/chart-coordinates', type='RequestValidationError') == before + 1
+
+
+def test_metrics_are_added_up_across_worker_processes(tmp_path):
+    # each process writes its own metrics files to the multiprocess directory, as gunicorn workers do
+    count_requests = (
+        "from services.metrics import requests_total; "
+        "requests_total.labels(method='POST', route='/uk-who/calculation', reference='uk-who', status='200').inc(3)"
+    )
+    environment = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": str(tmp_path)}
+    for _ in range(2):
+        subprocess.run([sys.executable, '-c', count_requests], cwd=ROOT, env=environment, check=True)
+
+    values = sample_values(metrics_response(str(tmp_path)).body.decode('utf-8'))
+
+    labels = (('method', 'POST'), ('reference', 'uk-who'), ('route', '/uk-who/calculation'), ('status', '200'))
+    assert values[('growth_api_requests_total', labels)] == 6
@@ -0,0 +1,57 @@
+"""
+Tests for the memory-mapped chart store shared by workers
+"""
+
+# standard imports
+import json
+
+# local / rcpch imports
+from rcpchgrowth import constants
+from services.chart_store import CHART_DATA_DIRECTORY, ChartDataStore, chart_data_name, standard_chart_data_parameters
+from services.compression import GZIP, compress
+from services.shared_chart_store import SHARED_CHART_STORE_NAME, write_shared_chart_store
+
+
+def write_store(directory, parameters):
+    chart_data_sets = {}
+    for chart_parameters in parameters:
+        name = chart_data_name(*chart_parameters)
+        with open(CHART_DATA_DIRECTORY / f'{name}.json', 'r') as file:
+            chart_data_sets[name] = json.load(file)
+        (directory / f'{name}.json').write_text(json.dumps(chart_data_sets[name]))
+    write_shared_chart_store(directory / SHARED_CHART_STORE_NAME, chart_data_sets)
+
+
+def test_shared_chart_store_serves_the_same_responses(tmp_path):
+    parameters = list(standard_chart_data_parameters())[:3]
+    write_store(tmp_path, parameters)
+
+    json_store = ChartDataStore(tmp_path, memory_budget=100_000_000)
+    shared_store = ChartDataStore(tmp_path, memory_budget=100_000_000, data_format='mmap')
+
+    for chart_parameters in parameters:
+        expected = json_store.get_response(*chart_parameters)
+        prepared = shared_store.get_response(*chart_parameters)
+        assert prepared.body == expected.body
+        assert prepared.etag() == expected.etag()
+        assert prepared.encoded(GZIP) == compress(expected.body, GZIP)
+        assert shared_store.get(*chart_parameters) == json_store.get(*chart_parameters)
+
+    assert shared_store.get_response(constants.THREE_PERCENT_CENTILES, constants.TURNERS, constants.FEMALE, constants.HEIGHT) is None
+
+
+
+def test_encodings_not_in_the_shared_chart_store_are_compressed_once(tmp_path, monkeypatch):
+    from services import shared_chart_store
+    parameters = list(standard_chart_data_parameters())[:1]
+    monkeypatch.setattr(shared_chart_store, 'available_encodings', lambda: [])
+    write_store(tmp_path, parameters)
+    compressed = []
+    monkeypatch.setattr(shared_chart_store, 'compress', lambda body, encoding: compressed.append(encoding) or compress(body, encoding))
+
+    shared_store = ChartDataStore(tmp_path, memory_budget=100_000_000, data_format='mmap')
+    first = shared_store.get_response(*parameters[0]).encoded(GZIP)
+    second = shared_store.get_response(*parameters[0]).encoded(GZIP)
+
+    assert first == second == compress(shared_store.get_response(*parameters[0]).body, GZIP)
+    assert compressed == [GZIP]
@@ -0,0 +1,93 @@
+"""
+Tests that trusted output is byte for byte the response the validated response models give
+"""
+
+# standard imports
+from typing import List
+
+# third party imports
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+# local / rcpch imports
+from rcpchgrowth import constants, create_chart
+from schemas import BulkCalculationResponse, Centile_Data, MeasurementBatchItem, MeasurementObject, MeasurementRequest
+from services import settings
+from services.calculations import bulk_calculation, calculate_measurement
+from services.chart_responses import prepare_chart_response
+from services.json_encoding import FastJSONResponse, render_json
+from services.trusted_output import trusted_content, trusted_response
+from schemas import BulkCalculationRequest
+
+
+def documented_measurement(observation_value: float, gestation_weeks: int) -> dict:
+    """
+    A measurement from rcpchgrowth, with the plottable data fields the response model requires
+    which this version of rcpchgrowth does not return
+    """
+    measurement = calculate_measurement(constants.UK_WHO, MeasurementRequest(
+        birth_date='2020-04-12',
+        observation_date='2021-06-12',
+        observation_value=observation_value,
+        sex='female',
+        gestation_weeks=gestation_weeks,
+        gestation_days=3,
+        measurement_method='weight',
+        events_text=['Started solids']))
+    for data in measurement['plottable_data'].values():
+        for age_data in data.values():
+            age_data.setdefault('sds', age_data['y'])
+            age_data.setdefault('observation_error', None)
+    return measurement
+
+
+def validated_and_trusted_bytes(response_model, content) -> tuple:
+    app = FastAPI(default_response_class=FastJSONResponse)
+
+    @app.get('/validated', response_model=response_model)
+    def validated():
+        return content
+
+    @app.get('/trusted', response_model=response_model)
+    def trusted():
+        return trusted_response(response_model, content)
+
+    client = TestClient(app)
+    validated_response = client.get('/validated')
+    trusted_response_ = client.get('/trusted')
+    assert validated_response.status_code == trusted_response_.status_code == 200
+    assert trusted_response_.headers['content-type'] == validated_response.headers['content-type']
+    return validated_response.content, trusted_response_.content
+
+
+@pytest.mark.parametrize('response_model, content', [
+    (MeasurementObject, documented_measurement(9.2, 40)),
+    (List[MeasurementBatchItem], [
+        {"measurement": documented_measurement(7.5, 30), "error": None},
+        {"measurement": None, "error": "observation_value: Field required"},
+    ]),
+    (BulkCalculationResponse, bulk_calculation(constants.UK_WHO, BulkCalculationRequest(
+        decimal_ages=[0.5, 4.0, 30.0],
+        sexes=['male', 'female', 'male'],
+        measurement_methods=['height', 'bmi', 'weight'],
+        observation_values=[67.0, 15.5, 70.0]))),
+])
+def test_trusted_output_matches_validated_output(response_model, content):
+    assert settings.trusted_output
+    validated, trusted = validated_and_trusted_bytes(response_model, content)
+
+    assert trusted == validated
+
+
+def test_trusted_output_matches_prepared_chart_coordinates():
+    chart_data = create_chart(constants.TRISOMY_21, [2, 50, 98], measurement_method=constants.WEIGHT, sex=constants.FEMALE)
+
+    assert render_json(trusted_content(Centile_Data, {"centile_data": chart_data})) == prepare_chart_response(chart_data).body
+
+
+def test_validated_output_when_trusted_output_is_off(monkeypatch):
+    monkeypatch.setattr(settings, 'trusted_output', False)
+    content = {"sds": [1.0], "centiles": [84.1]}
+
+    assert trusted_response(BulkCalculationResponse, content) is content
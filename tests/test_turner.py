@@ -113,6 +113,18 @@ def test_turner_chart_data_with_invalid_request():
     assert validation_errors['measurement_method']['msg'] == "unexpected value; permitted: 'height', 'weight', 'ofc', 'bmi'"
     
 
+def test_turner_chart_data_only_for_height_in_girls():
+    for body in [
+        {"sex": ["female", "male"], "measurement_method": "height"},
+        {"sex": "female", "measurement_method": ["height", "weight"]},
+        {"sex": "male", "measurement_method": "height"},
+    ]:
+        response = client.post("/turner/chart-coordinates", json=body)
+
+        assert response.status_code == 422
+        assert response.json()['detail'] == "Turner data only exists for height in girls."
+
+
 def test_turner_fictional_child_data_with_valid_request():
 
     body = {
@@ -3,6 +3,8 @@ Tests for the UK-WHO endpoints
 """
 
 # standard imports
+import csv
+import io
 import json
 import hashlib
 
@@ -74,6 +76,134 @@ def test_ukwho_calculation_with_invalid_request():
     assert validation_errors['sex']['msg'] == "unexpected value; permitted: 'male', 'female'"
 
 
+def test_ukwho_calculations_report_errors_inline():
+
+    # each invalid row is reported in place, without failing the batch
+    body = [
+        {
+            "birth_date": "2020-04-12",
+            "observation_date": "2028-06-12",
+            "observation_value": 115,
+            "sex": "invalid_sex",
+            "measurement_method": "height"
+        },
+        {
+            "birth_date": "2020-04-12",
+            "observation_date": "2028-06-12",
+            "observation_value": "invalid_observation_value",
+            "sex": "female",
+            "measurement_method": "height"
+        }
+    ]
+
+    response = client.post("/uk-who/calculations", json=body)
+
+    assert response.status_code == 200
+
+    results = response.json()
+    assert len(results) == 2
+    assert results[0]['measurement'] is None
+    assert results[0]['error'].startswith("sex:")
+    assert results[1]['measurement'] is None
+    assert results[1]['error'].startswith("observation_value:")
+
+
+def test_ukwho_calculations_with_oversized_batch():
+
+    body = [{}] * 501
+
+    response = client.post("/uk-who/calculations", json=body)
+
+    assert response.status_code == 422
+
+
+def test_ukwho_calculations_document_their_items():
+    # items are validated one at a time, but documented as measurement requests
+    request_body = app.openapi()['paths']['/uk-who/calculations']['post']['requestBody']
+
+    assert request_body['content']['application/json']['schema']['items'] == {'$ref': '#/components/schemas/MeasurementRequest'}
+
+def test_ukwho_calculations_stream_csv():
+
+    body = (
+        "birth_date,observation_date,observation_value,sex,measurement_method\n"
+        "2020-04-12,2028-06-12,115,female,height\n"
+        "2020-04-12,2028-06-12,115,invalid_sex,height\n"
+    )
+
+    response = client.post("/uk-who/calculations/stream", content=body, headers={"Content-Type": "text/csv"})
+
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith("text/csv")
+
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert len(rows) == 2
+
+    # the first row should match the single calculation endpoint
+    with open(r'tests/test_data/test_ukwho_calculation_valid.json', 'r') as file:
+        calculation = json.loads(file.read())
+    assert float(rows[0]['chronological_sds']) == calculation['measurement_calculated_values']['chronological_sds']
+    assert rows[0]['error'] == ""
+
+    # the second row should carry its error, without stopping the stream
+    assert rows[1]['chronological_sds'] == ""
+    assert rows[1]['error'].startswith("sex:")
+
+
+def test_ukwho_calculations_stream_continues_past_unreadable_rows():
+
+    body = (
+        b'{"birth_date": "2020-04-12", "observation_date": "2028-06-12", "observation_value": 115, "sex": "female", "measurement_method": "height"}\n'
+        b'\xff\xfe not utf-8\n'
+        b'{"birth_date": "2020-04-12", "observation_date": "2028-06-12", "observation_value": 115, "sex": "female", "measurement_method": "height"}\n'
+    )
+
+    response = client.post("/uk-who/calculations/stream", content=body, headers={"Content-Type": "application/x-ndjson"})
+
+    assert response.status_code == 200
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert len(rows) == 3
+    assert rows[0]['error'] is None
+    assert rows[1]['measurement'] is None
+    assert rows[1]['error'].startswith("Row could not be parsed:")
+    assert rows[2]['error'] is None
+
+
+def test_ukwho_calculations_stream_with_unreadable_csv_header():
+
+    body = (
+        b"birth_date,observation_date,\xff,sex,measurement_method\n"
+        b"2020-04-12,2028-06-12,115,female,height\n"
+        b"2020-04-12,2028-06-12,116,female,height\n"
+    )
+
+    response = client.post("/uk-who/calculations/stream", content=body, headers={"Content-Type": "text/csv"})
+
+    assert response.status_code == 200
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    # no row is taken as the header: each carries the header's error
+    assert [row['row'] for row in rows] == ['1', '2']
+    assert all(row['error'].startswith("Row could not be parsed: the CSV header could not be parsed") for row in rows)
+
+def test_ukwho_calculations_stream_continues_when_server_busy(monkeypatch):
+    from services.executor import thread_executor
+    monkeypatch.setattr(thread_executor, 'max_pending', 0)
+
+    body = (
+        "birth_date,observation_date,observation_value,sex,measurement_method\n"
+        "2020-04-12,2028-06-12,115,female,height\n"
+        "2020-04-12,2028-06-12,116,female,height\n"
+    )
+
+    response = client.post("/uk-who/calculations/stream", content=body, headers={"Content-Type": "text/csv"})
+
+    assert response.status_code == 200
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [row['row'] for row in rows] == ['1', '2']
+    assert all(row['error'].startswith("Row could not be calculated:") for row in rows)
+    assert rows[1]['observation_value'] == '116'
+
+
 def test_ukwho_chart_data_with_valid_request():
     body = {
         "measurement_method": "height",
@@ -104,6 +234,60 @@ def test_ukwho_chart_data_with_valid_request():
     # other chart data responses (female/male and weight/bmi/ofc)
 
 
+def test_ukwho_chart_data_etag_returns_not_modified():
+    body = {
+        "measurement_method": "height",
+        "sex": "male",
+        "centile_format": "cole-nine-centiles",
+        "is_sds": False
+    }
+
+    response = client.post("/uk-who/chart-coordinates", json=body)
+
+    assert response.status_code == 200
+    etag = response.headers['etag']
+
+    # the same chart, requested again with its ETag, should not be sent again
+    response = client.post("/uk-who/chart-coordinates", json=body, headers={"If-None-Match": etag})
+
+    assert response.status_code == 304
+    assert response.content == b''
+
+    # a different chart has a different ETag
+    body["measurement_method"] = "weight"
+    response = client.post("/uk-who/chart-coordinates", json=body, headers={"If-None-Match": etag})
+
+    assert response.status_code == 200
+    assert response.headers['etag'] != etag
+
+
+def test_ukwho_chart_data_for_several_measurement_methods_and_sexes():
+    measurement_methods = ["height", "weight", "bmi", "ofc"]
+    body = {
+        "measurement_method": measurement_methods,
+        "sex": ["male", "female"]
+    }
+
+    response = client.post("/uk-who/chart-coordinates", json=body)
+
+    assert response.status_code == 200
+    combined = response.json()['centile_data']
+
+    # each chart is in the combined response, as it is when requested alone
+    for sex in body["sex"]:
+        for measurement_method in measurement_methods:
+            single = client.post("/uk-who/chart-coordinates", json={"measurement_method": measurement_method, "sex": sex}).json()['centile_data']
+            assert len(single) == len(combined)
+            for single_reference, combined_reference in zip(single, combined):
+                for reference, sexes in single_reference.items():
+                    assert combined_reference[reference][sex][measurement_method] == sexes[sex][measurement_method]
+
+    # the combined response is cached, with its own ETag
+    response = client.post("/uk-who/chart-coordinates", json=body, headers={"If-None-Match": response.headers['etag']})
+
+    assert response.status_code == 304
+
+
 def test_ukwho_chart_data_with_invalid_request():
     body={
             "measurement_method": "invalid_measurement_method",
@@ -195,3 +379,64 @@ def test_ukwho_fictional_child_data_with_invalid_request():
     assert validation_errors['noise']['msg'] == "value could not be parsed to a boolean"
     assert validation_errors['noise_range']['msg'] == "value is not a valid float"
     assert validation_errors['reference']['msg'] == "unexpected value; permitted: 'uk-who', 'trisomy-21', 'turners-syndrome'"
+
+
+def test_ukwho_custom_chart_refused_when_server_busy(monkeypatch):
+    from services.executor import thread_executor
+    monkeypatch.setattr(thread_executor, 'max_pending', 0)
+
+    body = {"sex": "female", "measurement_method": "weight", "centile_format": [1.5, 98.5]}
+    response = client.post("/uk-who/chart-coordinates", json=body)
+
+    assert response.status_code == 503
+    assert response.headers['retry-after'] == '1'
+
+
+def test_ukwho_fictional_cohort_is_streamed_and_reproducible():
+    body = {
+        "number_of_children": 25,
+        "seed": 16,
+        "measurement_method": "weight",
+        "end_age": 5,
+        "measurement_interval_type": "months",
+        "measurement_interval_number": 6,
+        "drift_sd": 0.5,
+        "noise_range_max": 0.02
+    }
+    response = client.post("/uk-who/fictional-cohort-data", json=body)
+
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('application/x-ndjson')
+    children = [json.loads(line) for line in response.text.splitlines()]
+    assert [child['child'] for child in children] == list(range(25))
+    assert {child['sex'] for child in children} == {'male', 'female'}
+    assert all(len(child['measurements']) == 10 for child in children)
+    assert all(-5 < measurement['sds'] < 5 for child in children for measurement in child['measurements'])
+
+    # the same seed gives the same cohort
+    assert client.post("/uk-who/fictional-cohort-data", json=body).text == response.text
+    assert client.post("/uk-who/fictional-cohort-data", json={**body, "seed": 17}).text != response.text
+
+
+def test_ukwho_fictional_cohort_refuses_null_parameters():
+    for field in ["drift_sd", "start_sds_sd", "end_age", "measurement_interval_type"]:
+        body = {"number_of_children": 2, "measurement_method": "height", field: None}
+
+        response = client.post("/uk-who/fictional-cohort-data", json=body)
+
+        assert response.status_code == 422
+
+
+def test_ukwho_fictional_cohort_chunks_are_bounded_by_measurements(monkeypatch):
+    from services import fictional_cohort
+    from schemas import FictionalCohortRequest
+
+    daily = FictionalCohortRequest(measurement_method="height", measurement_interval_type="days", measurement_interval_number=1)
+    assert fictional_cohort.children_per_chunk(daily) == fictional_cohort.CHUNK_MEASUREMENTS // 7305
+
+    # a chunk of two children, each measured ten times
+    monkeypatch.setattr(fictional_cohort, 'CHUNK_MEASUREMENTS', 25)
+    body = {"number_of_children": 5, "measurement_method": "weight", "end_age": 5, "measurement_interval_number": 6}
+    children = [json.loads(line) for line in client.post("/uk-who/fictional-cohort-data", json=body).text.splitlines()]
+    assert [child['child'] for child in children] == list(range(5))
+    assert all(len(child['measurements']) == 10 for child in children)
@@ -0,0 +1,25 @@
+"""
+Tests for the utilities endpoints
+"""
+
+# third party imports
+from fastapi.testclient import TestClient
+
+# local / rcpch imports
+from main import app
+
+client = TestClient(app)
+
+
+def test_mid_parental_height_centile_lines_match_its_centile():
+    # heights which round differently to the nearest millimetre should not share centile lines
+    for height_paternal, height_maternal in [(180.04, 165.04), (180.0, 165.0)]:
+        body = {"height_paternal": height_paternal, "height_maternal": height_maternal, "sex": "male"}
+
+        response = client.post("/utilities/mid-parental-height", json=body)
+
+        assert response.status_code == 200
+        result = response.json()
+        for reference_data in result['mid_parental_height_centile_data']:
+            for sexes in reference_data.values():
+                assert sexes['male']['height'][0]['centile'] == result['mid_parental_height_centile']